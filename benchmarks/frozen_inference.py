@@ -0,0 +1,114 @@
+"""Benchmark a frozen graph against restoring the training checkpoint.
+
+A checkpoint with random weights is written for the chosen model, then we
+report the cold start time (build/restore or load, plus the first batch) and
+the per-batch latency of the model's ``restore()``, of a warm ``Embedder`` and
+of ``FrozenEmbedder``. ``restore()`` builds the graph and restores the checkpoint
+at every call, so its cold start is a call with one enroll and one test batch,
+and its latency the extra time per test batch::
+
+    python benchmarks/frozen_inference.py --model ctdnn --batches 50 --threads 4
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import tensorflow as tf
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pyasv import Config
+from pyasv.data_manage import DataManage
+from pyasv.engine import Trainer
+from pyasv.inference import FrozenEmbedder
+from pyasv.model.ctdnn import CTDnnEmbedder
+from pyasv.model.deep_speaker import DeepSpeakerEmbedder
+from pyasv.model.max_feature_map_dnn_model import MaxFeatureMapDnnEmbedder
+
+EMBEDDERS = {'ctdnn': CTDnnEmbedder, 'deep_speaker': DeepSpeakerEmbedder, 'mfm': MaxFeatureMapDnnEmbedder}
+
+
+def _random_checkpoint(embedder_class, config):
+    with tf.Graph().as_default():
+        x = tf.placeholder(tf.float32, [None] + list(embedder_class.frame_shape))
+        embedder_class.model_class(config, x)
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            tf.train.Saver().save(sess, os.path.join(config.SAVE_PATH, config.MODEL_NAME + ".ckpt"))
+
+
+def _latency(embedder, frames, n_batches):
+    embedder.embed(frames)
+    start = time.time()
+    for _ in range(n_batches):
+        embedder.embed(frames)
+    return (time.time() - start) / n_batches
+
+
+def _restore_timing(model_class, config, frames, n_batches):
+    labels = np.arange(len(frames)) % config.N_SPEAKER
+    enroll = DataManage(frames, labels, config)
+    timings = []
+    for n in (1, n_batches + 1):
+        test = DataManage(np.concatenate([frames] * n, 0), np.concatenate([labels] * n, 0), config)
+        start = time.time()
+        Trainer(model_class, config).restore(enroll, test, output='npy')
+        timings.append(time.time() - start)
+    return timings[0], (timings[1] - timings[0]) / n_batches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--model', choices=sorted(EMBEDDERS), default='ctdnn')
+    parser.add_argument('--batch-size', type=int, default=128)
+    parser.add_argument('--batches', type=int, default=50)
+    parser.add_argument('--speakers', type=int, default=100)
+    parser.add_argument('--threads', type=int, default=0)
+    args = parser.parse_args()
+
+    embedder_class = EMBEDDERS[args.model]
+    root = tempfile.mkdtemp()
+    try:
+        config = Config(name=args.model, n_speaker=args.speakers, batch_size=args.batch_size, n_gpu=0,
+                        max_step=1, is_big_dataset=False, learning_rate=0.001, save_path=root,
+                        conv_weight_decay=0.0, fc_weight_decay=0.0, bn_epsilon=1e-3,
+                        deep_speaker_out_channel=[64, 128, 256, 512])
+        _random_checkpoint(embedder_class, config)
+        frames = np.random.randn(args.batch_size, *embedder_class.frame_shape).astype(np.float32)
+        restore_cold, restore_latency = _restore_timing(embedder_class.model_class, config, frames,
+                                                        args.batches)
+
+        start = time.time()
+        embedder = embedder_class(config, intra_op_threads=args.threads, inter_op_threads=args.threads)
+        embedder.embed(frames)
+        embedder_cold = time.time() - start
+        export_path = os.path.join(root, 'frozen')
+        embedder.export(export_path)
+        embedder_latency = _latency(embedder, frames, args.batches)
+        reference = embedder.embed(frames)
+        embedder.close()
+
+        start = time.time()
+        frozen = FrozenEmbedder(export_path, intra_op_threads=args.threads, inter_op_threads=args.threads)
+        frozen.embed(frames)
+        frozen_cold = time.time() - start
+        frozen_latency = _latency(frozen, frames, args.batches)
+        error = float(np.abs(frozen.embed(frames) - reference).max())
+        frozen.close()
+
+        print("model %s, batch %d, %d batches." % (args.model, args.batch_size, args.batches))
+        print("%-10s %12s %14s" % ('', 'cold start s', 'ms per batch'))
+        print("%-10s %12.3f %14.2f" % ('restore()', restore_cold, restore_latency * 1e3))
+        print("%-10s %12.3f %14.2f" % ('Embedder', embedder_cold, embedder_latency * 1e3))
+        print("%-10s %12.3f %14.2f" % ('frozen', frozen_cold, frozen_latency * 1e3))
+        print("frozen graph %.1f MB, max abs difference %.2e." % (
+            os.path.getsize(os.path.join(export_path, 'frozen_graph.pb')) / 1e6, error))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
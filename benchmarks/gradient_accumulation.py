@@ -0,0 +1,99 @@
+"""Benchmark the memory and the throughput of training with micro-batches.
+
+Each micro-batch size is run in a fresh process on random data, and we report
+the step time, the examples per second and the peak resident memory of the
+process. DeepSpeaker is trained with the cached-embedding triplet loss, the
+softmax models with plain gradient accumulation::
+
+    python benchmarks/gradient_accumulation.py --model deep_speaker --batch-size 256 --micro-batch-sizes 0 32 64 128
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+SHAPES = {'ctdnn': (9, 40, 1), 'deep_speaker': (100, 64, 1), 'mfm': (50, 40, 1)}
+
+
+def _build(model_name, config, x, y):
+    from pyasv.model.ctdnn import CTDnn
+    from pyasv.model.deep_speaker import DeepSpeaker
+    from pyasv.model.max_feature_map_dnn_model import MaxFeatureMapDnn
+    return {'ctdnn': CTDnn, 'deep_speaker': DeepSpeaker, 'mfm': MaxFeatureMapDnn}[model_name](config, x, y)
+
+
+def _measure(model_name, batch_size, micro_batch_size, n_speaker, steps, threads):
+    import tensorflow as tf
+    from pyasv import Config
+    from pyasv.accumulation import GradientAccumulator, EmbeddingCacheAccumulator
+    from pyasv.inference import session_config
+
+    config = Config(name=model_name, n_speaker=n_speaker, batch_size=batch_size, n_gpu=0, max_step=1,
+                    is_big_dataset=False, learning_rate=0.001, save_path='.', conv_weight_decay=0.0,
+                    fc_weight_decay=0.0, bn_epsilon=1e-3, deep_speaker_out_channel=[64, 128, 256, 512])
+    x = tf.placeholder(tf.float32, [None] + list(SHAPES[model_name]))
+    y = tf.placeholder(tf.float32, [None, n_speaker])
+    model = _build(model_name, config, x, y)
+    opt = tf.train.AdamOptimizer(0.001)
+    if not micro_batch_size:
+        train_op = opt.minimize(model.loss)
+    elif model_name == 'deep_speaker':
+        accumulator = EmbeddingCacheAccumulator(opt, x, y, model.feature, model._triplet_loss)
+    else:
+        accumulator = GradientAccumulator(opt, model.loss, model.feature)
+
+    # P x K labels, so the triplet losses find positives.
+    labels = np.repeat(np.arange(batch_size // 4) % n_speaker, 4)
+    batch_x = np.random.randn(len(labels), *SHAPES[model_name]).astype(np.float32)
+    batch_y = np.eye(n_speaker, dtype=np.float32)[labels]
+    with tf.Session(config=session_config(threads, threads)) as sess:
+        sess.run(tf.global_variables_initializer())
+        if micro_batch_size:
+            sess.run(accumulator.initializer)
+
+        def step():
+            if micro_batch_size:
+                accumulator.run(sess, {x: batch_x, y: batch_y}, micro_batch_size)
+            else:
+                sess.run(train_op, {x: batch_x, y: batch_y})
+
+        step()
+        start = time.time()
+        for _ in range(steps):
+            step()
+        step_time = (time.time() - start) / steps
+    # ru_maxrss is in KB on Linux.
+    return step_time, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--model', choices=sorted(SHAPES), default='deep_speaker')
+    parser.add_argument('--batch-size', type=int, default=128)
+    parser.add_argument('--micro-batch-sizes', type=int, nargs='+', default=[0, 16, 32, 64],
+                        help="0 trains on the whole batch at once.")
+    parser.add_argument('--speakers', type=int, default=100)
+    parser.add_argument('--steps', type=int, default=5)
+    parser.add_argument('--threads', type=int, default=0)
+    args = parser.parse_args()
+
+    # spawn a fresh process per run, the peak memory of a process never decreases.
+    context = multiprocessing.get_context('spawn')
+    print("%s, batch %d." % (args.model, args.batch_size))
+    print("%12s %10s %12s %12s" % ('micro-batch', 'ms/step', 'examples/s', 'peak MB'))
+    for micro_batch_size in args.micro_batch_sizes:
+        with context.Pool(1) as pool:
+            step_time, peak = pool.apply(_measure, (args.model, args.batch_size, micro_batch_size,
+                                                    args.speakers, args.steps, args.threads))
+        print("%12s %10.1f %12.1f %12.1f" % (micro_batch_size or 'none', step_time * 1e3,
+                                             args.batch_size / step_time, peak))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""Benchmark the step time of full and sampled softmax output layers.
+
+Only the output layer is built, on random features of the size of the CTDNN
+feature layer, so the numbers show how the step time grows with the number
+of training speakers::
+
+    python benchmarks/sampled_softmax.py --speakers 1000 10000 50000 --n-sampled 1024
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import tensorflow as tf
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pyasv.loss.sampled_softmax import sampled_softmax_loss
+
+
+def _step_time(n_speaker, dim, batch_size, n_sampled, steps):
+    with tf.Graph().as_default():
+        features = tf.constant(np.random.randn(batch_size, dim).astype(np.float32))
+        labels = tf.random_uniform([batch_size, 1], maxval=n_speaker, dtype=tf.int64)
+        if n_sampled:
+            weights = tf.get_variable('w', [n_speaker, dim], initializer=tf.truncated_normal_initializer(stddev=0.1))
+            biases = tf.get_variable('b', [n_speaker], initializer=tf.zeros_initializer())
+            loss = sampled_softmax_loss(weights, biases, labels, features, n_sampled, n_speaker)
+        else:
+            weights = tf.get_variable('w', [dim, n_speaker], initializer=tf.truncated_normal_initializer(stddev=0.1))
+            biases = tf.get_variable('b', [n_speaker], initializer=tf.zeros_initializer())
+            logits = tf.nn.bias_add(tf.matmul(features, weights), biases)
+            loss = tf.reduce_mean(tf.nn.sparse_softmax_cross_entropy_with_logits(labels=labels[:, 0], logits=logits))
+        train_op = tf.train.GradientDescentOptimizer(0.01).minimize(loss)
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            sess.run(train_op)
+            start = time.time()
+            for _ in range(steps):
+                sess.run(train_op)
+            return (time.time() - start) / steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--speakers', type=int, nargs='+', default=[1000, 10000, 50000, 100000])
+    parser.add_argument('--dim', type=int, default=400)
+    parser.add_argument('--batch-size', type=int, default=128)
+    parser.add_argument('--n-sampled', type=int, default=1024)
+    parser.add_argument('--steps', type=int, default=20)
+    args = parser.parse_args()
+
+    print("dim %d, batch %d, %d sampled speakers." % (args.dim, args.batch_size, args.n_sampled))
+    print("%10s %14s %14s %8s" % ('speakers', 'full ms/step', 'sampled ms/step', 'speedup'))
+    for n_speaker in args.speakers:
+        full = _step_time(n_speaker, args.dim, args.batch_size, None, args.steps)
+        sampled = _step_time(n_speaker, args.dim, args.batch_size, min(args.n_sampled, n_speaker - 1), args.steps)
+        print("%10d %14.2f %14.2f %8.2f" % (n_speaker, full * 1e3, sampled * 1e3, full / sampled))
+
+
+if __name__ == '__main__':
+    main()
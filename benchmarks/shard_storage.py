@@ -0,0 +1,89 @@
+"""Benchmark the storage types and codecs of ``DataManage4BigData`` shards.
+
+For every combination we report the bytes on disk, the read speed (bytes on
+disk / time of ``np.load``) and the time of ``decode_frames``, on synthetic
+fbank-like frames. With the 'npz' codec the decompression happens in
+``np.load`` and is counted in the read speed::
+
+    python benchmarks/shard_storage.py --examples 20000 --shape 9 40
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pyasv.data_manage import DataManage4BigData, STORAGE_DTYPES, CODECS, decode_frames
+
+
+class _Config:
+    def __init__(self, batch_size, save_path):
+        self.BATCH_SIZE = batch_size
+        self.SAVE_PATH = save_path
+
+
+def _synthetic_frames(n, shape, seed=0):
+    rng = np.random.RandomState(seed)
+    # smooth along time and frequency like a log mel spectrogram.
+    frames = rng.randn(n, *shape).astype(np.float32)
+    frames = (frames + np.roll(frames, 1, axis=-1) + np.roll(frames, 1, axis=-2)) / 3
+    return frames
+
+
+def _bench(frames, labels, batch_size, storage_dtype, codec):
+    root = tempfile.mkdtemp()
+    try:
+        data = DataManage4BigData(_Config(batch_size, root), 'bench')
+        with data.open_writer(storage_dtype=storage_dtype, codec=codec) as writer:
+            writer.write(frames, labels)
+        paths = [os.path.join(data.url, name) for name in data.shard_names]
+        n_bytes = sum(os.path.getsize(path) for path in paths)
+        read_time = 0.0
+        decode_time = 0.0
+        error = 0.0
+        start_row = 0
+        for path in paths:
+            start = time.time()
+            with np.load(path) as loaded:
+                arrays = {key: loaded[key] for key in loaded.files}
+            read_time += time.time() - start
+            start = time.time()
+            decoded = decode_frames(arrays)
+            decode_time += time.time() - start
+            original = frames[start_row:start_row + len(decoded)]
+            error = max(error, float(np.abs(decoded - original).max()))
+            start_row += len(decoded)
+        return n_bytes, read_time, decode_time, error
+    finally:
+        shutil.rmtree(root)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--examples', type=int, default=20000)
+    parser.add_argument('--shape', type=int, nargs='+', default=[9, 40])
+    parser.add_argument('--batch-size', type=int, default=512)
+    parser.add_argument('--speakers', type=int, default=100)
+    args = parser.parse_args()
+
+    frames = _synthetic_frames(args.examples, args.shape)
+    labels = np.random.randint(0, args.speakers, [args.examples, 1])
+    raw_mb = frames.nbytes / 1e6
+    print("%d examples of shape %s, %.1f MB as float32." % (args.examples, args.shape, raw_mb))
+    print("%-8s %-5s %10s %7s %10s %11s %9s" % ('dtype', 'codec', 'disk MB', 'ratio',
+                                              'read MB/s', 'decode ms', 'max err'))
+    for storage_dtype in STORAGE_DTYPES:
+        for codec in CODECS:
+            n_bytes, read_time, decode_time, error = _bench(frames, labels, args.batch_size,
+                                                            storage_dtype, codec)
+            print("%-8s %-5s %10.2f %7.2f %10.1f %11.1f %9.2e" % (
+                storage_dtype, codec, n_bytes / 1e6, raw_mb * 1e6 / n_bytes,
+                n_bytes / 1e6 / max(read_time, 1e-9), decode_time * 1e3, error))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""Benchmark the step time and the triplets used by the triplet mining strategies.
+
+Each strategy is run forward and backward on random embeddings with P speakers
+and K utterances per speaker, and checked against the NumPy reference of
+``pyasv.loss.numpy_reference`` on the first batch::
+
+    python benchmarks/triplet_loss.py --speakers 8 32 64 --utterances 4
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import tensorflow as tf
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pyasv.loss import triplet_loss
+from pyasv.loss import numpy_reference
+
+
+MARGIN = 0.5
+
+
+def _build(strategy, labels, embeddings):
+    """Return the loss and the fraction of the triplets with a positive loss (None for batch_hard)."""
+    if strategy == 'batch_hard':
+        return triplet_loss.batch_hard_triplet_loss(labels, embeddings, MARGIN), None
+    if strategy == 'batch_all':
+        return triplet_loss.batch_all_triplet_loss(labels, embeddings, MARGIN)
+    if strategy == 'batch_all_sorted':
+        return triplet_loss.batch_all_triplet_loss_sorted(labels, embeddings, MARGIN)
+    return triplet_loss.semi_hard_triplet_loss(labels, embeddings, MARGIN)
+
+
+def _reference(strategy, labels, embeddings):
+    """Return the loss and the number of triplets with a positive loss."""
+    if strategy == 'batch_hard':
+        return numpy_reference.batch_hard_triplet_loss(labels, embeddings, MARGIN)
+    if strategy == 'semi_hard':
+        loss, _, used = numpy_reference.semi_hard_triplet_loss(labels, embeddings, MARGIN)
+    else:
+        loss, _, used = numpy_reference.batch_all_triplet_loss(labels, embeddings, MARGIN)
+    return loss, used
+
+
+def _run(strategy, n_speaker, n_utterance, dim, steps, check):
+    labels_value = np.repeat(np.arange(n_speaker), n_utterance).astype(np.int64)
+    embeddings_value = np.random.randn(len(labels_value), dim).astype(np.float32)
+    with tf.Graph().as_default():
+        labels = tf.constant(labels_value)
+        embeddings = tf.get_variable('embeddings', initializer=embeddings_value)
+        loss, fraction = _build(strategy, labels, embeddings)
+        train_op = tf.train.GradientDescentOptimizer(0.01).minimize(loss)
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            loss_value = sess.run(loss)
+            fraction_value = None if fraction is None else sess.run(fraction)
+            used, error = None, None
+            if check:
+                ref_loss, used = _reference(strategy, labels_value, embeddings_value)
+                error = abs(loss_value - ref_loss)
+            sess.run(train_op)
+            start = time.time()
+            for _ in range(steps):
+                sess.run(train_op)
+            return (time.time() - start) / steps, fraction_value, used, error
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--speakers', type=int, nargs='+', default=[8, 16, 32, 64])
+    parser.add_argument('--utterances', type=int, default=4)
+    parser.add_argument('--dim', type=int, default=512)
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--strategies', nargs='+',
+                        default=['batch_hard', 'batch_all', 'batch_all_sorted', 'semi_hard'])
+    parser.add_argument('--dense-limit', type=int, default=128,
+                        help="skip the O(batch^3) memory batch_all above this batch size.")
+    parser.add_argument('--check-limit', type=int, default=64,
+                        help="skip the loop based NumPy reference above this batch size.")
+    args = parser.parse_args()
+
+    print("dim %d, %d utterances per speaker, margin %.2f." % (args.dim, args.utterances, MARGIN))
+    print("%6s %18s %10s %10s %10s %10s" % ('batch', 'strategy', 'ms/step', 'fraction', 'triplets', 'ref error'))
+    for n_speaker in args.speakers:
+        batch_size = n_speaker * args.utterances
+        for strategy in args.strategies:
+            if strategy == 'batch_all' and batch_size > args.dense_limit:
+                continue
+            step, fraction, used, error = _run(strategy, n_speaker, args.utterances, args.dim, args.steps,
+                                               batch_size <= args.check_limit)
+            print("%6d %18s %10.2f %10s %10s %10s" % (batch_size, strategy, step * 1e3,
+                                                      '-' if fraction is None else "%.3f" % fraction,
+                                                      '-' if used is None else used,
+                                                      '-' if error is None else "%.2e" % error))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,13 @@
+import importlib
 from pyasv.config import Config
-import pyasv.speech_processing
-import pyasv.model
-import pyasv.data_manage
-import pyasv.config
-import pyasv.backend
-import pyasv.loss
\ No newline at end of file
+
+# the submodules are imported when they are first used, so that e.g. pyasv.inference
+# runs a frozen graph without the model code, librosa or scipy.
+_SUBMODULES = ('speech_processing', 'model', 'data_manage', 'data_loader', 'pipeline', 'inference',
+               'accumulation', 'distributed', 'engine', 'config', 'backend', 'loss')
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module('pyasv.' + name)
+    raise AttributeError("module 'pyasv' has no attribute '%s'" % name)
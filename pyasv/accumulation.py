@@ -0,0 +1,192 @@
+"""
+Gradient accumulation
+---------------------
+
+A logical batch of ``BATCH_SIZE`` examples is split into micro-batches of
+``MICRO_BATCH_SIZE`` examples. The gradients of the micro-batches are summed
+into non-trainable variables and applied once, so the memory of a step is the
+memory of a micro-batch.
+
+Losses which are a mean over the examples, like the softmax losses, are
+accumulated by ``GradientAccumulator``. The triplet losses mine the triplets over
+the whole batch, so ``EmbeddingCacheAccumulator`` first computes the embeddings
+of all the micro-batches, takes the gradient of the loss with respect to the
+cached embeddings, then back-propagates it through each micro-batch.
+
+.. autoclass:: pyasv.accumulation.GradientAccumulator
+    :members:
+
+    .. automethod:: __init__
+
+.. autoclass:: pyasv.accumulation.EmbeddingCacheAccumulator
+    :members:
+
+    .. automethod:: __init__
+
+.. autofunction:: pyasv.accumulation.micro_batches
+"""
+import numpy as np
+import tensorflow as tf
+
+
+def micro_batches(n, micro_batch_size):
+    """Split ``n`` examples into micro-batches.
+
+    Parameters
+    ----------
+    n : ``int``
+        the number of examples of the logical batch.
+    micro_batch_size : ``int``
+        the max number of examples of a micro-batch.
+
+    Returns
+    -------
+    slices : ``list``
+        ``slice`` of each micro-batch.
+    """
+    assert micro_batch_size > 0
+    return [slice(start, min(start + micro_batch_size, n)) for start in range(0, n, micro_batch_size)]
+
+
+class _Accumulator(object):
+    """Sum gradients into non-trainable variables and apply them once."""
+    def __init__(self, opt, objective, var_list=None):
+        grads_and_vars = [(g, v) for g, v in opt.compute_gradients(objective, var_list=var_list)
+                          if g is not None]
+        self._weight = tf.placeholder(tf.float32, [], name='micro_batch_weight')
+        # local variables are not saved in the checkpoints.
+        self._sums = [tf.Variable(tf.zeros(v.shape, dtype=v.dtype.base_dtype), trainable=False,
+                                  collections=[tf.GraphKeys.LOCAL_VARIABLES], name='accumulated_grad')
+                      for _, v in grads_and_vars]
+        self.initializer = tf.variables_initializer(self._sums)
+        self._zero_op = tf.group(*[s.assign(tf.zeros_like(s)) for s in self._sums])
+        # sparse gradients, e.g. of a sampled softmax, are densified here.
+        self._accumulate_op = tf.group(*[s.assign_add(tf.convert_to_tensor(g) * tf.cast(self._weight, s.dtype))
+                                         for s, (g, _) in zip(self._sums, grads_and_vars)])
+        self.apply_op = opt.apply_gradients([(s, v) for s, (_, v) in zip(self._sums, grads_and_vars)])
+
+
+class GradientAccumulator(_Accumulator):
+    """
+    Use ``GradientAccumulator`` to train a loss which is a mean over the examples
+    with micro-batches. The gradient of each micro-batch is weighted by its share
+    of the logical batch, so the applied gradient is the one of the whole batch.
+    """
+    def __init__(self, opt, loss, feature, var_list=None):
+        """
+        Parameters
+        ----------
+        opt : ``tf.train.Optimizer``
+            the optimizer.
+        loss : ``tf.Tensor``
+            scalar mean loss of the micro-batch fed.
+        feature : ``tf.Tensor``
+            ``[batch, dim]`` features of the micro-batch, returned by ``run``.
+        var_list : ``list``
+            the variables to train, all the trainable variables if None.
+        """
+        super(GradientAccumulator, self).__init__(opt, loss, var_list)
+        self._loss = loss
+        self._feature = feature
+
+    def run(self, sess, feed_dict, micro_batch_size):
+        """Run one training step on a logical batch.
+
+        Parameters
+        ----------
+        sess : ``tf.Session``
+            the session, ``initializer`` should have been run.
+        feed_dict : ``dict``
+            the logical batch, every value is split along its first axis.
+        micro_batch_size : ``int``
+            the max number of examples fed at a time.
+
+        Returns
+        -------
+        loss : ``float``
+            the mean loss of the logical batch.
+        features : ``np.ndarray``
+            ``[batch, dim]`` features.
+        """
+        n = len(next(iter(feed_dict.values())))
+        loss = 0.0
+        features = []
+        sess.run(self._zero_op)
+        for part in micro_batches(n, micro_batch_size):
+            weight = float(part.stop - part.start) / n
+            feed = {k: v[part] for k, v in feed_dict.items()}
+            feed[self._weight] = weight
+            _, part_loss, part_feature = sess.run([self._accumulate_op, self._loss, self._feature], feed)
+            loss += weight * part_loss
+            features.append(part_feature)
+        sess.run(self.apply_op)
+        return loss, np.concatenate(features, 0)
+
+
+class EmbeddingCacheAccumulator(_Accumulator):
+    """
+    Use ``EmbeddingCacheAccumulator`` to train a loss over the embeddings of the whole
+    logical batch, e.g. a triplet loss, with micro-batches.
+
+    The embeddings are computed micro-batch by micro-batch without gradients, the
+    loss and its gradient with respect to the embeddings are computed on the whole
+    batch, and each micro-batch is run again to back-propagate its part of that
+    gradient. A step costs one more forward pass than without accumulation, and
+    the model must be deterministic in training, e.g. no dropout.
+    """
+    def __init__(self, opt, inputs, labels, feature, loss_fn, var_list=None):
+        """
+        Parameters
+        ----------
+        opt : ``tf.train.Optimizer``
+            the optimizer.
+        inputs : ``tf.Tensor``
+            the inputs of the model.
+        labels : ``tf.Tensor``
+            the labels, only fed to the loss of the whole batch.
+        feature : ``tf.Tensor``
+            ``[batch, dim]`` embeddings of ``inputs``.
+        loss_fn : ``callable``
+            ``loss_fn(embeddings, labels)`` builds the scalar loss of a batch.
+        var_list : ``list``
+            the variables to train, all the trainable variables if None.
+        """
+        self._inputs = inputs
+        self._labels = labels
+        self._feature = feature
+        self._embeddings = tf.placeholder(tf.float32, feature.shape, name='cached_embeddings')
+        self._loss = loss_fn(self._embeddings, labels)
+        self._embedding_grad = tf.gradients(self._loss, self._embeddings)[0]
+        self._upstream = tf.placeholder(tf.float32, feature.shape, name='embedding_grad')
+        super(EmbeddingCacheAccumulator, self).__init__(opt, tf.reduce_sum(feature * self._upstream), var_list)
+
+    def run(self, sess, feed_dict, micro_batch_size):
+        """Run one training step on a logical batch.
+
+        Parameters
+        ----------
+        sess : ``tf.Session``
+            the session, ``initializer`` should have been run.
+        feed_dict : ``dict``
+            the logical batch, with the values of ``inputs`` and ``labels``.
+        micro_batch_size : ``int``
+            the max number of examples fed to the model at a time.
+
+        Returns
+        -------
+        loss : ``float``
+            the loss of the logical batch.
+        features : ``np.ndarray``
+            ``[batch, dim]`` embeddings.
+        """
+        batch_x = feed_dict[self._inputs]
+        parts = micro_batches(len(batch_x), micro_batch_size)
+        features = np.concatenate([sess.run(self._feature, {self._inputs: batch_x[part]}) for part in parts], 0)
+        loss, grad = sess.run([self._loss, self._embedding_grad],
+                              {self._embeddings: features, self._labels: feed_dict[self._labels]})
+        sess.run(self._zero_op)
+        for part in parts:
+            sess.run(self._accumulate_op, {self._inputs: batch_x[part], self._upstream: grad[part],
+                                           self._weight: 1.0})
+        sess.run(self.apply_op)
+        return loss, features
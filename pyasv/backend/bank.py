@@ -0,0 +1,124 @@
+"""
+EmbeddingBank
+-------------
+
+.. autoclass:: pyasv.backend.bank.EmbeddingBank
+    :members:
+
+    .. automethod:: __init__
+"""
+import numpy as np
+from pyasv.backend.centroid import CentroidAccumulator
+from pyasv.backend.scoring import normalize, select_top_k
+
+
+class EmbeddingBank(object):
+    """
+    Use ``EmbeddingBank`` to keep a compact table of speaker vectors during training.
+    The features of the training batches are accumulated, and every ``refresh_steps``
+    batches the table is refreshed: the mean of each speaker seen since the last
+    refresh is averaged with its row of the table, normalized and stored in float16.
+
+    The table is used to find the speakers nearest to each other, e.g. by
+    ``pyasv.data_manage.HardNegativeSampler``.
+    """
+    def __init__(self, n_speaker, dim, refresh_steps=100, momentum=0.5):
+        """
+        Parameters
+        ----------
+        n_speaker : ``int``
+            the number of speakers.
+        dim : ``int``
+            the dim of a feature.
+        refresh_steps : ``int``
+            the number of observed batches between two refreshes of the table.
+        momentum : ``float``
+            the weight of the old row of a speaker when the table is refreshed,
+            0 replaces it by the new mean.
+        """
+        assert refresh_steps > 0 and 0 <= momentum < 1
+        self.n_speaker = n_speaker
+        self.dim = dim
+        self.refresh_steps = refresh_steps
+        self.momentum = momentum
+        self.num_refreshes = 0
+        self._steps = 0
+        self._accumulator = CentroidAccumulator(n_speaker, dim)
+        self._table = np.zeros((n_speaker, dim), dtype=np.float16)
+        # float32 copy of the table for the products in ``neighbours``, only the
+        # refreshed rows are converted.
+        self._vectors = np.zeros((n_speaker, dim), dtype=np.float32)
+        self._valid = np.zeros(n_speaker, dtype=bool)
+
+    @property
+    def table(self):
+        """``[n_speaker, dim]`` float16 normalized speaker vectors, zeros for speakers never seen."""
+        return self._table
+
+    @property
+    def valid(self):
+        """``[n_speaker]`` bool mask of the speakers which have a row in the table."""
+        return self._valid
+
+    def observe(self, features, labels):
+        """Add the features of a training batch, and refresh the table every ``refresh_steps`` calls.
+
+        Parameters
+        ----------
+        features : ``np.ndarray``
+            ``[batch, dim]`` features.
+        labels : ``np.ndarray``
+            one-hot labels or speaker ids.
+
+        Returns
+        -------
+        refreshed : ``bool``
+            whether the table was refreshed.
+        """
+        self._accumulator.update(features, labels)
+        self._steps += 1
+        if self._steps < self.refresh_steps:
+            return False
+        self.refresh()
+        return True
+
+    def refresh(self):
+        """Fold the features observed since the last refresh into the table."""
+        present = self._accumulator.counts > 0
+        means = normalize(self._accumulator.epoch_means()[present])
+        old = self._table[present].astype(np.float32)
+        rows = np.where(self._valid[present, None], self.momentum * old + (1 - self.momentum) * means, means)
+        self._table[present] = normalize(rows)
+        self._vectors[present] = self._table[present]
+        self._valid |= present
+        self._accumulator.reset()
+        self._steps = 0
+        self.num_refreshes += 1
+
+    def neighbours(self, speakers, k):
+        """Find the ``k`` nearest speakers of each of ``speakers`` by the cosine of their rows.
+
+        Parameters
+        ----------
+        speakers : ``np.ndarray``
+            ``[n]`` speaker ids.
+        k : ``int``
+            the number of neighbours per speaker.
+
+        Returns
+        -------
+        ids : ``np.ndarray``
+            ``[n, k]`` speaker ids, nearest first.
+        scores : ``np.ndarray``
+            ``[n, k]`` cosine scores, ``-inf`` where the speaker or the neighbour
+            has no row in the table.
+        """
+        speakers = np.asarray(speakers, dtype=np.int64).reshape(-1)
+        k = min(k, self.n_speaker - 1)
+        scores = np.dot(self._vectors[speakers], self._vectors.T)
+        scores[:, ~self._valid] = -np.inf
+        scores[~self._valid[speakers]] = -np.inf
+        scores[np.arange(len(speakers)), speakers] = -np.inf
+        if k <= 0:
+            return np.zeros((len(speakers), 0), dtype=np.int64), np.zeros((len(speakers), 0), dtype=np.float32)
+        return select_top_k(scores, k)
@@ -0,0 +1,118 @@
+"""
+CentroidAccumulator
+-------------------
+
+.. autoclass:: pyasv.backend.centroid.CentroidAccumulator
+    :members:
+
+    .. automethod:: __init__
+"""
+import numpy as np
+
+
+class CentroidAccumulator(object):
+    """
+    Use ``CentroidAccumulator`` to compute speaker vectors from a stream of
+    batches. Only the per-speaker sums and counts are kept, so the memory does
+    not depend on the number of batches.
+
+    At the end of an epoch, the mean of the epoch is averaged with the vector of
+    the speaker from the previous epochs, as in the training loops.
+    """
+    def __init__(self, n_speaker, dim):
+        """
+        Parameters
+        ----------
+        n_speaker : ``int``
+            the number of speakers.
+        dim : ``int``
+            the dim of a feature.
+        """
+        self.n_speaker = n_speaker
+        self.dim = dim
+        self._sums = np.zeros((n_speaker, dim), dtype=np.float64)
+        self._counts = np.zeros(n_speaker, dtype=np.int64)
+        self._centroids = np.zeros((n_speaker, dim), dtype=np.float32)
+        self._seen = np.zeros(n_speaker, dtype=bool)
+
+    def update(self, features, labels):
+        """Add a batch of features.
+
+        Parameters
+        ----------
+        features : ``np.ndarray``
+            ``[batch, dim]`` features.
+        labels : ``np.ndarray``
+            one-hot labels or speaker ids.
+        """
+        labels = np.asarray(labels)
+        if labels.ndim > 1 and labels.shape[-1] > 1:
+            ids = np.argmax(labels, -1)
+        else:
+            ids = labels.reshape(-1).astype(np.int64)
+        if len(ids) == 0:
+            return
+        # sort the batch by speaker and sum the runs, np.add.at is slow.
+        order = np.argsort(ids, kind='mergesort')
+        ids = ids[order]
+        starts = np.concatenate([[0], np.nonzero(np.diff(ids))[0] + 1])
+        features = np.asarray(features, dtype=np.float64).reshape(len(ids), -1)[order]
+        self._sums[ids[starts]] += np.add.reduceat(features, starts, axis=0)
+        self._counts += np.bincount(ids, minlength=self.n_speaker)
+
+    def merge(self, sums, counts):
+        """Add the per-speaker sums and counts of features seen elsewhere, e.g. by other workers.
+
+        Parameters
+        ----------
+        sums : ``np.ndarray``
+            ``[n_speaker, dim]`` sums of features.
+        counts : ``np.ndarray``
+            ``[n_speaker]`` numbers of features.
+        """
+        self._sums += sums
+        self._counts += np.asarray(counts, dtype=np.int64)
+
+    @property
+    def sums(self):
+        """The sum of the features of each speaker in the current epoch."""
+        return self._sums
+
+    @property
+    def counts(self):
+        """The number of features of each speaker in the current epoch."""
+        return self._counts
+
+    def epoch_means(self):
+        """Return the mean feature of each speaker in the current epoch, zeros if absent."""
+        means = np.zeros((self.n_speaker, self.dim), dtype=np.float32)
+        present = self._counts > 0
+        means[present] = self._sums[present] / self._counts[present, None]
+        return means
+
+    def end_epoch(self):
+        """Fold the means of the current epoch into the centroids and start a new epoch.
+
+        Returns
+        -------
+        centroids : ``np.ndarray``
+            ``[n_speaker, dim]`` speaker vectors, zeros for speakers never seen.
+        """
+        present = self._counts > 0
+        means = self.epoch_means()
+        self._centroids[present] = np.where(self._seen[present, None],
+                                            (self._centroids[present] + means[present]) / 2,
+                                            means[present])
+        self._seen |= present
+        self.reset()
+        return self._centroids
+
+    def reset(self):
+        """Drop the sums and counts of the current epoch, the centroids are kept."""
+        self._sums[:] = 0
+        self._counts[:] = 0
+
+    @property
+    def centroids(self):
+        """``[n_speaker, dim]`` speaker vectors of the finished epochs."""
+        return self._centroids
@@ -0,0 +1,331 @@
+"""
+Scoring
+-------
+
+.. autofunction:: pyasv.backend.scoring.normalize
+
+.. autofunction:: pyasv.backend.scoring.cosine_scores
+
+.. autofunction:: pyasv.backend.scoring.iter_scores
+
+.. autofunction:: pyasv.backend.scoring.select_top_k
+
+.. autofunction:: pyasv.backend.scoring.top_k
+
+.. autofunction:: pyasv.backend.scoring.best_match
+
+.. autoclass:: pyasv.backend.scoring.ScoreWriter
+    :members:
+
+    .. automethod:: __init__
+"""
+import os
+import json
+import numpy as np
+
+
+SCORE_OUTPUTS = ('text', 'npy', 'topk')
+SUMMARY_NAME = 'summary.json'
+_HEADER_WIDTH = 64
+
+
+def normalize(vectors, eps=1e-12):
+    """L2-normalize the rows of ``vectors``. Rows with zero norm stay zero.
+
+    Parameters
+    ----------
+    vectors : ``np.ndarray``
+        ``[n, dim]`` vectors.
+    eps : ``float``
+        norms below ``eps`` are treated as zero.
+
+    Returns
+    -------
+    normalized : ``np.ndarray``
+        ``[n, dim]`` float32 vectors.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, eps)
+
+
+def cosine_scores(features, centroids, normalized=False):
+    """Compute the cosine scores of ``features`` against ``centroids`` with one matrix product.
+
+    Parameters
+    ----------
+    features : ``np.ndarray``
+        ``[n, dim]`` test vectors.
+    centroids : ``np.ndarray``
+        ``[n_speaker, dim]`` speaker vectors.
+    normalized : ``bool``
+        set it to True if ``centroids`` are already normalized.
+
+    Returns
+    -------
+    scores : ``np.ndarray``
+        ``[n, n_speaker]`` cosine scores, zero against all-zero vectors.
+    """
+    if not normalized:
+        centroids = normalize(centroids)
+    return np.dot(normalize(features), centroids.T)
+
+
+def iter_scores(features, centroids, chunk_size=1024, normalized=False):
+    """Yield the cosine scores of ``features`` against ``centroids``, ``chunk_size`` rows at a time.
+
+    Parameters
+    ----------
+    features : ``np.ndarray``
+        ``[n, dim]`` test vectors.
+    centroids : ``np.ndarray``
+        ``[n_speaker, dim]`` speaker vectors.
+    chunk_size : ``int``
+        the number of test vectors scored by one matrix product.
+    normalized : ``bool``
+        set it to True if ``centroids`` are already normalized.
+
+    Yields
+    ------
+    start : ``int``
+        index of the first row of the chunk.
+    scores : ``np.ndarray``
+        ``[chunk, n_speaker]`` cosine scores.
+    """
+    if not normalized:
+        centroids = normalize(centroids)
+    for start in range(0, len(features), chunk_size):
+        yield start, cosine_scores(features[start:start + chunk_size], centroids, normalized=True)
+
+
+def select_top_k(scores, k=1, exclude=None):
+    """Select the ``k`` highest scores of each row.
+
+    Parameters
+    ----------
+    scores : ``np.ndarray``
+        ``[n, n_speaker]`` scores.
+    k : ``int``
+        the number of speakers returned per row.
+    exclude : ``np.ndarray`` or None
+        ``[n_speaker]`` bool mask of the speakers which should not be selected.
+
+    Returns
+    -------
+    ids : ``np.ndarray``
+        ``[n, k]`` speaker ids, best first.
+    scores : ``np.ndarray``
+        ``[n, k]`` the scores of ``ids``.
+    """
+    k = min(k, scores.shape[1])
+    masked = scores
+    if exclude is not None and exclude.any():
+        masked = np.where(exclude, -np.inf, scores)
+    if k == 1:
+        ids = np.argmax(masked, axis=1)[:, None]
+    else:
+        part = np.argpartition(-masked, k - 1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(masked, part, axis=1), axis=1)
+        ids = np.take_along_axis(part, order, axis=1)
+    return ids, np.take_along_axis(scores, ids, axis=1)
+
+
+def top_k(features, centroids, k=1, chunk_size=1024):
+    """Find the ``k`` best scoring speakers of each test vector.
+
+    Speakers whose vector is all zeros (never seen) are never selected
+    unless ``k`` is larger than the number of the other speakers.
+
+    Parameters
+    ----------
+    features : ``np.ndarray``
+        ``[n, dim]`` test vectors.
+    centroids : ``np.ndarray``
+        ``[n_speaker, dim]`` speaker vectors.
+    k : ``int``
+        the number of speakers returned per vector.
+    chunk_size : ``int``
+        the number of test vectors scored by one matrix product.
+
+    Returns
+    -------
+    ids : ``np.ndarray``
+        ``[n, k]`` speaker ids, best first.
+    scores : ``np.ndarray``
+        ``[n, k]`` the scores of ``ids``.
+    """
+    centroids = normalize(centroids)
+    k = min(k, len(centroids))
+    empty = ~centroids.any(axis=1)
+    ids = np.empty((len(features), k), dtype=np.int64)
+    scores = np.empty((len(features), k), dtype=np.float32)
+    for start, chunk in iter_scores(features, centroids, chunk_size, normalized=True):
+        stop = start + len(chunk)
+        ids[start:stop], scores[start:stop] = select_top_k(chunk, k, empty)
+    return ids, scores
+
+
+def best_match(features, centroids, chunk_size=1024):
+    """Return the best scoring speaker id and its score for each test vector.
+
+    Parameters
+    ----------
+    features : ``np.ndarray``
+        ``[n, dim]`` test vectors.
+    centroids : ``np.ndarray``
+        ``[n_speaker, dim]`` speaker vectors.
+    chunk_size : ``int``
+        the number of test vectors scored by one matrix product.
+
+    Returns
+    -------
+    ids : ``np.ndarray``
+        ``[n]`` speaker ids.
+    scores : ``np.ndarray``
+        ``[n]`` cosine scores.
+    """
+    ids, scores = top_k(features, centroids, 1, chunk_size)
+    return ids[:, 0], scores[:, 0]
+
+
+class ScoreWriter(object):
+    """
+    Use ``ScoreWriter`` to write the scores of test vectors batch by batch.
+
+    * ``'text'`` writes ``result.txt``, one line with the score list per test vector.
+    * ``'npy'`` writes the ``[n_test, n_speaker]`` score matrix into ``scores.npy``,
+      which can be opened with ``np.load(path, mmap_mode='r')``.
+    * ``'topk'`` only writes the ``k`` best speaker ids and scores per test vector into
+      ``topk_ids.npy`` and ``topk_scores.npy``.
+
+    Except for ``'text'``, the labels of the test vectors are written into ``labels.npy``.
+    In every mode, ``close`` writes the accuracy into ``summary.json``.
+    """
+    def __init__(self, path, n_test, n_speaker, output='text', k=5):
+        """
+        Parameters
+        ----------
+        path : ``str``
+            the directory of the output files.
+        n_test : ``int``
+            the max number of test vectors.
+        n_speaker : ``int``
+            the number of enrolled speakers.
+        output : ``str``
+            one of ``'text'``, ``'npy'`` and ``'topk'``.
+        k : ``int``
+            the number of speakers kept per vector in ``'topk'`` mode,
+            also used for the top-k accuracy of the summary.
+        """
+        if output not in SCORE_OUTPUTS:
+            raise ValueError("output should be one of %s, got %s" % (SCORE_OUTPUTS, output))
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.path = path
+        self.output = output
+        self.k = min(k, n_speaker)
+        self.n_test = n_test
+        self.n_speaker = n_speaker
+        self.num_vectors = 0
+        self.num_true = 0
+        self.num_true_k = 0
+        self._closed = False
+        if output == 'text':
+            self.files = ['result.txt']
+            self._text = open(os.path.join(path, 'result.txt'), 'w')
+            self._text.write(' ' * _HEADER_WIDTH + '\n')
+        else:
+            self._labels = self._open('labels.npy', np.int64, (n_test,))
+            if output == 'npy':
+                self._scores = self._open('scores.npy', np.float32, (n_test, n_speaker))
+            else:
+                self._ids = self._open('topk_ids.npy', np.int32, (n_test, self.k))
+                self._scores = self._open('topk_scores.npy', np.float32, (n_test, self.k))
+            self.files = [os.path.basename(f.filename) for f in self._memmaps()]
+
+    def _open(self, name, dtype, shape):
+        return np.lib.format.open_memmap(os.path.join(self.path, name), mode='w+', dtype=dtype, shape=shape)
+
+    def _memmaps(self):
+        if self.output == 'npy':
+            return [self._labels, self._scores]
+        return [self._labels, self._ids, self._scores]
+
+    def write(self, scores, labels, exclude=None):
+        """Write the scores of a batch.
+
+        Parameters
+        ----------
+        scores : ``np.ndarray``
+            ``[batch, n_speaker]`` scores.
+        labels : ``np.ndarray``
+            ``[batch]`` true speaker ids.
+        exclude : ``np.ndarray`` or None
+            ``[n_speaker]`` bool mask of the speakers which can't be predicted.
+        """
+        start = self.num_vectors
+        stop = start + len(scores)
+        if stop > self.n_test:
+            raise ValueError("ScoreWriter was opened for %d vectors, got %d." % (self.n_test, stop))
+        ids, top_scores = select_top_k(scores, self.k, exclude)
+        labels = np.asarray(labels).reshape(-1)
+        self.num_true += int(np.sum(ids[:, 0] == labels))
+        self.num_true_k += int(np.sum(ids == labels[:, None]))
+        if self.output == 'text':
+            lines = ["No.%d vector, pred:%d %s Score list:%s\n" % (start + i, ids[i, 0], ids[i, 0] == labels[i],
+                                                                  scores[i].tolist())
+                     for i in range(len(scores))]
+            self._text.writelines(lines)
+        else:
+            self._labels[start:stop] = labels
+            if self.output == 'npy':
+                self._scores[start:stop] = scores
+            else:
+                self._ids[start:stop] = ids
+                self._scores[start:stop] = top_scores
+        self.num_vectors = stop
+
+    def summary(self):
+        """Return the accuracy of the vectors written so far.
+
+        Returns
+        -------
+        summary : ``dict``
+            ``num_vectors``, ``num_true``, ``accuracy``, ``k``, ``top_k_accuracy``, ``output`` and ``files``.
+        """
+        n = max(self.num_vectors, 1)
+        return {'num_vectors': self.num_vectors, 'num_true': self.num_true,
+                'accuracy': self.num_true / n, 'k': self.k, 'top_k_accuracy': self.num_true_k / n,
+                'output': self.output, 'files': self.files}
+
+    def close(self):
+        """Flush the outputs and write ``summary.json``.
+
+        Returns
+        -------
+        summary : ``dict``
+            see ``summary``.
+        """
+        summary = self.summary()
+        if self._closed:
+            return summary
+        self._closed = True
+        if self.output == 'text':
+            self._text.seek(0)
+            self._text.write("Acc:%.4f  Num_of_true:%d" % (summary['accuracy'], summary['num_true']))
+            self._text.close()
+        else:
+            for memmap in self._memmaps():
+                memmap.flush()
+            del self._labels, self._scores
+            if self.output == 'topk':
+                del self._ids
+        with open(os.path.join(self.path, SUMMARY_NAME), 'w') as f:
+            json.dump(summary, f, indent=2)
+        return summary
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
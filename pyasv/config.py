@@ -20,7 +20,16 @@ class Config:
                  slide_windows=None,
                  plda_rankf=None,
                  plda_rankg=None,
-                 deep_speaker_out_channel=None):
+                 deep_speaker_out_channel=None,
+                 use_tf_data=None,
+                 n_sampled=None,
+                 triplet_strategy=None,
+                 micro_batch_size=None,
+                 n_workers=None,
+                 worker_addresses=None,
+                 local_ranks=None,
+                 intra_op_threads=None,
+                 inter_op_threads=None):
         """
         Parameters
         ----------
@@ -36,6 +45,29 @@ class Config:
         slide_windows : ``list``
             This list have two element. The first is `l` and the second is `r`
             If slide_windows is not ``None``, each frame's feature will be replace by [i-l, i+r] frames' feature.
+        use_tf_data : ``bool``
+            If we feed the model by a ``tf.data`` input pipeline instead of ``feed_dict``.
+        n_sampled : ``int``
+            If not ``None``, CTDNN and MFM models are trained with a sampled softmax over
+            ``n_sampled`` speakers per batch, the full softmax is still used for prediction.
+        triplet_strategy : ``str``
+            The triplet mining of the DeepSpeaker model, 'batch_hard' (default), 'batch_all'
+            or 'semi_hard'.
+        micro_batch_size : ``int``
+            If not ``None``, the training loops without GPU split each batch into micro-batches
+            of this size and apply the accumulated gradients once per batch.
+        n_workers : ``int``
+            If larger than 1 and ``n_gpu`` is 0, the models are trained by ``n_workers``
+            data-parallel processes, see ``pyasv.distributed``.
+        worker_addresses : ``list``
+            ``host:port`` of every worker, all the workers run on this machine if ``None``.
+        local_ranks : ``list``
+            The ranks of the workers started on this machine, all of them if ``None``.
+        intra_op_threads : ``int``
+            The number of threads used inside an op during training, decided by tensorflow
+            (or split between the local workers) if ``None``.
+        inter_op_threads : ``int``
+            The number of ops run in parallel during training, decided by tensorflow if ``None``.
         """
         if config_path:
             f = open(config_path, 'r')
@@ -60,6 +92,15 @@ class Config:
             self.PLDA_F_RANK = plda_rankf
             self.PLDA_G_RANK = plda_rankg
             self.DEEP_SPEAKER_OUT_CHANNEL = deep_speaker_out_channel
+            self.USE_TF_DATA = use_tf_data
+            self.N_SAMPLED = n_sampled
+            self.TRIPLET_STRATEGY = triplet_strategy
+            self.MICRO_BATCH_SIZE = micro_batch_size
+            self.N_WORKERS = n_workers
+            self.WORKER_ADDRESSES = worker_addresses
+            self.LOCAL_RANKS = local_ranks
+            self.INTRA_OP_THREADS = intra_op_threads
+            self.INTER_OP_THREADS = inter_op_threads
 
     def set(self,
             n_speaker=None,
@@ -76,7 +117,16 @@ class Config:
             slide_windows=None,
             plda_rankf=None,
             plda_rankg=None,
-            deep_speaker_out_channel=None):
+            deep_speaker_out_channel=None,
+            use_tf_data=None,
+            n_sampled=None,
+            triplet_strategy=None,
+            micro_batch_size=None,
+            n_workers=None,
+            worker_addresses=None,
+            local_ranks=None,
+            intra_op_threads=None,
+            inter_op_threads=None):
         """The ``set`` method is used for reset some config.
         """
         if n_speaker is not None:
@@ -109,6 +159,24 @@ class Config:
             self.PLDA_G_RANK = plda_rankg
         if deep_speaker_out_channel is not None:
             self.DEEP_SPEAKER_OUT_CHANNEL = deep_speaker_out_channel
+        if use_tf_data is not None:
+            self.USE_TF_DATA = use_tf_data
+        if n_sampled is not None:
+            self.N_SAMPLED = n_sampled
+        if triplet_strategy is not None:
+            self.TRIPLET_STRATEGY = triplet_strategy
+        if micro_batch_size is not None:
+            self.MICRO_BATCH_SIZE = micro_batch_size
+        if n_workers is not None:
+            self.N_WORKERS = n_workers
+        if worker_addresses is not None:
+            self.WORKER_ADDRESSES = worker_addresses
+        if local_ranks is not None:
+            self.LOCAL_RANKS = local_ranks
+        if intra_op_threads is not None:
+            self.INTRA_OP_THREADS = intra_op_threads
+        if inter_op_threads is not None:
+            self.INTER_OP_THREADS = inter_op_threads
 
     def save(self, name='global_config'):
         """This method is used for save your config to save_path
@@ -0,0 +1,286 @@
+"""
+MultiProcessLoader
+------------------
+
+.. autoclass:: MultiProcessLoader
+    :members:
+
+    .. automethod:: __init__
+
+.. note::
+    The workers are forked, so create the loader before you create a
+    ``tf.Session`` and run it on Linux.
+"""
+import numpy as np
+import multiprocessing
+import traceback
+import queue
+from multiprocessing import shared_memory
+
+
+class MultiProcessLoader(object):
+    """
+    Use ``MultiProcessLoader`` to build the batches of a ``DataManage`` or
+    ``DataManage4BigData`` in worker processes. The workers write the batches
+    into a ring of shared memory slots and ``next_batch`` returns views of them,
+    so batches are never pickled or copied on the way to the trainer. Call
+    ``close``, or use the loader as a context manager, to stop the workers and
+    free the shared memory.
+
+    The workers have a copy of the dataset made when they are forked. Each batch
+    is requested with the epoch and the partition of the dataset of the trainer,
+    which the copy of the worker follows before building the batch.
+    """
+    def __init__(self, data, n_workers=2, n_slots=None, transform=None, seed=0, shuffle=True):
+        """
+        Parameters
+        ----------
+        data : ``DataManage`` or ``DataManage4BigData``
+            the dataset, we use its ``batch_at``, ``num_batches`` and ``reset_batch_counter``
+            members. A ``DataManage4BigData`` must not have a shuffle buffer, its batches
+            are its shards.
+        n_workers : ``int``
+            the number of worker processes.
+        n_slots : ``int``
+            the number of shared memory slots, rounded up to a multiple of ``n_workers``.
+            Default is ``2 * n_workers``.
+        transform : ``callable``
+            ``transform(frames, labels, rng)`` is run by the workers on every batch,
+            e.g. augmentation. It must not return more examples than the largest batch
+            of ``data``.
+        seed : ``int``
+            the seed of the batch order and of the ``rng`` given to ``transform``.
+            The batches are the same and in the same order for the same seed.
+        shuffle : ``bool``
+            permute the batches every epoch.
+        """
+        if getattr(data, 'shuffle_buffer_size', None) is not None:
+            raise ValueError("MultiProcessLoader reads whole shards, create the DataManage4BigData "
+                             "without shuffle_buffer_size and use shuffle=True.")
+        if n_slots is None:
+            n_slots = 2 * n_workers
+        n_slots = int(np.ceil(n_slots / float(n_workers))) * n_workers
+        self._data = data
+        self._n_workers = n_workers
+        self._n_slots = n_slots
+        self._transform = transform
+        self._seed = seed
+        self._shuffle = shuffle
+        self.batch_size = data.batch_size
+        # a shard of DataManage4BigData may be larger than the current batch_size.
+        self._rows = getattr(data, 'max_batch_size', data.batch_size)
+        self.spkr_num = data.spkr_num
+        self.epoch = 0
+        self.batch_counter = 0
+        # batches counted over all epochs: requested, returned and whose slot is free again.
+        self._issued = 0
+        self._consumed = 0
+        self._released = 0
+        self._held = None
+        self._closed = False
+        self._workers = []
+        self._shm = []
+
+        # probe the shape and type of a batch.
+        frames, labels = _build_batch(data, transform, seed, 0, 0)
+        self._rows = max(self._rows, len(frames))
+        self._frame_spec = (frames.shape[1:], frames.dtype)
+        self._label_spec = (labels.shape[1:], labels.dtype)
+
+        ctx = multiprocessing.get_context('fork')
+        self._frames = []
+        self._labels = []
+        for _ in range(n_slots):
+            frames_buf, frames_view = _allocate(self._rows, *self._frame_spec)
+            labels_buf, labels_view = _allocate(self._rows, *self._label_spec)
+            self._shm += [frames_buf, labels_buf]
+            self._frames.append(frames_view)
+            self._labels.append(labels_view)
+        self._lengths = ctx.RawArray('q', n_slots)
+        self._requests = [ctx.Queue() for _ in range(n_workers)]
+        self._full = [ctx.Semaphore(0) for _ in range(n_slots)]
+        self._stop = ctx.Event()
+        self._errors = ctx.Queue()
+        for worker_id in range(n_workers):
+            worker = ctx.Process(target=self._work, args=(worker_id,), daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        self._start_epoch()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def reset_batch_counter(self):
+        """Skip the rest of the current epoch and start the next one."""
+        self._skip()
+        self.epoch += 1
+        self._data.reset_batch_counter()
+        self._start_epoch()
+
+    def set_partition(self, rank, world_size, seed=None):
+        """Only read the ``rank``-th of ``world_size`` disjoint parts of the dataset.
+
+        The partition is set on the dataset, see its ``set_partition``, and sent to the
+        workers with the next requests. The rest of the current epoch is skipped and
+        the epoch starts again with the batches of this worker.
+
+        Parameters
+        ----------
+        rank : ``int``
+            the index of this worker.
+        world_size : ``int``
+            the number of workers.
+        seed : ``int``
+            the seed of the partition, must be the same in every worker. The seed
+            of the dataset if None.
+        """
+        self._skip()
+        self._data.set_partition(rank, world_size, seed)
+        self._start_epoch()
+
+    @property
+    def next_batch(self):
+        """``property`` to get next batch data.
+
+        Returns
+        -------
+        batch_frames : ``np.ndarray``
+        batch_labels : ``np.ndarray``
+
+        Notes
+        -----
+        The arrays are views of shared memory which is reused after the next
+        call, copy them if you need to keep them.
+        After ``num_batches`` batches, two empty arrays are returned until
+        ``reset_batch_counter`` starts the next epoch.
+        """
+        self._release()
+        if self.batch_counter >= self.num_batches:
+            return np.array([]), np.array([])
+        slot = self._consumed % self._n_slots
+        self._wait(slot)
+        self._held = slot
+        self._consumed += 1
+        self.batch_counter += 1
+        length = self._lengths[slot]
+        return self._frames[slot][:length], self._labels[slot][:length]
+
+    def close(self):
+        """Stop the workers and free the shared memory."""
+        if getattr(self, '_closed', True):
+            return
+        self._closed = True
+        self._stop.set()
+        for worker in self._workers:
+            worker.join(timeout=1)
+            if worker.is_alive():
+                worker.terminate()
+                worker.join()
+        self._frames, self._labels = [], []
+        for buf in self._shm:
+            buf.close()
+            buf.unlink()
+        self._shm = []
+
+    def _start_epoch(self):
+        """Take the batch count, the order and the state of the dataset, and request the first batches."""
+        self.num_batches = self._data.num_batches
+        self.num_examples = self._data.num_examples
+        self.batch_counter = 0
+        if self._shuffle:
+            self._order = np.random.RandomState(self._seed + self.epoch).permutation(self.num_batches)
+        else:
+            self._order = np.arange(self.num_batches)
+        self._epoch_start = self._issued
+        self._state = _data_state(self._data)
+        self._request()
+
+    def _request(self):
+        """Request the batches of the epoch which fit in the free slots."""
+        end = min(self._epoch_start + self.num_batches, self._released + self._n_slots)
+        while self._issued < end:
+            position = int(self._order[self._issued - self._epoch_start])
+            worker_id = self._issued % self._n_slots % self._n_workers
+            self._requests[worker_id].put((self._issued, position, self._state))
+            self._issued += 1
+
+    def _skip(self):
+        """Wait for the requested batches which were not read and free their slots."""
+        self._release()
+        while self._consumed < self._issued:
+            self._wait(self._consumed % self._n_slots)
+            self._consumed += 1
+            self._released += 1
+
+    def _release(self):
+        if self._held is not None:
+            self._held = None
+            self._released += 1
+            self._request()
+
+    def _wait(self, slot):
+        while not self._full[slot].acquire(timeout=0.1):
+            try:
+                message = self._errors.get_nowait()
+            except queue.Empty:
+                message = None
+            if message is not None:
+                self.close()
+                raise RuntimeError("A worker of MultiProcessLoader failed:\n" + message)
+            if not all(worker.is_alive() for worker in self._workers):
+                self.close()
+                raise RuntimeError("A worker of MultiProcessLoader exited unexpectedly.")
+
+    def _work(self, worker_id):
+        try:
+            while not self._stop.is_set():
+                try:
+                    index, position, state = self._requests[worker_id].get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                _follow(self._data, state)
+                frames, labels = _build_batch(self._data, self._transform, self._seed, position, index)
+                if len(frames) > self._rows:
+                    raise ValueError("A batch of %d examples does not fit in a slot of %d examples."
+                                     % (len(frames), self._rows))
+                slot = index % self._n_slots
+                self._frames[slot][:len(frames)] = frames
+                self._labels[slot][:len(labels)] = labels
+                self._lengths[slot] = len(frames)
+                self._full[slot].release()
+        except Exception:
+            self._errors.put(traceback.format_exc())
+
+
+def _allocate(rows, shape, dtype):
+    size = max(1, rows * int(np.prod(shape)) * np.dtype(dtype).itemsize)
+    buf = shared_memory.SharedMemory(create=True, size=size)
+    return buf, np.ndarray((rows,) + tuple(shape), dtype=dtype, buffer=buf.buf)
+
+
+def _data_state(data):
+    """The epoch and the partition of a dataset."""
+    return (getattr(data, 'epoch', 0), getattr(data, 'rank', 0), getattr(data, 'world_size', 1),
+            getattr(data, 'seed', None))
+
+
+def _follow(data, state):
+    """Move the copy of a dataset of a worker to the epoch and the partition of the trainer."""
+    if _data_state(data) == state:
+        return
+    epoch, rank, world_size, seed = state
+    data.epoch = epoch
+    if hasattr(data, 'set_partition'):
+        data.set_partition(rank, world_size, seed)
+
+
+def _build_batch(data, transform, seed, position, index):
+    """Build the ``position``-th batch of the epoch, the ``index``-th of the stream over all epochs."""
+    frames, labels = data.batch_at(position)
+    if transform is not None:
+        rng = np.random.RandomState((seed * 1000003 + index) % 2 ** 32)
+        frames, labels = transform(frames, labels, rng)
+    return np.asarray(frames), np.asarray(labels)
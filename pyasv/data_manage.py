@@ -14,9 +14,84 @@ DataManage4BigData
     :members:
 
     .. automethod:: __init__
+
+ShardWriter
+-----------
+
+.. autoclass:: ShardWriter
+    :members:
+
+    .. automethod:: __init__
+
+SpeakerBalancedSampler
+----------------------
+
+.. autoclass:: SpeakerBalancedSampler
+    :members:
+
+    .. automethod:: __init__
+
+HardNegativeSampler
+-------------------
+
+.. autoclass:: HardNegativeSampler
+    :members:
+
+    .. automethod:: __init__
+
+UtteranceStore
+--------------
+
+.. autoclass:: UtteranceStore
+    :members:
+
+    .. automethod:: __init__
+
+SegmentSampler
+--------------
+
+.. autoclass:: SegmentSampler
+    :members:
+
+    .. automethod:: __init__
+
+BucketBatcher
+-------------
+
+.. autoclass:: BucketBatcher
+    :members:
+
+    .. automethod:: __init__
+
+.. autofunction:: padding_report
+
+partition_indices
+-----------------
+
+.. autofunction:: partition_indices
+
+encode_frames
+-------------
+
+.. autofunction:: encode_frames
+
+decode_frames
+-------------
+
+.. autofunction:: decode_frames
 """
 import numpy as np
 import os
+import json
+import zlib
+import lzma
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from pyasv.backend.bank import EmbeddingBank
+
+
+INDEX_NAME = 'index.json'
+STORAGE_DTYPES = ('float32', 'float16', 'int8')
+CODECS = ('npz', 'none', 'zlib', 'lzma')
 
 
 class DataManage(object):
@@ -37,10 +112,12 @@ class DataManage(object):
         """
         assert len(raw_frames) == len(raw_labels)
         # must be one-hot encoding
-        np.random.shuffle(raw_frames)
-        np.random.shuffle(raw_labels)
-        self.raw_frames = np.array(raw_frames, dtype=np.float32)
-        raw_labels = np.array(raw_labels)
+        order = np.random.permutation(len(raw_frames))
+        # the row of each example after the shuffle, the partitions are drawn over the
+        # original order so that they do not depend on the shuffle of each process.
+        self._rows = np.argsort(order)
+        self.raw_frames = np.array(raw_frames, dtype=np.float32)[order]
+        raw_labels = np.array(raw_labels)[order]
         if raw_labels.shape[-1] != config.N_SPEAKER:
             raw_labels = np.eye(config.N_SPEAKER)[raw_labels.reshape(-1)]
         self.raw_labels = np.array(raw_labels, dtype=np.float32)
@@ -52,9 +129,73 @@ class DataManage(object):
         self.epoch_size = self.num_examples / config.BATCH_SIZE
         self.batch_counter = 0
         self.spkr_num = np.array(self.raw_labels).shape[-1]
+        self.epoch = 0
+        self.rank = 0
+        self.world_size = 1
+        self.seed = 0
+        self._partition = None
+
+    def set_partition(self, rank, world_size, seed=None):
+        """Only read the ``rank``-th of ``world_size`` disjoint parts of the dataset.
+
+        Every epoch the examples, in the order they were given, are permuted by a seeded
+        permutation, which is the same in every worker, and each worker takes
+        ``num_examples // world_size`` of them, so workers never read the same example
+        in an epoch, even if each of them created its own ``DataManage``.
+
+        Parameters
+        ----------
+        rank : ``int``
+            the index of this worker.
+        world_size : ``int``
+            the number of workers.
+        seed : ``int``
+            the seed of the permutation, must be the same in every worker. The
+            current ``seed``, 0 by default, if None.
+        """
+        assert 0 <= rank < world_size
+        self.rank = rank
+        self.world_size = world_size
+        if seed is not None:
+            self.seed = seed
+        self._update_partition()
+
+    @property
+    def partition(self):
+        """The rows of the examples of this worker in the current epoch, None if it reads all of them."""
+        return self._partition
+
+    def _update_partition(self):
+        if self.world_size == 1:
+            self._partition = None
+            self.num_examples = len(self.raw_frames)
+        else:
+            self._partition = self._rows[partition_indices(len(self.raw_frames), self.rank, self.world_size,
+                                                           self.seed, self.epoch)]
+            self.num_examples = len(self._partition)
+        self.epoch_size = self.num_examples / self.batch_size
 
     def reset_batch_counter(self):
         self.batch_counter = 0
+        self.epoch += 1
+        if self._partition is not None:
+            self._update_partition()
+
+    def _slice(self, start, stop):
+        if self._partition is None:
+            return self.raw_frames[start:stop], self.raw_labels[start:stop]
+        rows = self._partition[start:stop]
+        return self.raw_frames[rows], self.raw_labels[rows]
+
+    @property
+    def num_batches(self):
+        """The number of batches in an epoch, including the last partial one."""
+        return int(np.ceil(self.num_examples / float(self.batch_size)))
+
+    def batch_at(self, index):
+        """Return the ``index``-th batch without moving the batch counter."""
+        start = index * self.batch_size
+        return self._slice(start, start + self.batch_size)
 
     @property
     def next_batch(self):
@@ -70,16 +211,12 @@ class DataManage(object):
         the type of ``batch_frames`` and ``batch_labels`` is
         same as your input data.
         """
-        if (self.batch_counter+1) * self.batch_size <= len(self.raw_frames):
-            batch_frames = self.raw_frames[self.batch_counter * self.batch_size:
-                                           (self.batch_counter+1) * self.batch_size]
-            batch_labels = self.raw_labels[self.batch_counter * self.batch_size:
-                                           (self.batch_counter+1) * self.batch_size]
+        start = self.batch_counter * self.batch_size
+        if (self.batch_counter+1) * self.batch_size <= self.num_examples:
             self.batch_counter += 1
-            return batch_frames, batch_labels
+            return self._slice(start, start + self.batch_size)
         else:
-            return self.raw_frames[self.batch_counter * self.batch_size:], \
-                   self.raw_labels[self.batch_counter * self.batch_size:]
+            return self._slice(start, self.num_examples)
 
 
 class DataManage4BigData(object):
@@ -89,28 +226,199 @@ class DataManage4BigData(object):
     in each step we can still use next_batch to get batch data
     every step.
     """
-    def __init__(self, config, split_type, number_examples, number_speakers):
+    def __init__(self, config, split_type, number_examples=None, number_speakers=None,
+                 shuffle_buffer_size=None, n_open_shards=1, seed=None, rank=0, world_size=1):
         """
         Parameters
         ----------
         config : ``config`` class
             the config of your model. we will use its batch_size to manage our data
             and save the data to save_path/data.
+        number_examples : ``int``
+            the number of examples, read from the index of the dataset if ``None``.
+        number_speakers : ``int``
+            the number of speakers, read from the index of the dataset if ``None``.
+        shuffle_buffer_size : ``int``
+            If not ``None``, the shard order is permuted every epoch and each batch is
+            drawn at random from an in-memory buffer of at most this many examples.
+            If ``None``, shards are read in order, one shard per batch.
+        n_open_shards : ``int``
+            the number of shards which are read at the same time to fill the buffer.
+        seed : ``int``
+            the seed of the shard permutation and of the buffer sampling.
+        rank : ``int``
+            the index of this worker, see ``set_partition``.
+        world_size : ``int``
+            the number of workers reading the dataset, see ``set_partition``.
         """
         self.batch_size = config.BATCH_SIZE
         self.url = os.path.join(config.SAVE_PATH, 'data', split_type)
         self.num_examples = number_examples
         self.spkr_num = number_speakers
         self.batch_count = 0
+        self.shuffle_buffer_size = shuffle_buffer_size
+        self.n_open_shards = max(1, int(n_open_shards))
+        self.seed = seed
+        self.epoch = 0
+        self._rng = np.random.RandomState(seed)
+        self._buffer = None
+        self._epoch_names = None
+        self.rank = 0
+        self.world_size = 1
         if os.path.exists(self.url) and os.listdir(self.url):
             self.file_is_exist = True
         else:
             self.file_is_exist = False
+        index = _read_index(self.url)
+        if index is not None:
+            if self.num_examples is None:
+                self.num_examples = index['num_examples']
+            if self.spkr_num is None:
+                self.spkr_num = index['spkr_num']
+        self.total_examples = self.num_examples
+        if world_size > 1:
+            self.set_partition(rank, world_size)
+
+    def set_partition(self, rank, world_size, seed=None):
+        """Only read the ``rank``-th of ``world_size`` disjoint parts of the shards.
+
+        Every epoch the shards are permuted by a permutation seeded with
+        ``seed + epoch``, which is the same in every worker, and each worker takes
+        ``n_shards // world_size`` of them. The left shards change every epoch.
+        ``num_examples`` becomes the number of examples this worker reads in the
+        current epoch.
+
+        Parameters
+        ----------
+        rank : ``int``
+            the index of this worker.
+        world_size : ``int``
+            the number of workers.
+        seed : ``int``
+            the seed of the permutation, must be the same in every worker. The
+            ``seed`` of the dataset if None.
+        """
+        assert 0 <= rank < world_size
+        self.rank = rank
+        self.world_size = world_size
+        if seed is not None:
+            self.seed = seed
+        if world_size > 1 and self.seed is None:
+            # workers must use the same permutation.
+            self.seed = 0
+        self._update_partition()
+
+    def _update_partition(self):
+        self._epoch_names = None
+        if self.world_size == 1:
+            self.num_examples = self.total_examples
+            return
+        self._epoch_names = self._epoch_shards()
+        index = _read_index(self.url)
+        lengths = {} if index is None else {shard['name']: shard['length'] for shard in index['shards']}
+        self.num_examples = sum(lengths.get(name, self.batch_size) for name in self._epoch_names)
 
     def reset_batch_counter(self):
         self.batch_count = 0
+        self.epoch += 1
+        self._buffer = None
+        if self.world_size > 1:
+            self._update_partition()
+
+    @property
+    def partition(self):
+        """The shards of this worker in the current epoch, None if it reads all of them."""
+        return self._epoch_names
+
+    @property
+    def shard_names(self):
+        """The file names of all shards, ordered by their index."""
+        index = _read_index(self.url)
+        if index is not None:
+            return [shard['name'] for shard in index['shards']]
+        if not os.path.exists(self.url):
+            return []
+        names = [name for name in os.listdir(self.url)
+                 if name.startswith('data_') and name.endswith('.npz')]
+        return sorted(names, key=_shard_id)
+
+    @property
+    def num_batches(self):
+        """The number of batches in an epoch.
+
+        Without a shuffle buffer it is the number of shards read in an epoch, each of
+        them is one batch. With a shuffle buffer the examples of the epoch are drawn
+        ``batch_size`` at a time, whatever the lengths of the shards.
+        """
+        if self.shuffle_buffer_size is not None:
+            return int(np.ceil(self.num_examples / float(self.batch_size)))
+        if self._epoch_names is not None:
+            return len(self._epoch_names)
+        return len(self.shard_names)
+
+    @property
+    def max_batch_size(self):
+        """The number of examples of the largest shard, read from the index if there is one."""
+        index = _read_index(self.url)
+        if index is not None and index['shards']:
+            return max(shard['length'] for shard in index['shards'])
+        lengths = [len(self._load_labels(name)) for name in self.shard_names]
+        return max(lengths) if lengths else self.batch_size
+
+    def batch_at(self, index):
+        """Return the ``index``-th shard without moving the batch counter."""
+        if self._epoch_names is not None:
+            return self._load_shard(self._epoch_names[index])
+        return self._load_shard(self.shard_names[index])
+
+    def _load_shard(self, name):
+        with np.load(os.path.join(self.url, name)) as loaded:
+            return decode_frames(loaded), loaded['labels']
+
+    def _load_labels(self, name):
+        """Read the labels of a shard without decoding its frames."""
+        with np.load(os.path.join(self.url, name)) as loaded:
+            return loaded['labels']
+
+    def _epoch_shards(self):
+        """Permute the shards of the current epoch and take the part of this worker.
+
+        With a ``seed`` the permutation only depends on ``seed`` and ``epoch``.
+        """
+        names = self.shard_names
+        if self.seed is None:
+            order = self._rng.permutation(len(names))
+        else:
+            order = partition_indices(len(names), self.rank, self.world_size, self.seed, self.epoch)
+        return [names[i] for i in order]
+
+    def open_writer(self, n_workers=4, use_processes=False, append=False,
+                    storage_dtype='float32', codec='npz'):
+        """Open a ``ShardWriter`` which streams data to save_path/data.
+
+        Parameters
+        ----------
+        n_workers : ``int``
+            the number of threads (or processes) writing shards.
+        use_processes : ``bool``
+            use a process pool instead of a thread pool.
+        append : ``bool``
+            add the new data to the existing dataset instead of replacing it.
+        storage_dtype : ``str``
+            the type of the frames on disk, 'float32', 'float16' or 'int8'.
+            'int8' stores a scale and an offset per feature dimension.
+        codec : ``str``
+            the compression of a shard, 'npz' (``np.savez_compressed``), 'none',
+            'zlib' or 'lzma'.
+
+        Returns
+        -------
+        writer : ``ShardWriter``
+        """
+        return ShardWriter(self, n_workers=n_workers, use_processes=use_processes, append=append,
+                           storage_dtype=storage_dtype, codec=codec)
 
-    def write_file(self, raw_frames, raw_labels):
+    def write_file(self, raw_frames, raw_labels, storage_dtype='float32', codec='npz'):
         """Save your data to save_path/data.
 
         Parameters
@@ -119,35 +427,26 @@ class DataManage4BigData(object):
             the feature array of your dataset.
         raw_labels : ``list`` or ``np.ndarray``
             the label array of your dataset.
+        storage_dtype : ``str``
+            the type of the frames on disk, 'float32', 'float16' or 'int8'.
+            'int8' stores a scale and an offset per feature dimension.
+        codec : ``str``
+            the compression of a shard, 'npz' (``np.savez_compressed``), 'none',
+            'zlib' or 'lzma'.
+
+        Notes
+        -----
+        The whole dataset has to be in memory, use ``open_writer`` to write
+        data incrementally.
         """
-        batch_size = self.batch_size
-        local_batch_count = 0
-        np.random.shuffle(raw_frames)
-        np.random.shuffle(raw_labels)
-        self.spkr_num = raw_labels.shape[-1]
-        if type(raw_frames) == np.ndarray:
-            data_length = raw_frames.shape[0]
-            self.num_examples = data_length
-        else:
-            data_length = raw_frames.shape[0]
-            self.num_examples = data_length
-            print("Total number of batches to be written to disk: ", int(data_length//batch_size))
-        while local_batch_count * batch_size < data_length:
-            if batch_size * (local_batch_count+1) >= data_length:
-                frames = raw_frames[local_batch_count * batch_size:]
-                labels = raw_labels[local_batch_count * batch_size:]
-                batch_length = data_length - (local_batch_count * batch_size)
-                print("Writing data to disk : Batch "+str(local_batch_count)+" having length "+str(batch_length))
-                np.savez_compressed(os.path.join(self.url, "data_%d.npz"%local_batch_count), frames=frames, labels=labels)    
-                break
-            else:
-                frames = raw_frames[local_batch_count * batch_size: (local_batch_count+1) * batch_size]
-                labels = raw_labels[local_batch_count * batch_size: (local_batch_count+1) * batch_size]
-                batch_length = ((local_batch_count+1) * batch_size) - (local_batch_count * batch_size)
-                print("Writing data to disk : Batch "+str(local_batch_count)+" having length "+str(batch_length))
-                np.savez_compressed(os.path.join(self.url, "data_%d.npz"%local_batch_count), frames=frames, labels=labels)    
-                local_batch_count += 1
-        self.file_is_exist = True
+        raw_frames = np.asarray(raw_frames)
+        raw_labels = np.asarray(raw_labels)
+        assert len(raw_frames) == len(raw_labels)
+        order = np.random.permutation(len(raw_frames))
+        with self.open_writer(storage_dtype=storage_dtype, codec=codec) as writer:
+            for start in range(0, len(order), self.batch_size):
+                chosen = order[start:start + self.batch_size]
+                writer.write(raw_frames[chosen], raw_labels[chosen])
 
     @property
     def next_batch(self):
@@ -165,12 +464,1155 @@ class DataManage4BigData(object):
         we will check if the data is saved. If you didn't save the data
         you will get log and two empty array.
 
+        If ``shuffle_buffer_size`` is set, the last batch of an epoch may be
+        smaller than ``batch_size``, after it two empty arrays are returned until
+        ``reset_batch_counter`` starts the next epoch.
         """
         if not self.file_is_exist:
             print('You need write file before load it.')
             return np.array([]), np.array([])
-        loaded = np.load(os.path.join(self.url, "data_%d.npz"%self.batch_count))
-        frames = loaded['frames']
-        labels = loaded['labels']
+        if self.shuffle_buffer_size is None and self._epoch_names is not None:
+            if self.batch_count >= len(self._epoch_names):
+                return np.array([]), np.array([])
+            frames, labels = self._load_shard(self._epoch_names[self.batch_count])
+        elif self.shuffle_buffer_size is None:
+            frames, labels = self._load_shard("data_%d.npz" % self.batch_count)
+        else:
+            if self._buffer is None:
+                self._buffer = _ShuffleBuffer(self, self._epoch_shards())
+            frames, labels = self._buffer.next_batch(self.batch_size)
         self.batch_count += 1
         return frames, labels
+
+
+class _ShuffleBuffer(object):
+    """Interleave several shards into a bounded buffer and sample batches from it.
+
+    The buffer is a fixed array of ``shuffle_buffer_size`` slots. A batch takes
+    random slots, which are refilled in place from the open shards, so a batch
+    only copies ``batch_size`` examples. At most ``n_open_shards`` shards are
+    held in memory besides the buffer.
+    """
+    def __init__(self, manager, shards):
+        self._manager = manager
+        self._pending = list(shards)
+        self._open = []
+        self._turn = 0
+        self._frames = None
+        self._labels = None
+        self._size = 0
+
+    def _read(self, n):
+        """Read up to ``n`` examples, a chunk of every open shard in turn."""
+        n_open = self._manager.n_open_shards
+        chunk = max(1, self._manager.batch_size // n_open)
+        pieces = []
+        while n > 0:
+            while len(self._open) < n_open and self._pending:
+                frames, labels = self._manager._load_shard(self._pending.pop(0))
+                self._open.append([frames, labels, 0])
+            if not self._open:
+                break
+            turn = self._turn % len(self._open)
+            shard = self._open[turn]
+            frames, labels, pos = shard
+            taken = min(chunk, n, len(frames) - pos)
+            if taken > 0:
+                pieces.append((frames[pos:pos + taken], labels[pos:pos + taken]))
+            shard[2] = pos + taken
+            n -= taken
+            if shard[2] >= len(frames):
+                # the next shard takes the turn of the finished one.
+                del self._open[turn]
+            else:
+                self._turn += 1
+        return pieces
+
+    def _put(self, slots, pieces):
+        start = 0
+        for frames, labels in pieces:
+            rows = slots[start:start + len(frames)]
+            self._frames[rows] = frames
+            self._labels[rows] = labels
+            start += len(frames)
+        return start
+
+    def _sample(self, k):
+        """Draw ``k`` distinct slots, in O(k) when the buffer is much larger than a batch."""
+        rng = self._manager._rng
+        if 2 * k > self._size:
+            return rng.permutation(self._size)[:k]
+        chosen = np.unique(rng.randint(0, self._size, k))
+        while len(chosen) < k:
+            chosen = np.unique(np.concatenate([chosen, rng.randint(0, self._size, k - len(chosen))]))
+        rng.shuffle(chosen)
+        return chosen
+
+    def next_batch(self, batch_size):
+        if self._frames is None:
+            capacity = self._manager.shuffle_buffer_size
+            pieces = self._read(capacity)
+            if not pieces:
+                return np.array([]), np.array([])
+            frames, labels = pieces[0]
+            self._frames = np.empty((capacity,) + frames.shape[1:], dtype=frames.dtype)
+            self._labels = np.empty((capacity,) + labels.shape[1:], dtype=labels.dtype)
+            self._size = self._put(np.arange(capacity), pieces)
+        if self._size == 0:
+            return np.array([]), np.array([])
+        chosen = self._sample(min(batch_size, self._size))
+        frames, labels = self._frames[chosen], self._labels[chosen]
+        n_new = self._put(chosen, self._read(len(chosen)))
+        holes = chosen[n_new:]
+        if len(holes):
+            # the shards are exhausted: move the last examples into the free slots.
+            size = self._size - len(holes)
+            movers = np.setdiff1d(np.arange(size, self._size), holes)
+            targets = holes[holes < size]
+            self._frames[targets] = self._frames[movers]
+            self._labels[targets] = self._labels[movers]
+            self._size = size
+        return frames, labels
+
+
+class ShardWriter(object):
+    """
+    Use ``ShardWriter`` to write a dataset of ``DataManage4BigData`` incrementally.
+    Every ``batch_size`` examples are written to one shard by a thread (or process)
+    pool, and the number of examples and speakers is saved in an index file.
+    """
+    def __init__(self, manager, n_workers=4, use_processes=False, append=False,
+                 storage_dtype='float32', codec='npz'):
+        """
+        Parameters
+        ----------
+        manager : ``DataManage4BigData``
+            the dataset to write. Its counters are updated when the writer is closed.
+        n_workers : ``int``
+            the number of threads (or processes) writing shards.
+        use_processes : ``bool``
+            use a process pool instead of a thread pool.
+        append : ``bool``
+            add the new data to the existing dataset instead of replacing it.
+        storage_dtype : ``str``
+            the type of the frames on disk, 'float32', 'float16' or 'int8'.
+            'int8' stores a scale and an offset per feature dimension.
+        codec : ``str``
+            the compression of a shard, 'npz' (``np.savez_compressed``), 'none',
+            'zlib' or 'lzma'.
+        """
+        if storage_dtype not in STORAGE_DTYPES:
+            raise ValueError("storage_dtype must be one of %s." % str(STORAGE_DTYPES))
+        if codec not in CODECS:
+            raise ValueError("codec must be one of %s." % str(CODECS))
+        self._storage_dtype = storage_dtype
+        self._codec = codec
+        self._manager = manager
+        self._url = manager.url
+        self._shard_size = manager.batch_size
+        self._n_workers = n_workers
+        if not os.path.exists(self._url):
+            os.makedirs(self._url)
+        if not append:
+            # the readers glob the directory, so the shards of the old dataset must go.
+            _remove_shards(self._url)
+        index = None
+        if append:
+            index = _read_index(self._url)
+            if index is None and manager.shard_names:
+                index = _scan_index(manager)
+        if index is None:
+            index = {'num_examples': 0, 'spkr_num': 0, 'speaker_counts': [], 'shards': []}
+        self._index = index
+        self._speaker_counts = np.array(index['speaker_counts'], dtype=np.int64)
+        if index['shards']:
+            self._next_shard = max(_shard_id(shard['name']) for shard in index['shards']) + 1
+        else:
+            self._next_shard = 0
+        self._pending_frames = []
+        self._pending_labels = []
+        self._pending_size = 0
+        self._futures = []
+        if use_processes:
+            self._pool = ProcessPoolExecutor(max_workers=n_workers)
+        else:
+            self._pool = ThreadPoolExecutor(max_workers=n_workers)
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, frames, labels):
+        """Add a chunk of data, a shard is written every ``batch_size`` examples.
+
+        Parameters
+        ----------
+        frames : ``list`` or ``np.ndarray``
+            the feature array of the chunk.
+        labels : ``list`` or ``np.ndarray``
+            the label array of the chunk, one-hot or speaker id.
+        """
+        frames = np.asarray(frames)
+        labels = np.asarray(labels)
+        assert len(frames) == len(labels)
+        self._pending_frames.append(frames)
+        self._pending_labels.append(labels)
+        self._pending_size += len(frames)
+        if self._pending_size >= self._shard_size:
+            frames = np.concatenate(self._pending_frames, 0)
+            labels = np.concatenate(self._pending_labels, 0)
+            n_full = self._pending_size - self._pending_size % self._shard_size
+            for start in range(0, n_full, self._shard_size):
+                self._submit(frames[start:start + self._shard_size],
+                             labels[start:start + self._shard_size])
+            self._pending_frames = [frames[n_full:]]
+            self._pending_labels = [labels[n_full:]]
+            self._pending_size -= n_full
+
+    def write_from(self, iterable):
+        """Write every ``(frames, labels)`` chunk of ``iterable``, e.g. a feature generator."""
+        for frames, labels in iterable:
+            self.write(frames, labels)
+
+    def close(self):
+        """Write the last (partial) shard and the index, and wait for all shards."""
+        if self._closed:
+            return
+        if self._pending_size:
+            self._submit(np.concatenate(self._pending_frames, 0),
+                         np.concatenate(self._pending_labels, 0))
+        self._pending_frames, self._pending_labels, self._pending_size = [], [], 0
+        for future in self._futures:
+            future.result()
+        self._pool.shutdown()
+        self._index['speaker_counts'] = self._speaker_counts.tolist()
+        self._index['spkr_num'] = max(self._index['spkr_num'], len(self._speaker_counts))
+        _write_index(self._url, self._index)
+        self._manager.total_examples = self._index['num_examples']
+        self._manager.num_examples = self._index['num_examples']
+        self._manager.spkr_num = self._index['spkr_num']
+        self._manager.file_is_exist = True
+        self._manager.set_partition(self._manager.rank, self._manager.world_size)
+        self._closed = True
+
+    def abort(self):
+        """Stop writing without writing the last shard and the index, e.g. after an error.
+
+        The shards already written stay on disk, but the index is not updated, so
+        an appended dataset keeps its old index.
+        """
+        if self._closed:
+            return
+        for future in self._futures:
+            future.cancel()
+        self._pool.shutdown()
+        self._pending_frames, self._pending_labels, self._pending_size = [], [], 0
+        self._closed = True
+
+    def _submit(self, frames, labels):
+        name = "data_%d.npz" % self._next_shard
+        self._next_shard += 1
+        ids, n_speaker = _speaker_ids(labels)
+        counts = np.bincount(ids, minlength=max(n_speaker, len(self._speaker_counts)))
+        counts[:len(self._speaker_counts)] += self._speaker_counts
+        self._speaker_counts = counts
+        self._index['num_examples'] += len(frames)
+        self._index['shards'].append({'name': name, 'length': len(frames),
+                                      'storage_dtype': self._storage_dtype, 'codec': self._codec})
+        # bound the number of shards waiting in memory.
+        while len(self._futures) >= 2 * self._n_workers:
+            self._futures.pop(0).result()
+        self._futures.append(self._pool.submit(_write_shard, os.path.join(self._url, name),
+                                               frames, labels, self._storage_dtype, self._codec))
+
+
+class SpeakerBalancedSampler(object):
+    """
+    Use ``SpeakerBalancedSampler`` to draw batches of P speakers x K utterances
+    from a ``DataManage`` or ``DataManage4BigData``, e.g. for triplet loss.
+
+    The examples of an epoch are split into windows: all the examples of a
+    ``DataManage``, or ``cache_size`` shards of a ``DataManage4BigData``, which are
+    loaded once and kept in memory while their batches are drawn. The shards are
+    permuted every epoch, so the windows change. Every speaker of a window is drawn
+    at least once in its window, and every utterance of a speaker in a window is
+    drawn once before any of them is drawn again, so ``cache_size`` should be large
+    enough for a window to hold about K utterances of its speakers.
+
+    If the dataset has a partition, see ``set_partition``, only the examples or the
+    shards of this worker in the current epoch are drawn.
+    """
+    def __init__(self, data, config, n_speakers, n_utterances=None, seed=None, cache_size=8):
+        """
+        Parameters
+        ----------
+        data : ``DataManage`` or ``DataManage4BigData``
+            the dataset to sample from.
+        config : ``config`` class
+            the config of your model, we use its 'batch_size' member if
+            ``n_utterances`` is ``None``.
+        n_speakers : ``int``
+            P, the number of speakers in a batch.
+        n_utterances : ``int``
+            K, the number of utterances of each speaker in a batch.
+            Default is ``config.BATCH_SIZE // n_speakers``.
+        seed : ``int``
+            the seed of the sampler.
+        cache_size : ``int``
+            the number of shards of a ``DataManage4BigData`` in a window.
+        """
+        if n_utterances is None:
+            n_utterances = config.BATCH_SIZE // n_speakers
+        assert n_speakers > 0 and n_utterances > 0 and cache_size > 0
+        self._data = data
+        self.n_speakers = n_speakers
+        self.n_utterances = n_utterances
+        self.batch_size = n_speakers * n_utterances
+        self.spkr_num = data.spkr_num
+        self._rng = np.random.RandomState(seed)
+        self._cache_size = cache_size
+        self._resident = {}
+
+        # (shard, row) of every example, the shard is -1 for in-memory data.
+        if hasattr(data, 'raw_labels'):
+            self._shard_names = None
+            ids, _ = _speaker_ids(data.raw_labels)
+            self._shards = np.full(len(ids), -1, dtype=np.int64)
+            self._rows = np.arange(len(ids))
+        else:
+            # only the labels are read, the frames of a shard are loaded with its window.
+            self._shard_names = data.shard_names
+            ids, shards, rows = [], [], []
+            for shard, name in enumerate(self._shard_names):
+                shard_ids, _ = _speaker_ids(data._load_labels(name))
+                ids.append(shard_ids)
+                shards.append(np.full(len(shard_ids), shard, dtype=np.int64))
+                rows.append(np.arange(len(shard_ids)))
+            ids, self._shards, self._rows = [np.concatenate(a) if a else np.zeros(0, dtype=np.int64)
+                                             for a in (ids, shards, rows)]
+            starts = np.concatenate([[0], np.cumsum([len(a) for a in rows])])
+            self._shard_examples = [np.arange(starts[k], starts[k + 1]) for k in range(len(rows))]
+            self._shard_index = {name: shard for shard, name in enumerate(self._shard_names)}
+        self._ids = ids
+        self._speakers = np.unique(ids)
+        if len(self._speakers) == 0:
+            raise ValueError("The dataset is empty.")
+        self._in_window = np.zeros(self._speakers[-1] + 1, dtype=bool)
+        if self._shard_names is None:
+            # a single window, its cycles go on from epoch to epoch.
+            self._set_members(np.arange(len(ids)))
+        self._start_epoch()
+
+    @property
+    def num_batches(self):
+        """The number of batches of the current epoch."""
+        return self.epoch_size
+
+    def reset_batch_counter(self):
+        # the dataset moves its partition to the next epoch.
+        self._data.reset_batch_counter()
+        self._start_epoch()
+
+    def set_partition(self, rank, world_size, seed=None):
+        """Only draw from the ``rank``-th of ``world_size`` disjoint parts of the dataset.
+
+        The parts are the ones of the ``set_partition`` of the dataset, they change
+        every epoch. The current epoch starts again from the part of this worker.
+
+        Parameters
+        ----------
+        rank : ``int``
+            the index of this worker.
+        world_size : ``int``
+            the number of workers.
+        seed : ``int``
+            the seed of the partition, must be the same in every worker. The seed
+            of the dataset if None.
+        """
+        self._data.set_partition(rank, world_size, seed)
+        if self._shard_names is None and self._data.partition is None:
+            self._set_members(np.arange(len(self._ids)))
+        self._start_epoch()
+
+    def _seeds_per_batch(self):
+        return self.n_speakers
+
+    def _start_epoch(self):
+        """Split the examples of the epoch into windows and count their batches."""
+        partition = getattr(self._data, 'partition', None)
+        if self._shard_names is None:
+            if partition is not None:
+                self._set_members(partition)
+            self._windows = [None]
+            counts = [len(self._active)]
+        else:
+            if partition is None:
+                shards = np.arange(len(self._shard_names))
+            else:
+                shards = np.array([self._shard_index[name] for name in partition], dtype=np.int64)
+            order = self._rng.permutation(shards)
+            self._windows = [order[start:start + self._cache_size]
+                             for start in range(0, len(order), self._cache_size)]
+            counts = [len(np.unique(self._ids[np.concatenate([self._shard_examples[k] for k in shards])]))
+                      for shards in self._windows]
+        seeds = self._seeds_per_batch()
+        self._window_batches = [int(np.ceil(count / float(seeds))) for count in counts]
+        self.epoch_size = sum(self._window_batches)
+        self.num_examples = self.epoch_size * self.batch_size
+        self.batch_counter = 0
+        self._window = -1
+        self._window_batch = 0
+
+    def _enter(self, window):
+        """Load the shards of a window and draw the order of its speakers."""
+        self._window = window
+        self._window_batch = 0
+        shards = self._windows[window]
+        if shards is not None:
+            self._resident = {shard: self._resident[shard] if shard in self._resident
+                              else self._data._load_shard(self._shard_names[shard]) for shard in shards}
+            self._set_members(np.concatenate([self._shard_examples[shard] for shard in shards]))
+        self._epoch_speakers = self._rng.permutation(self._active)
+
+    def _set_members(self, examples):
+        order = examples[np.argsort(self._ids[examples], kind='mergesort')]
+        speakers, starts = np.unique(self._ids[order], return_index=True)
+        bounds = np.append(starts, len(order))
+        self._members = {spkr: order[bounds[k]:bounds[k + 1]] for k, spkr in enumerate(speakers)}
+        self._active = speakers
+        self._in_window[:] = False
+        self._in_window[speakers] = True
+        self._cycle = {spkr: self._rng.permutation(members) for spkr, members in self._members.items()}
+        self._cursor = dict.fromkeys(self._members, 0)
+
+    def _next_seeds(self):
+        """Enter the next window if needed and return the seed speakers of the next batch."""
+        while self._window < 0 or self._window_batch >= self._window_batches[self._window]:
+            self._enter(self._window + 1)
+        seeds = self._seeds_per_batch()
+        start = self._window_batch * seeds
+        self._window_batch += 1
+        self.batch_counter += 1
+        return self._epoch_speakers[start:start + seeds]
+
+    def _fill(self, speakers):
+        """Fill a batch with other speakers of the window."""
+        if len(speakers) < self.n_speakers:
+            others = np.setdiff1d(self._active, speakers)
+            n_extra = min(self.n_speakers - len(speakers), len(others))
+            speakers += list(self._rng.choice(others, n_extra, replace=False))
+        return speakers
+
+    @property
+    def next_batch(self):
+        """``property`` to get next batch data.
+
+        Returns
+        -------
+        batch_frames : ``np.ndarray``
+            P x K examples, the K examples of a speaker are adjacent.
+        batch_labels : ``np.ndarray``
+            the labels, in the format of the dataset.
+
+        Notes
+        -----
+        After ``epoch_size`` batches, two empty arrays are returned until
+        ``reset_batch_counter`` starts the next epoch.
+        """
+        if self.batch_counter >= self.epoch_size:
+            return np.array([]), np.array([])
+        speakers = self._fill(list(self._next_seeds()))
+        examples = np.concatenate([self._take(spkr) for spkr in speakers])
+        return self._gather(examples)
+
+    def _take(self, spkr):
+        """Take the next K utterances of a speaker."""
+        taken = []
+        n_taken = 0
+        while n_taken < self.n_utterances:
+            cycle = self._cycle[spkr]
+            if self._cursor[spkr] >= len(cycle):
+                self._cycle[spkr] = cycle = self._rng.permutation(self._members[spkr])
+                self._cursor[spkr] = 0
+            cursor = self._cursor[spkr]
+            taken.append(cycle[cursor:cursor + self.n_utterances - n_taken])
+            n_taken += len(taken[-1])
+            self._cursor[spkr] = cursor + len(taken[-1])
+        return np.concatenate(taken)
+
+    def _gather(self, examples):
+        shards = self._shards[examples]
+        rows = self._rows[examples]
+        if shards[0] < 0:
+            return self._data.raw_frames[rows], self._data.raw_labels[rows]
+        frames, labels = None, None
+        for shard in np.unique(shards):
+            shard_frames, shard_labels = self._resident[shard]
+            if frames is None:
+                frames = np.empty((len(examples),) + shard_frames.shape[1:], dtype=shard_frames.dtype)
+                labels = np.empty((len(examples),) + shard_labels.shape[1:], dtype=shard_labels.dtype)
+            in_shard = shards == shard
+            frames[in_shard] = shard_frames[rows[in_shard]]
+            labels[in_shard] = shard_labels[rows[in_shard]]
+        return frames, labels
+
+
+class HardNegativeSampler(SpeakerBalancedSampler):
+    """
+    Use ``HardNegativeSampler`` to draw batches of P speakers x K utterances made of
+    groups of speakers close to each other, so the batches contain more hard triplets.
+
+    Each group is a seed speaker and its ``group_size - 1`` nearest speakers in an
+    ``EmbeddingBank``. The bank is fed by ``observe`` with the features of the
+    training batches, which the training loops call after each step. The groups are
+    drawn window by window as in ``SpeakerBalancedSampler``: every speaker of a window
+    is a seed at least once in the window, the neighbours are taken among the speakers
+    of the window, and the speakers without a row in the bank yet are grouped with
+    random speakers.
+    """
+    def __init__(self, data, config, n_speakers, n_utterances=None, group_size=4, bank=None,
+                 refresh_steps=100, seed=None, cache_size=8):
+        """
+        Parameters
+        ----------
+        data : ``DataManage`` or ``DataManage4BigData``
+            the dataset to sample from.
+        config : ``config`` class
+            the config of your model, we use its 'batch_size' and 'n_speaker' members.
+        n_speakers : ``int``
+            P, the number of speakers in a batch.
+        n_utterances : ``int``
+            K, the number of utterances of each speaker in a batch.
+            Default is ``config.BATCH_SIZE // n_speakers``.
+        group_size : ``int``
+            the number of speakers of a group, P // group_size seeds are drawn per batch.
+        bank : ``pyasv.backend.bank.EmbeddingBank``
+            the bank of speaker vectors. If None, a bank refreshed every ``refresh_steps``
+            batches is created by the first ``observe``, with the dim of the features.
+        refresh_steps : ``int``
+            see ``bank``.
+        seed : ``int``
+            the seed of the sampler.
+        cache_size : ``int``
+            the number of shards of a ``DataManage4BigData`` in a window.
+        """
+        assert 0 < group_size <= n_speakers
+        self.group_size = group_size
+        self.n_groups = n_speakers // group_size
+        self.bank = bank
+        self._n_speaker = config.N_SPEAKER
+        self._refresh_steps = refresh_steps
+        super(HardNegativeSampler, self).__init__(data, config, n_speakers, n_utterances, seed, cache_size)
+
+    def observe(self, features, labels):
+        """Add the features of a training batch to the bank.
+
+        Parameters
+        ----------
+        features : ``np.ndarray``
+            ``[batch, dim]`` features.
+        labels : ``np.ndarray``
+            the labels of the batch.
+        """
+        if self.bank is None:
+            # the features of the model decide the dim of the bank, e.g. 400 for CTDnn.
+            self.bank = EmbeddingBank(self._n_speaker, np.shape(features)[-1], self._refresh_steps)
+        self.bank.observe(features, labels)
+
+    @property
+    def next_batch(self):
+        """``property`` to get next batch data.
+
+        Returns
+        -------
+        batch_frames : ``np.ndarray``
+            P x K examples, the K examples of a speaker are adjacent and the
+            speakers of a group are adjacent.
+        batch_labels : ``np.ndarray``
+            the labels, in the format of the dataset.
+
+        Notes
+        -----
+        After ``epoch_size`` batches, two empty arrays are returned until
+        ``reset_batch_counter`` starts the next epoch.
+        """
+        if self.batch_counter >= self.epoch_size:
+            return np.array([]), np.array([])
+        speakers = self._fill(self._group(self._next_seeds()))
+        examples = np.concatenate([self._take(spkr) for spkr in speakers])
+        return self._gather(examples)
+
+    def _seeds_per_batch(self):
+        return self.n_groups
+
+    def _group(self, seeds):
+        """Return the seeds followed by their nearest speakers which are not in the batch yet."""
+        if self.bank is None:
+            return list(seeds)
+        speakers = []
+        chosen = set()
+        # more candidates than needed, as the groups of close seeds overlap.
+        ids, scores = self.bank.neighbours(seeds, self.group_size * 2)
+        for seed, seed_ids, seed_scores in zip(seeds, ids, scores):
+            if seed in chosen:
+                continue
+            group = [seed]
+            chosen.add(seed)
+            for spkr, score in zip(seed_ids, seed_scores):
+                if len(group) == self.group_size or not np.isfinite(score):
+                    break
+                if spkr < len(self._in_window) and self._in_window[spkr] and spkr not in chosen:
+                    group.append(spkr)
+                    chosen.add(spkr)
+            speakers += group
+        return speakers
+
+
+class UtteranceStore(object):
+    """
+    Use ``UtteranceStore`` to keep utterance-level feature matrices on disk.
+    The frames of all utterances are saved in one flat file, which is memory-mapped,
+    so reading any part of an utterance does not load the others.
+    """
+    def __init__(self, url):
+        """
+        Parameters
+        ----------
+        url : ``str``
+            the directory written by ``UtteranceStore.write``.
+        """
+        with open(os.path.join(url, 'store.json'), 'r') as f:
+            meta = json.load(f)
+        self.url = url
+        self.dim = meta['dim']
+        self.spkr_num = meta['spkr_num']
+        self.num_frames = meta['num_frames']
+        self.frames = np.memmap(os.path.join(url, 'frames.bin'), dtype=meta['dtype'], mode='r',
+                                shape=(self.num_frames, self.dim))
+        self.offsets = np.load(os.path.join(url, 'offsets.npy'))
+        self.labels = np.load(os.path.join(url, 'labels.npy'))
+        self.lengths = np.diff(self.offsets)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def utterance(self, index):
+        """Return the feature matrix and the label of the ``index``-th utterance."""
+        return self.frames[self.offsets[index]:self.offsets[index + 1]], self.labels[index]
+
+    @staticmethod
+    def write(url, samples, dtype='float32'):
+        """Write utterances to ``url``, one at a time.
+
+        Parameters
+        ----------
+        url : ``str``
+            the directory of the store.
+        samples : ``iterable``
+            ``(feature, label)`` pairs, ``feature`` is a ``[frames, dim]`` matrix and
+            ``label`` the speaker id, e.g. from ``speech_processing.iter_utterance_features``.
+        dtype : ``str``
+            the type of the frames on disk.
+
+        Returns
+        -------
+        store : ``UtteranceStore``
+        """
+        if not os.path.exists(url):
+            os.makedirs(url)
+        offsets = [0]
+        labels = []
+        dim = None
+        with open(os.path.join(url, 'frames.bin'), 'wb') as f:
+            for feature, label in samples:
+                feature = np.asarray(feature, dtype=dtype)
+                feature = feature.reshape(feature.shape[0], -1)
+                if dim is None:
+                    dim = feature.shape[1]
+                elif feature.shape[1] != dim:
+                    raise ValueError("All features must have dim %d, got %d." % (dim, feature.shape[1]))
+                f.write(feature.tobytes())
+                offsets.append(offsets[-1] + feature.shape[0])
+                labels.append(int(label))
+        np.save(os.path.join(url, 'offsets.npy'), np.array(offsets, dtype=np.int64))
+        np.save(os.path.join(url, 'labels.npy'), np.array(labels, dtype=np.int64))
+        meta = {'dim': dim, 'dtype': dtype, 'num_frames': offsets[-1],
+                'spkr_num': max(labels) + 1 if labels else 0}
+        with open(os.path.join(url, 'store.json'), 'w') as f:
+            json.dump(meta, f)
+        return UtteranceStore(url)
+
+
+class SegmentSampler(object):
+    """
+    Use ``SegmentSampler`` to draw random fixed-length crops of the utterances of an
+    ``UtteranceStore``, e.g. the 100 frame inputs of DeepSpeaker. Every batch has
+    fresh segments, and nothing is pre-cut or stored twice.
+    """
+    def __init__(self, store, config, segment_length=100, crop_lengths=None, seed=None):
+        """
+        Parameters
+        ----------
+        store : ``UtteranceStore``
+            the utterances.
+        config : ``config`` class
+            the config of your model, we use its 'batch_size' and 'n_speaker' members.
+        segment_length : ``int``
+            the number of frames of a crop.
+        crop_lengths : ``list``
+            If not ``None``, each batch uses one of these lengths, drawn at random,
+            instead of ``segment_length``. The models of ``pyasv.model`` are trained on
+            inputs of a fixed number of frames, so ``pyasv.engine.Trainer`` refuses a
+            sampler with crops of another length; several lengths are only for your
+            own training loops of variable-length models.
+        seed : ``int``
+            the seed of the sampler and of the partition, see ``set_partition``.
+        """
+        self._store = store
+        self.batch_size = config.BATCH_SIZE
+        self.n_speaker = config.N_SPEAKER
+        self.spkr_num = store.spkr_num
+        self.crop_lengths = list(crop_lengths) if crop_lengths else [segment_length]
+        self.seed = seed
+        self._rng = np.random.RandomState(seed)
+        # the seed of batch_at, which only depends on it, the epoch and the index.
+        self._batch_seed = self._rng.randint(2 ** 31)
+        self.batch_counter = 0
+        self.epoch = 0
+        self.rank = 0
+        self.world_size = 1
+        self._update_partition()
+
+    def set_partition(self, rank, world_size, seed=None):
+        """Only crop the ``rank``-th of ``world_size`` disjoint parts of the utterances.
+
+        Every epoch the utterances are permuted by a permutation seeded with
+        ``seed + epoch``, which is the same in every worker, and each worker takes
+        ``len(store) // world_size`` of them, see ``partition_indices``.
+
+        Parameters
+        ----------
+        rank : ``int``
+            the index of this worker.
+        world_size : ``int``
+            the number of workers.
+        seed : ``int``
+            the seed of the permutation, must be the same in every worker. The
+            ``seed`` of the sampler if None.
+        """
+        assert 0 <= rank < world_size
+        self.rank = rank
+        self.world_size = world_size
+        if seed is not None:
+            self.seed = seed
+        if world_size > 1 and self.seed is None:
+            # workers must use the same permutation.
+            self.seed = 0
+        self._update_partition()
+
+    def _update_partition(self):
+        """Find the utterances of the current epoch which are long enough for each crop length."""
+        if self.world_size == 1:
+            utterances = np.arange(len(self._store))
+        else:
+            utterances = np.sort(partition_indices(len(self._store), self.rank, self.world_size,
+                                                   self.seed, self.epoch))
+        lengths = self._store.lengths[utterances]
+        # drawn in proportion to their crops.
+        self._eligible = {}
+        for length in self.crop_lengths:
+            eligible = utterances[lengths >= length]
+            if len(eligible) == 0:
+                raise ValueError("No utterance has %d frames." % length)
+            n_crops = (self._store.lengths[eligible] - length + 1).astype(np.float64)
+            self._eligible[length] = (eligible, n_crops / n_crops.sum())
+        self.num_examples = int(lengths.sum() / np.mean(self.crop_lengths))
+        self.epoch_size = self.num_examples / self.batch_size
+
+    def reset_batch_counter(self):
+        self.batch_counter = 0
+        self.epoch += 1
+        if self.world_size > 1:
+            self._update_partition()
+
+    @property
+    def num_batches(self):
+        """The number of batches in an epoch."""
+        return int(np.ceil(self.epoch_size))
+
+    def batch_at(self, index):
+        """Return the ``index``-th batch of the epoch, the same for the same epoch and index.
+
+        It does not move the batch counter and can be called from several threads
+        or processes, e.g. by ``pyasv.data_loader.MultiProcessLoader``.
+        """
+        rng = np.random.RandomState((self._batch_seed + 1000003 * self.epoch + index) % 2 ** 32)
+        return self._crop(rng)
+
+    @property
+    def next_batch(self):
+        """``property`` to get next batch data.
+
+        Returns
+        -------
+        batch_frames : ``np.ndarray``
+            ``[batch_size, length, dim]`` crops, all crops of a batch have the same length.
+        batch_labels : ``np.ndarray``
+            one-hot labels.
+        """
+        self.batch_counter += 1
+        return self._crop(self._rng)
+
+    def _crop(self, rng):
+        length = self.crop_lengths[rng.randint(len(self.crop_lengths))]
+        eligible, probability = self._eligible[length]
+        chosen = rng.choice(eligible, self.batch_size, p=probability)
+        starts = self._store.offsets[chosen] + \
+            (rng.rand(self.batch_size) * (self._store.lengths[chosen] - length + 1)).astype(np.int64)
+        # read the memory-mapped file in order.
+        order = np.argsort(starts)
+        starts, chosen = starts[order], chosen[order]
+        frames = np.asarray(self._store.frames[starts[:, None] + np.arange(length)], dtype=np.float32)
+        labels = np.eye(self.n_speaker, dtype=np.float32)[self._store.labels[chosen]]
+        return frames, labels
+
+
+class BucketBatcher(object):
+    """
+    Use ``BucketBatcher`` to batch whole utterances of an ``UtteranceStore``.
+    Utterances are grouped by length into buckets and a batch only contains
+    utterances of one bucket, so it is padded to the longest of them and not
+    to the longest utterance of the dataset.
+    """
+    def __init__(self, store, config, bucket_edges, seed=None):
+        """
+        Parameters
+        ----------
+        store : ``UtteranceStore``
+            the utterances.
+        config : ``config`` class
+            the config of your model, we use its 'batch_size' and 'n_speaker' members.
+        bucket_edges : ``list``
+            the upper lengths of the buckets, e.g. ``[200, 400, 800]``.
+            Longer utterances are put in a last bucket.
+        seed : ``int``
+            the seed of the batch order and of the partition, see ``set_partition``.
+        """
+        self._store = store
+        self.batch_size = config.BATCH_SIZE
+        self.n_speaker = config.N_SPEAKER
+        self.spkr_num = store.spkr_num
+        self.bucket_edges = sorted(bucket_edges)
+        self.seed = seed
+        self._rng = np.random.RandomState(seed)
+        self.epoch = 0
+        self.rank = 0
+        self.world_size = 1
+        self._start_epoch()
+
+    def reset_batch_counter(self):
+        self.epoch += 1
+        self._start_epoch()
+
+    def set_partition(self, rank, world_size, seed=None):
+        """Only batch the ``rank``-th of ``world_size`` disjoint parts of the utterances.
+
+        The parts change every epoch as in ``SegmentSampler.set_partition``, the
+        batches of the current epoch are drawn again from the part of this worker.
+
+        Parameters
+        ----------
+        rank : ``int``
+            the index of this worker.
+        world_size : ``int``
+            the number of workers.
+        seed : ``int``
+            the seed of the permutation, must be the same in every worker. The
+            ``seed`` of the batcher if None.
+        """
+        assert 0 <= rank < world_size
+        self.rank = rank
+        self.world_size = world_size
+        if seed is not None:
+            self.seed = seed
+        if world_size > 1 and self.seed is None:
+            # workers must use the same permutation.
+            self.seed = 0
+        self._start_epoch()
+
+    def _start_epoch(self):
+        """Cut the utterances of this worker in the current epoch to batches."""
+        if self.world_size == 1:
+            self._batches = _bucket_batches(self._store.lengths, self.bucket_edges, self.batch_size, self._rng)
+            self.num_examples = len(self._store)
+        else:
+            utterances = partition_indices(len(self._store), self.rank, self.world_size, self.seed, self.epoch)
+            self._batches = [utterances[batch] for batch in _bucket_batches(self._store.lengths[utterances],
+                                                                            self.bucket_edges, self.batch_size,
+                                                                            self._rng)]
+            self.num_examples = len(utterances)
+        self.epoch_size = len(self._batches)
+        self.batch_counter = 0
+
+    @property
+    def next_batch(self):
+        """``property`` to get next batch data.
+
+        Returns
+        -------
+        batch_frames : ``np.ndarray``
+            ``[batch, max_length, dim]`` utterances, padded with zeros.
+        batch_labels : ``np.ndarray``
+            one-hot labels.
+        batch_lengths : ``np.ndarray``
+            the number of frames of each utterance.
+        batch_mask : ``np.ndarray``
+            ``[batch, max_length]``, 1 for frames and 0 for padding.
+
+        Notes
+        -----
+        After ``epoch_size`` batches, empty arrays are returned until
+        ``reset_batch_counter`` starts the next epoch.
+        """
+        if self.batch_counter >= len(self._batches):
+            return np.array([]), np.array([]), np.array([]), np.array([])
+        chosen = self._batches[self.batch_counter]
+        self.batch_counter += 1
+        lengths = self._store.lengths[chosen]
+        frames = np.zeros((len(chosen), lengths.max(), self._store.dim), dtype=np.float32)
+        for row, index in enumerate(chosen):
+            frames[row, :lengths[row]], _ = self._store.utterance(index)
+        mask = (np.arange(lengths.max()) < lengths[:, None]).astype(np.float32)
+        labels = np.eye(self.n_speaker, dtype=np.float32)[self._store.labels[chosen]]
+        return frames, labels, lengths, mask
+
+    def padding_report(self):
+        """The padding overhead of the buckets, see ``padding_report``."""
+        return padding_report(self._store.lengths, self.bucket_edges, self.batch_size)
+
+
+def _bucket_batches(lengths, bucket_edges, batch_size, rng):
+    """Shuffle the utterances of each bucket, cut them to batches and shuffle the batches."""
+    buckets = np.searchsorted(bucket_edges, lengths, side='left')
+    batches = []
+    for bucket in np.unique(buckets):
+        members = rng.permutation(np.nonzero(buckets == bucket)[0])
+        batches += [members[i:i + batch_size] for i in range(0, len(members), batch_size)]
+    return [batches[i] for i in rng.permutation(len(batches))]
+
+
+def padding_report(lengths, bucket_edges, batch_size, seed=0):
+    """Measure the padding of length-bucketed batches, to tune the bucket edges.
+
+    Parameters
+    ----------
+    lengths : ``np.ndarray``
+        the number of frames of every utterance.
+    bucket_edges : ``list``
+        the upper lengths of the buckets, ``[]`` is a single bucket.
+    batch_size : ``int``
+        the batch size.
+    seed : ``int``
+        the seed of the simulated epoch.
+
+    Returns
+    -------
+    report : ``dict``
+        'buckets' is a list of ``(upper_edge, utterances, frames, padded_frames)``
+        and 'overhead' the ratio of padding to all padded frames, for the buckets
+        and for 'no_bucket_overhead' a single bucket.
+    """
+    lengths = np.asarray(lengths)
+    bucket_edges = sorted(bucket_edges)
+
+    def _simulate(edges):
+        rng = np.random.RandomState(seed)
+        padded = {}
+        for batch in _bucket_batches(lengths, edges, batch_size, rng):
+            bucket = int(np.searchsorted(edges, lengths[batch[0]], side='left'))
+            padded[bucket] = padded.get(bucket, 0) + len(batch) * int(lengths[batch].max())
+        return padded
+
+    padded = _simulate(bucket_edges)
+    buckets = np.searchsorted(bucket_edges, lengths, side='left')
+    report = {'buckets': []}
+    for bucket in sorted(padded):
+        members = buckets == bucket
+        edge = bucket_edges[bucket] if bucket < len(bucket_edges) else None
+        report['buckets'].append((edge, int(members.sum()), int(lengths[members].sum()), padded[bucket]))
+    total = float(sum(padded.values()))
+    report['overhead'] = float(1 - lengths.sum() / total) if total else 0.0
+    single = float(sum(_simulate([]).values()))
+    report['no_bucket_overhead'] = float(1 - lengths.sum() / single) if single else 0.0
+    return report
+
+
+def partition_indices(n, rank, world_size, seed, epoch=0):
+    """Return the part of ``rank`` of a seeded permutation of ``range(n)``.
+
+    The permutation only depends on ``seed`` and ``epoch``, so workers get disjoint
+    parts of ``n // world_size`` indices without any coordination. With
+    ``world_size`` of 1 this is the whole permutation.
+
+    Parameters
+    ----------
+    n : ``int``
+        the number of items, e.g. shards or examples.
+    rank : ``int``
+        the index of this worker.
+    world_size : ``int``
+        the number of workers.
+    seed : ``int``
+        the seed, must be the same in every worker.
+    epoch : ``int``
+        the current epoch.
+
+    Returns
+    -------
+    indices : ``np.ndarray``
+    """
+    order = np.random.RandomState(seed + epoch).permutation(n)
+    return order[rank::world_size][:n // world_size]
+
+
+def _remove_shards(url):
+    """Remove the shards and the index of a dataset."""
+    for name in os.listdir(url):
+        if name.startswith('data_') and (name.endswith('.npz') or name.endswith('.npz.tmp')):
+            os.remove(os.path.join(url, name))
+    if os.path.exists(os.path.join(url, INDEX_NAME)):
+        os.remove(os.path.join(url, INDEX_NAME))
+
+
+def _shard_id(name):
+    return int(name[len('data_'):-len('.npz')])
+
+
+def _speaker_ids(labels):
+    """Return the speaker id of each label and the width of one-hot labels."""
+    labels = np.asarray(labels)
+    if labels.ndim > 1 and labels.shape[-1] > 1:
+        return np.argmax(labels, -1).reshape(-1), labels.shape[-1]
+    ids = labels.reshape(-1).astype(np.int64)
+    return ids, 0
+
+
+def _write_shard(path, frames, labels, storage_dtype='float32', codec='npz'):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        if storage_dtype == 'float32' and codec == 'npz':
+            np.savez_compressed(f, frames=frames, labels=labels)
+        else:
+            encoded = encode_frames(frames, storage_dtype, codec)
+            if codec == 'npz':
+                np.savez_compressed(f, labels=labels, **encoded)
+            else:
+                np.savez(f, labels=labels, **encoded)
+    os.replace(tmp_path, path)
+
+
+def encode_frames(frames, storage_dtype='float32', codec='none'):
+    """Encode a frame array for a shard.
+
+    Parameters
+    ----------
+    frames : ``np.ndarray``
+        the feature array.
+    storage_dtype : ``str``
+        'float32', 'float16' or 'int8'. 'int8' is quantized with a scale and an
+        offset per feature dimension (the last axis).
+    codec : ``str``
+        'npz', 'none', 'zlib' or 'lzma'. 'npz' and 'none' store the array as it is.
+
+    Returns
+    -------
+    encoded : ``dict``
+        the arrays to save in the shard, decode them by ``decode_frames``.
+    """
+    frames = np.asarray(frames, dtype=np.float32)
+    encoded = {'storage_dtype': np.array(storage_dtype), 'codec': np.array(codec),
+               'shape': np.array(frames.shape, dtype=np.int64)}
+    if storage_dtype == 'int8':
+        flat = frames.reshape(-1, frames.shape[-1])
+        low = flat.min(0) if len(flat) else np.zeros(frames.shape[-1], np.float32)
+        high = flat.max(0) if len(flat) else np.zeros(frames.shape[-1], np.float32)
+        offset = (high + low) / 2
+        scale = (high - low) / 254
+        scale[scale == 0] = 1
+        stored = np.clip(np.rint((frames - offset) / scale), -127, 127).astype(np.int8)
+        encoded['scale'] = scale.astype(np.float32)
+        encoded['offset'] = offset.astype(np.float32)
+    else:
+        stored = frames.astype(storage_dtype)
+    if codec == 'zlib':
+        stored = np.frombuffer(zlib.compress(stored.tobytes()), dtype=np.uint8)
+    elif codec == 'lzma':
+        stored = np.frombuffer(lzma.compress(stored.tobytes()), dtype=np.uint8)
+    encoded['frames'] = stored
+    return encoded
+
+
+def decode_frames(loaded):
+    """Decode the frames of a shard to ``float32``.
+
+    Parameters
+    ----------
+    loaded : ``dict`` or ``NpzFile``
+        the arrays of a shard, the output of ``encode_frames`` or a shard with
+        only 'frames' written by older versions.
+
+    Returns
+    -------
+    frames : ``np.ndarray``
+    """
+    if 'codec' not in loaded:
+        return loaded['frames']
+    codec = str(loaded['codec'])
+    storage_dtype = str(loaded['storage_dtype'])
+    stored = loaded['frames']
+    if codec == 'zlib':
+        stored = np.frombuffer(zlib.decompress(stored.tobytes()), dtype=storage_dtype)
+    elif codec == 'lzma':
+        stored = np.frombuffer(lzma.decompress(stored.tobytes()), dtype=storage_dtype)
+    stored = stored.reshape(loaded['shape'])
+    if storage_dtype == 'int8':
+        return stored.astype(np.float32) * loaded['scale'] + loaded['offset']
+    return stored.astype(np.float32)
+
+
+def _read_index(url):
+    path = os.path.join(url, INDEX_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def _write_index(url, index):
+    path = os.path.join(url, INDEX_NAME)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(index, f)
+    os.replace(path + '.tmp', path)
+
+
+def _scan_index(manager):
+    """Build the index of a dataset written without one."""
+    index = {'num_examples': 0, 'spkr_num': 0, 'speaker_counts': [], 'shards': []}
+    counts = np.zeros(0, dtype=np.int64)
+    for name in manager.shard_names:
+        labels = manager._load_labels(name)
+        ids, n_speaker = _speaker_ids(labels)
+        new_counts = np.bincount(ids, minlength=max(n_speaker, len(counts)))
+        new_counts[:len(counts)] += counts
+        counts = new_counts
+        index['num_examples'] += len(labels)
+        index['shards'].append({'name': name, 'length': len(labels)})
+    index['speaker_counts'] = counts.tolist()
+    index['spkr_num'] = len(counts)
+    return index
@@ -0,0 +1,348 @@
+"""
+Data-parallel training on CPU
+-----------------------------
+
+``N_WORKERS`` processes each train a replica of the model on their part of the
+dataset (see ``DataManage.set_partition``). After every batch the gradients of
+the replicas are averaged with a ring allreduce over TCP sockets, and every
+replica applies the same averaged gradient, so the replicas stay identical.
+
+By default all the workers are started on this machine and talk over the
+loopback interface. To train on several machines, set ``WORKER_ADDRESSES`` to
+the ``host:port`` of every rank and ``LOCAL_RANKS`` to the ranks to start on
+each machine.
+
+The training loop of the workers is ``pyasv.engine.Trainer``.
+
+.. autoclass:: pyasv.distributed.RingCommunicator
+    :members:
+
+    .. automethod:: __init__
+
+.. autoclass:: pyasv.distributed.AllreduceOptimizer
+    :members:
+
+    .. automethod:: __init__
+
+.. autofunction:: pyasv.distributed.launch
+
+.. autofunction:: pyasv.distributed.local_addresses
+"""
+import os
+import time
+import socket
+import struct
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import tensorflow as tf
+
+
+DEFAULT_PORT = 29500
+_REDUCE_OPS = {'sum': np.add, 'max': np.maximum, 'min': np.minimum}
+
+
+def local_addresses(world_size, base_port=DEFAULT_PORT, host='127.0.0.1'):
+    """Return the addresses of ``world_size`` workers on this machine.
+
+    Parameters
+    ----------
+    world_size : ``int``
+        the number of workers.
+    base_port : ``int``
+        the port of rank 0, rank ``i`` listens on ``base_port + i``.
+    host : ``str``
+        the host of the workers.
+
+    Returns
+    -------
+    addresses : ``list``
+        ``host:port`` of each rank.
+    """
+    return ['%s:%d' % (host, base_port + rank) for rank in range(world_size)]
+
+
+def _parse_address(address):
+    host, port = address.rsplit(':', 1)
+    return host, int(port)
+
+
+def _recv_into(sock, buf):
+    view = memoryview(buf).cast('B')
+    while len(view):
+        n = sock.recv_into(view)
+        if n == 0:
+            raise ConnectionError("The previous worker closed the connection.")
+        view = view[n:]
+
+
+class RingCommunicator(object):
+    """
+    Use ``RingCommunicator`` to reduce numpy arrays across workers connected in a ring.
+    Each rank sends to rank + 1 and receives from rank - 1, so ``allreduce`` sends
+    ``2 * (world_size - 1) / world_size`` times the size of the array per worker,
+    whatever the number of workers.
+    """
+    def __init__(self, rank, addresses, timeout=120.0):
+        """
+        Parameters
+        ----------
+        rank : ``int``
+            the index of this worker.
+        addresses : ``list``
+            ``host:port`` of every rank, this worker listens on its own address.
+        timeout : ``float``
+            seconds to wait for the neighbours to connect. Once connected, a message
+            is waited for as long as needed, e.g. while rank 0 validates and saves a
+            checkpoint; a worker which dies closes its sockets, which fails the others.
+        """
+        assert 0 <= rank < len(addresses)
+        self.rank = rank
+        self.world_size = len(addresses)
+        self._next = None
+        self._prev = None
+        self._sender = None
+        if self.world_size == 1:
+            return
+        _, port = _parse_address(addresses[rank])
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind(('', port))
+        server.listen(1)
+        server.settimeout(timeout)
+        try:
+            self._next = self._connect(addresses[(rank + 1) % self.world_size], timeout)
+            self._next.sendall(struct.pack('!i', rank))
+            while True:
+                conn, _ = server.accept()
+                conn.settimeout(timeout)
+                peer = struct.unpack('!i', self._recv_bytes(conn, 4))[0]
+                if peer == (rank - 1) % self.world_size:
+                    break
+                conn.close()
+            self._prev = conn
+        finally:
+            server.close()
+        for sock in (self._next, self._prev):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            # the timeout only applies to the connection, the steps of the workers can
+            # take very different times.
+            sock.settimeout(None)
+        self._sender = ThreadPoolExecutor(1)
+
+    @staticmethod
+    def _connect(address, timeout):
+        deadline = time.time() + timeout
+        while True:
+            try:
+                return socket.create_connection(_parse_address(address), timeout=timeout)
+            except (ConnectionRefusedError, socket.timeout, OSError):
+                # the next worker is not listening yet.
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.1)
+
+    @staticmethod
+    def _recv_bytes(sock, n):
+        buf = bytearray(n)
+        _recv_into(sock, buf)
+        return bytes(buf)
+
+    def _exchange(self, send, recv):
+        """Send ``send`` to the next rank while receiving ``recv`` from the previous one."""
+        future = self._sender.submit(self._next.sendall, memoryview(send).cast('B'))
+        _recv_into(self._prev, recv)
+        future.result()
+
+    def allreduce(self, array, op='sum'):
+        """Reduce an array over all workers.
+
+        Parameters
+        ----------
+        array : ``np.ndarray``
+            the array of this worker, of the same shape and dtype in every worker.
+        op : ``str``
+            one of ``'sum'``, ``'max'`` and ``'min'``.
+
+        Returns
+        -------
+        reduced : ``np.ndarray``
+            a new array, the same in every worker.
+        """
+        reduce_op = _REDUCE_OPS[op]
+        array = np.asarray(array)
+        flat = np.array(array, copy=True).reshape(-1)
+        if self.world_size == 1:
+            return flat.reshape(array.shape)
+        n = self.world_size
+        chunks = np.array_split(flat, n)
+        recv = np.empty(max(len(c) for c in chunks), dtype=flat.dtype)
+        # reduce-scatter: after n - 1 steps, chunk rank + 1 is reduced over all workers.
+        for step in range(n - 1):
+            send_chunk = chunks[(self.rank - step) % n]
+            recv_chunk = chunks[(self.rank - step - 1) % n]
+            self._exchange(send_chunk, recv[:len(recv_chunk)])
+            reduce_op(recv_chunk, recv[:len(recv_chunk)], out=recv_chunk)
+        # allgather the reduced chunks.
+        for step in range(n - 1):
+            send_chunk = chunks[(self.rank - step + 1) % n]
+            recv_chunk = chunks[(self.rank - step) % n]
+            self._exchange(send_chunk, recv[:len(recv_chunk)])
+            recv_chunk[:] = recv[:len(recv_chunk)]
+        return flat.reshape(array.shape)
+
+    def broadcast(self, array, root=0):
+        """Send the array of ``root`` to every worker.
+
+        Parameters
+        ----------
+        array : ``np.ndarray``
+            the array, of the same shape and dtype in every worker.
+        root : ``int``
+            the rank whose array is sent.
+
+        Returns
+        -------
+        array : ``np.ndarray``
+            the array of ``root``.
+        """
+        array = np.array(array, copy=True)
+        if self.world_size == 1:
+            return array
+        if self.rank != root:
+            _recv_into(self._prev, array)
+        if (self.rank + 1) % self.world_size != root:
+            self._next.sendall(memoryview(np.ascontiguousarray(array)).cast('B'))
+        return array
+
+    def barrier(self):
+        """Wait for every worker."""
+        self.allreduce(np.zeros(1, dtype=np.float32))
+
+    def close(self):
+        if self._sender is not None:
+            self._sender.shutdown()
+            self._sender = None
+        for sock in (self._next, self._prev):
+            if sock is not None:
+                sock.close()
+        self._next = self._prev = None
+
+
+class AllreduceOptimizer(object):
+    """
+    Use ``AllreduceOptimizer`` to train replicas of a model with the averaged
+    gradients of all workers. The gradients are computed by tensorflow, averaged
+    by a ``RingCommunicator`` and fed back to ``apply_gradients``.
+    """
+    def __init__(self, opt, loss, communicator, var_list=None):
+        """
+        Parameters
+        ----------
+        opt : ``tf.train.Optimizer``
+            the optimizer.
+        loss : ``tf.Tensor``
+            scalar loss of the batch of this worker.
+        communicator : ``RingCommunicator``
+            the communicator of this worker.
+        var_list : ``list``
+            the variables to train, all the trainable variables if None.
+        """
+        grads_and_vars = [(g, v) for g, v in opt.compute_gradients(loss, var_list=var_list) if g is not None]
+        self.communicator = communicator
+        # sparse gradients, e.g. of a sampled softmax, are densified here.
+        self._grads = [tf.convert_to_tensor(g) for g, _ in grads_and_vars]
+        self._placeholders = [tf.placeholder(v.dtype.base_dtype, v.shape) for _, v in grads_and_vars]
+        self._sizes = [int(np.prod(v.shape.as_list())) for _, v in grads_and_vars]
+        self.apply_op = opt.apply_gradients(list(zip(self._placeholders, [v for _, v in grads_and_vars])))
+
+    def broadcast_variables(self, sess, root=0):
+        """Copy all the global variables of ``root`` to every worker, e.g. after initialization."""
+        variables = tf.global_variables()
+        values = sess.run(variables)
+        flat = np.concatenate([np.asarray(v, dtype=np.float64).reshape(-1) for v in values])
+        flat = self.communicator.broadcast(flat, root)
+        start = 0
+        for variable, value in zip(variables, values):
+            size = np.size(value)
+            variable.load(flat[start:start + size].reshape(np.shape(value)).astype(value.dtype), sess)
+            start += size
+
+    def run(self, sess, feed_dict, fetches):
+        """Compute the gradients of a batch, average them over the workers and apply them.
+
+        Parameters
+        ----------
+        sess : ``tf.Session``
+            the session.
+        feed_dict : ``dict``
+            the batch of this worker.
+        fetches : ``list``
+            tensors evaluated with the gradients.
+
+        Returns
+        -------
+        fetched : ``list``
+            the values of ``fetches``.
+        """
+        grads, fetched = sess.run([self._grads, fetches], feed_dict)
+        flat = np.concatenate([g.reshape(-1) for g in grads]).astype(np.float32, copy=False)
+        flat = self.communicator.allreduce(flat) / self.communicator.world_size
+        apply_feed = {}
+        start = 0
+        for placeholder, grad, size in zip(self._placeholders, grads, self._sizes):
+            apply_feed[placeholder] = flat[start:start + size].reshape(grad.shape)
+            start += size
+        sess.run(self.apply_op, apply_feed)
+        return fetched
+
+
+def _worker_main(fn, rank, addresses, args):
+    os.environ['CUDA_VISIBLE_DEVICES'] = ""
+    communicator = RingCommunicator(rank, addresses)
+    try:
+        fn(communicator, *args)
+    finally:
+        communicator.close()
+
+
+def launch(fn, world_size, args=(), addresses=None, ranks=None):
+    """Start worker processes and wait for them.
+
+    Each worker calls ``fn(communicator, *args)`` with its ``RingCommunicator``. The
+    processes are started with ``spawn``, so ``fn`` and ``args`` must be picklable.
+    If a worker fails, the others are terminated.
+
+    Parameters
+    ----------
+    fn : ``callable``
+        the function run by every worker.
+    world_size : ``int``
+        the number of workers over all machines.
+    args : ``tuple``
+        the extra arguments of ``fn``.
+    addresses : ``list``
+        ``host:port`` of every rank, ``local_addresses(world_size)`` if None.
+    ranks : ``list``
+        the ranks started on this machine, all of them if None.
+    """
+    if addresses is None:
+        addresses = local_addresses(world_size)
+    assert len(addresses) == world_size
+    if ranks is None:
+        ranks = list(range(world_size))
+    context = multiprocessing.get_context('spawn')
+    processes = [context.Process(target=_worker_main, args=(fn, rank, addresses, args)) for rank in ranks]
+    for process in processes:
+        process.start()
+    try:
+        while any(process.is_alive() for process in processes):
+            for rank, process in zip(ranks, processes):
+                process.join(0.5)
+                if process.exitcode not in (None, 0):
+                    raise RuntimeError("worker %d exited with code %d." % (rank, process.exitcode))
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+                process.join()
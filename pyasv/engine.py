@@ -0,0 +1,480 @@
+"""
+Training engine
+---------------
+
+``Trainer`` holds the training and scoring loops shared by the models of
+``pyasv.model``. A model class declares the ``input_shape`` of an example and its
+``feature_dim``, and builds its graph from ``(config, x, y)``; the ``run`` and
+``restore`` functions of each model module only create a ``Trainer``.
+
+The way the model is trained is chosen from the config:
+
+* ``N_GPU > 0``: one tower per GPU, the gradients of the towers are averaged.
+* ``N_WORKERS > 1``: data-parallel CPU processes, see ``pyasv.distributed``.
+* otherwise one CPU process, fed by ``tf.data`` if ``USE_TF_DATA`` and with
+  micro-batches if ``MICRO_BATCH_SIZE``, see ``pyasv.accumulation``.
+
+``INTRA_OP_THREADS`` and ``INTER_OP_THREADS`` set the thread pools of the session.
+
+.. autoclass:: pyasv.engine.Trainer
+    :members:
+
+    .. automethod:: __init__
+
+.. autoclass:: pyasv.engine.Hook
+    :members:
+
+.. autofunction:: pyasv.engine.average_gradients
+
+.. autofunction:: pyasv.engine.select_gpus
+"""
+import os
+import time
+import subprocess
+import numpy as np
+import tensorflow as tf
+from tensorflow.python import debug
+from pyasv import pipeline
+from pyasv import distributed
+from pyasv.accumulation import GradientAccumulator, EmbeddingCacheAccumulator
+from pyasv.backend.centroid import CentroidAccumulator
+from pyasv.backend.scoring import best_match, cosine_scores, normalize, ScoreWriter
+from pyasv.inference import session_config
+
+
+class Hook(object):
+    """
+    Base class of the training hooks. ``Trainer`` calls ``begin`` once the variables
+    are initialized, ``after_step`` after every training step and ``end_epoch`` after
+    the validation of every epoch. In data-parallel training the hooks run in every
+    worker, ``trainer.is_chief`` is True in rank 0.
+    """
+    def begin(self, trainer, sess):
+        pass
+
+    def after_step(self, trainer, step, loss, features, labels):
+        pass
+
+    def end_epoch(self, trainer, epoch, summary):
+        pass
+
+
+def average_gradients(tower_grads):
+    """Average the gradients of the towers.
+
+    Parameters
+    ----------
+    tower_grads : ``list``
+        the ``compute_gradients`` result of each tower, the variables are shared.
+
+    Returns
+    -------
+    grads_and_vars : ``list``
+        the averaged gradient of each variable.
+    """
+    average_grads = []
+    for grad_and_vars in zip(*tower_grads):
+        # ((grad0_gpu0, var0_gpu0), ... , (grad0_gpuN, var0_gpuN))
+        grad = tf.reduce_mean(tf.stack([tf.convert_to_tensor(g) for g, _ in grad_and_vars], 0), 0)
+        average_grads.append((grad, grad_and_vars[0][1]))
+    return average_grads
+
+
+def select_gpus(n_gpu):
+    """Return the ``n_gpu`` GPUs with the most free memory.
+
+    Parameters
+    ----------
+    n_gpu : ``int``
+        the number of GPUs.
+
+    Returns
+    -------
+    devices : ``str``
+        the value of ``CUDA_VISIBLE_DEVICES``, the first GPUs if ``nvidia-smi`` fails.
+    """
+    try:
+        output = subprocess.check_output(['nvidia-smi', '--query-gpu=memory.free',
+                                          '--format=csv,noheader,nounits'])
+    except (OSError, subprocess.CalledProcessError):
+        print("nvidia-smi failed, use the first %d GPUs." % n_gpu)
+        return ','.join(str(gpu) for gpu in range(n_gpu))
+    free = [int(line) for line in output.decode().split('\n') if line.strip()]
+    return ','.join(str(gpu) for gpu in np.argsort(-np.array(free), kind='mergesort')[:n_gpu])
+
+
+def _num_batches(data):
+    """The number of batches of an epoch of ``data``, e.g. P x K batches of a sampler."""
+    if hasattr(data, 'num_batches'):
+        return int(data.num_batches)
+    return int(data.num_examples // data.batch_size)
+
+
+def _label_ids(labels):
+    labels = np.asarray(labels)
+    if labels.ndim > 1 and labels.shape[-1] > 1:
+        return np.argmax(labels, -1)
+    return labels.reshape(-1).astype(np.int64)
+
+
+class Trainer(object):
+    """
+    Use ``Trainer`` to train a model class and to score a test set with it.
+    """
+    def __init__(self, model_class, config, hooks=None):
+        """
+        Parameters
+        ----------
+        model_class : ``class``
+            the model, e.g. ``pyasv.model.CTDnn``, built by ``model_class(config, x, y)``.
+            If it has an ``embedding_loss(embeddings, labels)`` method, micro-batches
+            are trained with cached embeddings.
+        config : ``config``
+            the config of model.
+        hooks : ``list``
+            ``Hook`` objects called during training.
+        """
+        self.model_class = model_class
+        self.config = config
+        self.input_shape = list(model_class.input_shape)
+        self.feature_dim = model_class.feature_dim
+        self.hooks = list(hooks or [])
+        self.communicator = None
+        self.is_chief = True
+
+    @property
+    def checkpoint(self):
+        """The path of the checkpoint, ``SAVE_PATH/MODEL_NAME.ckpt``."""
+        return os.path.join(self.config.SAVE_PATH, self.config.MODEL_NAME + ".ckpt")
+
+    def run(self, train, validation, debug_mode=False):
+        """Train the model, on GPUs, in data-parallel CPU workers or in this process.
+
+        Parameters
+        ----------
+        train : ``DataManage``
+            train dataset.
+        validation
+            validation dataset.
+        debug_mode : ``bool``
+            wrap the session in the tensorflow CLI debugger.
+        """
+        config = self.config
+        n_workers = getattr(config, 'N_WORKERS', None) or 1
+        if config.N_GPU == 0 and n_workers > 1:
+            ranks = getattr(config, 'LOCAL_RANKS', None) or list(range(n_workers))
+            # share the cores of this machine between its workers.
+            threads = max(1, (os.cpu_count() or 1) // len(ranks))
+            distributed.launch(_train_worker, n_workers, (self, train, validation, threads),
+                               getattr(config, 'WORKER_ADDRESSES', None), ranks)
+            return
+        if config.N_GPU == 0:
+            os.environ['CUDA_VISIBLE_DEVICES'] = ""
+        else:
+            os.environ['CUDA_VISIBLE_DEVICES'] = select_gpus(config.N_GPU)
+        self.train(train, validation, debug_mode=debug_mode)
+
+    def train(self, train, validation, communicator=None, threads=0, debug_mode=False):
+        """Train the model in this process.
+
+        Parameters
+        ----------
+        train : ``DataManage``
+            train dataset, only the part of this worker is read with a ``communicator``.
+        validation
+            validation dataset, only read by rank 0.
+        communicator : ``pyasv.distributed.RingCommunicator``
+            average the gradients with the other workers if not None.
+        threads : ``int``
+            the default size of the thread pools, 0 lets tensorflow decide.
+        debug_mode : ``bool``
+            wrap the session in the tensorflow CLI debugger.
+        """
+        config = self.config
+        self.communicator = communicator
+        self.is_chief = communicator is None or communicator.rank == 0
+        if communicator is not None:
+            if not hasattr(train, 'set_partition'):
+                raise ValueError("%s can't be split between the workers, it has no set_partition."
+                                 % type(train).__name__)
+            train.set_partition(communicator.rank, communicator.world_size)
+        tf.reset_default_graph()
+        self._log('build model...')
+        opt = tf.train.AdamOptimizer(learning_rate=config.LR)
+        self._use_tf_data = False
+        if communicator is not None:
+            self._build_allreduce(opt)
+        elif config.N_GPU > 0:
+            self._build_towers(opt)
+        else:
+            self._build_single(opt, train, validation)
+        crop_lengths = getattr(train, 'crop_lengths', None)
+        if crop_lengths and set(crop_lengths) != {self.input_shape[0]}:
+            # e.g. a SegmentSampler with several crop lengths.
+            raise ValueError("%s takes inputs of %d frames, the dataset has crops of %s frames."
+                             % (self.model_class.__name__, self.input_shape[0], str(crop_lengths)))
+        for data in (train, validation):
+            if not self._use_tf_data and not hasattr(type(data), 'next_batch'):
+                # e.g. TFRecordData.
+                raise ValueError("%s can only be read by the tf.data pipeline of a single process, "
+                                 "set use_tf_data in config." % type(data).__name__)
+        centroids = CentroidAccumulator(config.N_SPEAKER, self.feature_dim)
+        saver = tf.train.Saver()
+        self._log('done...')
+        with tf.Session(config=self._session_config(threads)) as sess:
+            sess.run(tf.global_variables_initializer())
+            sess.run(tf.local_variables_initializer())
+            if communicator is not None:
+                self._optimizer.broadcast_variables(sess)
+            if debug_mode:
+                sess = debug.LocalCLIDebugWrapperSession(sess=sess)
+            for hook in self.hooks:
+                hook.begin(self, sess)
+            self._log('run train op...')
+            for epoch in range(config.MAX_STEP):
+                start_time = time.time()
+                summary = self._train_epoch(sess, train, centroids, epoch)
+                vectors = centroids.end_epoch()
+                if self.is_chief:
+                    summary['val_accuracy'] = self._validate(sess, validation, vectors)
+                    saver.save(sess=sess, save_path=self.checkpoint)
+                if communicator is not None:
+                    # the other workers wait here, not in the next step, while rank 0 validates.
+                    val_accuracy = summary.get('val_accuracy')
+                    val_accuracy = communicator.broadcast(np.array([np.nan if val_accuracy is None
+                                                                    else val_accuracy]))[0]
+                    summary['val_accuracy'] = None if np.isnan(val_accuracy) else float(val_accuracy)
+                summary['time'] = time.time() - start_time
+                self._log('Cost time: ' + str(summary['time']) + ' sec.')
+                for hook in self.hooks:
+                    hook.end_epoch(self, epoch, summary)
+        self._log('training done.')
+
+    def _log(self, message, **kwargs):
+        if self.is_chief:
+            print(message, **kwargs)
+
+    def _session_config(self, threads):
+        intra = getattr(self.config, 'INTRA_OP_THREADS', None) or threads
+        inter = getattr(self.config, 'INTER_OP_THREADS', None) or (2 if threads else 0)
+        config = session_config(intra, inter)
+        config.allow_soft_placement = True
+        return config
+
+    def _placeholders(self):
+        x = tf.placeholder(tf.float32, [None] + self.input_shape)
+        y = tf.placeholder(tf.float32, [None, self.config.N_SPEAKER])
+        return x, y
+
+    def _build_single(self, opt, train, validation):
+        config = self.config
+        self._use_tf_data = getattr(config, 'USE_TF_DATA', False)
+        if self._use_tf_data:
+            x, y, self._train_init, self._validation_init = pipeline.input_tensors(config, train, validation,
+                                                                                   self.input_shape)
+        else:
+            x, y = self._placeholders()
+        model = self.model_class(config, x, y)
+        self._x, self._y, self._feature = x, y, model.feature
+        self._loss = model.loss
+        self._micro_batch_size = getattr(config, 'MICRO_BATCH_SIZE', None)
+        if self._micro_batch_size:
+            if hasattr(model, 'embedding_loss'):
+                self._accumulator = EmbeddingCacheAccumulator(opt, x, y, model.feature, model.embedding_loss)
+            else:
+                self._accumulator = GradientAccumulator(opt, model.loss, model.feature)
+            self._mode = 'accumulate'
+        else:
+            self._train_op = opt.minimize(model.loss)
+            self._mode = 'single'
+
+    def _build_towers(self, opt):
+        config = self.config
+        towers = []
+        with tf.device('/cpu:0'):
+            for gpu_id in range(config.N_GPU):
+                with tf.device('/gpu:%d' % gpu_id), tf.name_scope('tower_%d' % gpu_id):
+                    with tf.variable_scope('cpu_variables', reuse=tf.AUTO_REUSE):
+                        x, y = self._placeholders()
+                        model = self.model_class(config, x, y)
+                        towers.append((x, y, model.loss, model.feature, opt.compute_gradients(model.loss)))
+            tower_x, tower_y, tower_losses, tower_features, tower_grads = zip(*towers)
+            self._train_op = opt.apply_gradients(average_gradients(tower_grads))
+            self._loss = tf.reduce_mean(tower_losses)
+            self._tower_features = tf.concat(tower_features, 0)
+        self._towers = list(zip(tower_x, tower_y))
+        self._x, self._y, self._feature = tower_x[0], tower_y[0], tower_features[0]
+        self._mode = 'towers'
+
+    def _build_allreduce(self, opt):
+        x, y = self._placeholders()
+        model = self.model_class(self.config, x, y)
+        self._x, self._y, self._feature = x, y, model.feature
+        self._loss = model.loss
+        self._optimizer = distributed.AllreduceOptimizer(opt, model.loss, self.communicator)
+        self._mode = 'allreduce'
+
+    def _next_batch(self, data):
+        batch_x, batch_y = data.next_batch
+        return np.reshape(batch_x, [-1] + self.input_shape), pipeline.one_hot(batch_y, self.config.N_SPEAKER)
+
+    def _step(self, sess, train):
+        """Run a training step, return the loss, the features and the labels of the batch."""
+        if self._mode == 'single' and self._use_tf_data:
+            _, loss, features, labels = sess.run([self._train_op, self._loss, self._feature, self._y])
+            return loss, features, labels
+        if self._use_tf_data:
+            batch_x, batch_y = sess.run([self._x, self._y])
+        else:
+            batch_x, batch_y = self._next_batch(train)
+        if self._mode == 'single':
+            _, loss, features = sess.run([self._train_op, self._loss, self._feature],
+                                         feed_dict={self._x: batch_x, self._y: batch_y})
+        elif self._mode == 'accumulate':
+            # the gradients of the micro-batches are applied once per batch.
+            loss, features = self._accumulator.run(sess, {self._x: batch_x, self._y: batch_y},
+                                                   self._micro_batch_size)
+        elif self._mode == 'allreduce':
+            loss, features = self._optimizer.run(sess, {self._x: batch_x, self._y: batch_y},
+                                                 [self._loss, self._feature])
+        else:
+            if len(batch_x) < len(self._towers):
+                raise ValueError("A batch of %d examples can't be split on %d GPUs." % (len(batch_x),
+                                                                                      len(self._towers)))
+            feed_dict = {}
+            for (x, y), part_x, part_y in zip(self._towers, np.array_split(batch_x, len(self._towers)),
+                                              np.array_split(batch_y, len(self._towers))):
+                feed_dict[x] = part_x
+                feed_dict[y] = part_y
+            _, loss, features = sess.run([self._train_op, self._loss, self._tower_features], feed_dict)
+        return loss, features, batch_y
+
+    def _train_epoch(self, sess, train, centroids, epoch):
+        config = self.config
+        if self._use_tf_data:
+            # the pipeline batches the examples by BATCH_SIZE.
+            total_batch = int(train.num_examples // config.BATCH_SIZE)
+        else:
+            total_batch = _num_batches(train)
+        if self.communicator is not None:
+            # every worker must run the same number of steps.
+            total_batch = int(self.communicator.allreduce(np.array([total_batch]), 'min')[0])
+        self._log('\n---------------------')
+        self._log('Epoch:%d, lr:%.4f, total_batch=%d' % (epoch, config.LR, total_batch))
+        if self._use_tf_data:
+            sess.run(self._train_init)
+        start_time = time.time()
+        total_loss = 0.0
+        n_examples = 0
+        for batch_id in range(total_batch):
+            loss, features, labels = self._step(sess, train)
+            total_loss += loss
+            n_examples += len(features)
+            centroids.update(features, labels)
+            if hasattr(train, 'observe'):
+                # e.g. HardNegativeSampler refreshes its embedding bank.
+                train.observe(features, labels)
+            for hook in self.hooks:
+                hook.after_step(self, batch_id, loss, features, labels)
+            self._log("batch_%d  batch_loss=%.4f" % (batch_id, loss), end='\r')
+        train.reset_batch_counter()
+        elapsed = time.time() - start_time
+        avg_loss = total_loss / max(total_batch, 1)
+        if self.communicator is not None:
+            # the speaker vectors are computed from the features of all the workers.
+            sums, counts = centroids.sums.copy(), centroids.counts.copy()
+            centroids.merge(self.communicator.allreduce(sums) - sums, self.communicator.allreduce(counts) - counts)
+            avg_loss, n_examples = self.communicator.allreduce(np.array([avg_loss, n_examples], dtype=np.float64))
+            avg_loss /= self.communicator.world_size
+        summary = {'epoch': epoch, 'loss': float(avg_loss), 'steps': total_batch,
+                   'step_time': elapsed / max(total_batch, 1), 'examples_per_sec': n_examples / max(elapsed, 1e-9)}
+        self._log('\nTrain loss:%.4f  %.1f ms/step  %.1f examples/sec' % (summary['loss'], 1e3 * summary['step_time'],
+                                                                         summary['examples_per_sec']))
+        return summary
+
+    def _iter_features(self, sess, x, feature, data, total_batch):
+        """Yield the ``feature`` and the label ids of ``total_batch`` batches of ``data`` fed to ``x``."""
+        for _ in range(total_batch):
+            batch_x, batch_y = data.next_batch
+            batch_x = np.reshape(batch_x, [-1] + self.input_shape)
+            yield sess.run(feature, feed_dict={x: batch_x}), _label_ids(batch_y)
+
+    def _validate(self, sess, validation, vectors):
+        total_batch = int(validation.num_examples // self.config.BATCH_SIZE)
+        if total_batch < 1:
+            print("your validation dataset's size is less than one batch.")
+            return None
+        print("validation...")
+        if self._use_tf_data:
+            sess.run(self._validation_init)
+            batches = [sess.run([self._feature, self._y]) for _ in range(total_batch)]
+            features = np.concatenate([f for f, _ in batches], 0)
+            labels = np.concatenate([_label_ids(y) for _, y in batches], 0)
+        else:
+            batches = list(self._iter_features(sess, self._x, self._feature, validation, total_batch))
+            features = np.concatenate([f for f, _ in batches], 0)
+            labels = np.concatenate([y for _, y in batches], 0)
+        validation.reset_batch_counter()
+        preds, _ = best_match(features, vectors)
+        val_accuracy = float(np.mean(labels == preds))
+        print('Val Accuracy: %0.4f%%' % (100.0 * val_accuracy))
+        return val_accuracy
+
+    def restore(self, enroll, test, output='text', k=5):
+        """Enroll speakers with the trained model and score the test set.
+
+        Parameters
+        ----------
+        enroll : ``DataManage``
+            enroll dataset.
+        test : ``DataManage``
+            test dataset.
+        output : ``str``
+            ``'text'`` writes ``result.txt``, ``'npy'`` writes the score matrix into ``scores.npy``
+            and ``'topk'`` only writes the ``k`` best speakers per vector, see ``ScoreWriter``.
+        k : ``int``
+            the number of speakers kept per vector with ``output='topk'``.
+
+        Returns
+        -------
+        summary : ``dict``
+            see ``ScoreWriter.summary``.
+        """
+        config = self.config
+        with tf.Graph().as_default():
+            x, _ = self._placeholders()
+            if config.N_GPU == 0:
+                model = self.model_class(config, x)
+            else:
+                with tf.variable_scope('cpu_variables', reuse=tf.AUTO_REUSE):
+                    model = self.model_class(config, x)
+            saver = tf.train.Saver()
+            with tf.Session(config=self._session_config(0)) as sess:
+                saver.restore(sess, self.checkpoint)
+                print("restore model succeed.")
+                print("enrolling...")
+                enrolled = CentroidAccumulator(enroll.spkr_num, self.feature_dim)
+                # the last partial batches are abandoned.
+                total_batch = int(enroll.num_examples // config.BATCH_SIZE)
+                for features, labels in self._iter_features(sess, x, model.feature, enroll, total_batch):
+                    enrolled.update(features, labels)
+                enrolled_vector = normalize(enrolled.epoch_means())
+                not_enrolled = enrolled.counts == 0
+
+                print("testing...")
+                total_batch = int(test.num_examples // config.BATCH_SIZE)
+                print("writing the result in %s" % config.SAVE_PATH)
+                with ScoreWriter(config.SAVE_PATH, total_batch * config.BATCH_SIZE, enroll.spkr_num,
+                                 output, k) as writer:
+                    for features, labels in self._iter_features(sess, x, model.feature, test, total_batch):
+                        scores = cosine_scores(features, enrolled_vector, normalized=True)
+                        writer.write(scores, labels, not_enrolled)
+                summary = writer.summary()
+        print("Acc:%.4f  Top-%d acc:%.4f  Num_of_true:%d" % (summary['accuracy'], summary['k'],
+                                                             summary['top_k_accuracy'], summary['num_true']))
+        print("done.")
+        return summary
+
+
+def _train_worker(communicator, trainer, train, validation, threads):
+    trainer.train(train, validation, communicator=communicator, threads=threads)
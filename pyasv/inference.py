@@ -0,0 +1,382 @@
+"""
+Inference without the model code
+--------------------------------
+
+``Embedder.export`` writes the feature branch of a trained model as a frozen
+graph: the variables are converted to constants, the constant sub-graphs are
+folded and the nodes which are only needed for training are removed. This
+module only depends on tensorflow and numpy, so an inference host can load the
+frozen graph with ``FrozenEmbedder`` without building the python model classes
+or restoring a training checkpoint.
+
+.. autoclass:: pyasv.inference.BaseEmbedder
+    :members:
+
+.. autoclass:: pyasv.inference.FrozenEmbedder
+    :members:
+
+    .. automethod:: __init__
+
+.. autoclass:: pyasv.inference.SlidingWindowExtractor
+    :members:
+
+    .. automethod:: __init__
+
+.. autofunction:: pyasv.inference.freeze_graph
+
+.. autofunction:: pyasv.inference.write_frozen_graph
+
+.. autofunction:: pyasv.inference.session_config
+"""
+import os
+import json
+import numpy as np
+import tensorflow as tf
+
+
+FROZEN_GRAPH_NAME = 'frozen_graph.pb'
+FROZEN_META_NAME = 'frozen_graph.json'
+_EXTRACT = object()
+
+
+class BaseEmbedder(object):
+    """
+    Fixed-shape batching and windowing shared by the embedders. Subclasses set
+    ``frame_shape``, ``hop``, ``batch_size`` and ``dim``, and implement ``_run``
+    which maps a ``[batch_size] + frame_shape`` array to ``[batch_size, dim]`` features.
+    """
+    frame_shape = None
+    hop = 1
+    batch_size = None
+    dim = None
+
+    def _run(self, batch):
+        raise NotImplementedError
+
+    def embed(self, frames):
+        """Extract the features of a batch of examples.
+
+        The examples are fed ``batch_size`` at a time, the last partial batch is padded
+        with zeros and the padded rows are dropped from the result.
+
+        Parameters
+        ----------
+        frames : ``np.ndarray``
+            ``[n] + frame_shape`` examples, any ``n``.
+
+        Returns
+        -------
+        features : ``np.ndarray``
+            ``[n, dim]`` features.
+        """
+        frames = np.asarray(frames, dtype=np.float32).reshape([-1] + list(self.frame_shape))
+        features = np.empty((len(frames), self.dim), dtype=np.float32)
+        batch = np.zeros([self.batch_size] + list(self.frame_shape), dtype=np.float32)
+        for start in range(0, len(frames), self.batch_size):
+            chunk = frames[start:start + self.batch_size]
+            if len(chunk) == self.batch_size:
+                feed = chunk
+            else:
+                batch[:len(chunk)] = chunk
+                batch[len(chunk):] = 0
+                feed = batch
+            features[start:start + len(chunk)] = self._run(feed)[:len(chunk)]
+        return features
+
+    def windows(self, features, hop=None):
+        """Cut the feature matrix of an utterance into model inputs.
+
+        Utterances shorter than one window are repeated to the window length.
+
+        Parameters
+        ----------
+        features : ``np.ndarray``
+            ``[frames, dim]`` feature matrix.
+        hop : ``int``
+            frames between the starts of two windows, the class ``hop`` if None.
+
+        Returns
+        -------
+        windows : ``np.ndarray``
+            ``[n] + frame_shape`` examples.
+        """
+        hop = hop or self.hop
+        features = np.asarray(features, dtype=np.float32)
+        length = self.frame_shape[0]
+        if len(features) < length:
+            features = np.pad(features, [(0, length - len(features)), (0, 0)], mode='wrap')
+        starts = np.arange(0, len(features) - length + 1, hop)
+        windows = features[starts[:, None] + np.arange(length)]
+        return windows.reshape([-1] + list(self.frame_shape))
+
+    def embed_utterance(self, features, hop=None):
+        """Extract one feature of an utterance, the mean of the features of its windows.
+
+        Parameters
+        ----------
+        features : ``np.ndarray``
+            ``[frames, dim]`` feature matrix.
+        hop : ``int``
+            frames between the starts of two windows, the class ``hop`` if None.
+
+        Returns
+        -------
+        feature : ``np.ndarray``
+            ``[dim]`` feature.
+        """
+        return self.embed(self.windows(features, hop)).mean(axis=0)
+
+    def close(self):
+        """Close the session."""
+        self._sess.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def session_config(intra_op_threads, inter_op_threads):
+    """Return a ``tf.ConfigProto`` with the given thread pool sizes, 0 lets tensorflow decide."""
+    return tf.ConfigProto(intra_op_parallelism_threads=intra_op_threads,
+                          inter_op_parallelism_threads=inter_op_threads)
+
+
+def freeze_graph(sess, input_name, output_name):
+    """Return the frozen ``GraphDef`` computing ``output_name`` from ``input_name``.
+
+    Parameters
+    ----------
+    sess : ``tf.Session``
+        the session holding the trained variables.
+    input_name : ``str``
+        name of the input op.
+    output_name : ``str``
+        name of the output op.
+
+    Returns
+    -------
+    graph_def : ``tf.GraphDef``
+        graph without variables, unused and training-only nodes.
+    """
+    graph_def = tf.graph_util.convert_variables_to_constants(sess, sess.graph.as_graph_def(), [output_name])
+    graph_def = tf.graph_util.remove_training_nodes(graph_def, protected_nodes=[input_name, output_name])
+    try:
+        from tensorflow.tools.graph_transforms import TransformGraph
+    except ImportError:
+        return tf.graph_util.extract_sub_graph(graph_def, [output_name])
+    return TransformGraph(graph_def, [input_name], [output_name],
+                          ['strip_unused_nodes', 'fold_constants(ignore_errors=true)',
+                           'fold_batch_norms', 'remove_nodes(op=Identity, op=CheckNumerics)'])
+
+
+def write_frozen_graph(path, graph_def, meta):
+    """Write a frozen graph and its meta data into directory ``path``.
+
+    Parameters
+    ----------
+    path : ``str``
+        the directory of ``frozen_graph.pb`` and ``frozen_graph.json``.
+    graph_def : ``tf.GraphDef``
+        the frozen graph.
+    meta : ``dict``
+        ``input`` and ``output`` tensor names, ``frame_shape``, ``hop``, ``batch_size`` and ``dim``.
+    """
+    if not os.path.exists(path):
+        os.makedirs(path)
+    with open(os.path.join(path, FROZEN_GRAPH_NAME), 'wb') as f:
+        f.write(graph_def.SerializeToString())
+    with open(os.path.join(path, FROZEN_META_NAME), 'w') as f:
+        json.dump(meta, f, indent=2)
+
+
+class FrozenEmbedder(BaseEmbedder):
+    """
+    Load a graph written by ``Embedder.export`` and extract features with it.
+    """
+    def __init__(self, path, intra_op_threads=0, inter_op_threads=0):
+        """
+        Parameters
+        ----------
+        path : ``str``
+            the directory given to ``Embedder.export``.
+        intra_op_threads : ``int``
+            threads used inside one op, 0 lets tensorflow decide.
+        inter_op_threads : ``int``
+            threads used to run independent ops, 0 lets tensorflow decide.
+        """
+        with open(os.path.join(path, FROZEN_META_NAME), 'r') as f:
+            meta = json.load(f)
+        self.frame_shape = tuple(meta['frame_shape'])
+        self.hop = meta['hop']
+        self.batch_size = meta['batch_size']
+        self.dim = meta['dim']
+        graph_def = tf.GraphDef()
+        with open(os.path.join(path, FROZEN_GRAPH_NAME), 'rb') as f:
+            graph_def.ParseFromString(f.read())
+        self._graph = tf.Graph()
+        with self._graph.as_default():
+            tf.import_graph_def(graph_def, name='')
+        self._x = self._graph.get_tensor_by_name(meta['input'])
+        self._feature = self._graph.get_tensor_by_name(meta['output'])
+        self._sess = tf.Session(graph=self._graph, config=session_config(intra_op_threads, inter_op_threads))
+
+    def _run(self, batch):
+        return self._sess.run(self._feature, feed_dict={self._x: batch})
+
+
+class _Stream(object):
+    def __init__(self, dim, frame_dim):
+        self.frames = np.zeros((0, frame_dim), dtype=np.float32)
+        self.frame_offset = 0
+        self.next_unit = 0
+        self.units = np.zeros((0, dim), dtype=np.float64)
+        self.unit_offset = 0
+        self.next_window = 0
+
+
+class SlidingWindowExtractor(object):
+    """
+    Extract an embedding every ``hop`` frames over windows of ``window`` frames.
+
+    The model inputs ("units", ``frame_shape[0]`` frames every ``unit_hop`` frames) are
+    embedded once and the embedding of a window is the mean of the features of the units
+    inside it, taken from cumulative sums, so overlapping windows share their units. With
+    ``CTDnn`` a unit is the 9 frames context of one frame.
+
+    Frames are pushed per stream with ``push`` and ``flush`` embeds the new units of all
+    streams in batches of the embedder. A stream only keeps the frames of its unfinished
+    units and the features of its unfinished windows, so its memory does not grow with the
+    length of the recording::
+
+        extractor = SlidingWindowExtractor(embedder, window=150, hop=50)
+        for chunk in live_frames:
+            extractor.push('call', chunk)
+            for start, embedding in zip(*extractor.flush()['call']):
+                ...
+    """
+    def __init__(self, embedder, window, hop, unit_hop=None):
+        """
+        Parameters
+        ----------
+        embedder : ``BaseEmbedder``
+            an ``Embedder`` or a ``FrozenEmbedder``.
+        window : ``int``
+            frames per window, not less than the frames of one model input.
+        hop : ``int``
+            frames between the starts of two windows.
+        unit_hop : ``int``
+            frames between the starts of two model inputs, it should divide ``hop``.
+            The ``hop`` of the embedder if None.
+        """
+        unit_hop = unit_hop or embedder.hop
+        self.unit_length = embedder.frame_shape[0]
+        if window < self.unit_length:
+            raise ValueError("window should be at least %d frames, got %d." % (self.unit_length, window))
+        if hop % unit_hop:
+            raise ValueError("hop (%d) should be a multiple of unit_hop (%d)." % (hop, unit_hop))
+        self.embedder = embedder
+        self.window = window
+        self.hop = hop
+        self.unit_hop = unit_hop
+        self.units_per_window = (window - self.unit_length) // unit_hop + 1
+        self._streams = dict()
+
+    def push(self, key, frames):
+        """Add frames to a stream, the stream is opened by its first push.
+
+        Parameters
+        ----------
+        key : hashable
+            the stream.
+        frames : ``np.ndarray``
+            ``[frames, dim]`` new frames.
+        """
+        if key not in self._streams:
+            self._streams[key] = _Stream(self.embedder.dim, self.embedder.frame_shape[1])
+        stream = self._streams[key]
+        frames = np.asarray(frames, dtype=np.float32).reshape(-1, self.embedder.frame_shape[1])
+        stream.frames = np.concatenate([stream.frames, frames], axis=0)
+
+    def close(self, key):
+        """Forget a stream."""
+        self._streams.pop(key, None)
+
+    def _cut_units(self, stream):
+        end = stream.frame_offset + len(stream.frames)
+        n_units = max(0, (end - self.unit_length - stream.next_unit) // self.unit_hop + 1)
+        if n_units == 0:
+            return np.zeros([0] + list(self.embedder.frame_shape), dtype=np.float32)
+        starts = stream.next_unit - stream.frame_offset + np.arange(n_units) * self.unit_hop
+        units = stream.frames[starts[:, None] + np.arange(self.unit_length)]
+        stream.next_unit += n_units * self.unit_hop
+        keep = stream.next_unit - stream.frame_offset
+        stream.frames = stream.frames[keep:]
+        stream.frame_offset += keep
+        return units.reshape([-1] + list(self.embedder.frame_shape))
+
+    def _emit(self, stream):
+        windows_hop = self.hop // self.unit_hop
+        n_units = stream.unit_offset + len(stream.units)
+        first = stream.next_window * windows_hop
+        n_windows = max(0, (n_units - self.units_per_window - first) // windows_hop + 1)
+        starts = first + np.arange(n_windows) * windows_hop - stream.unit_offset
+        cumsum = np.concatenate([np.zeros((1, stream.units.shape[1])), np.cumsum(stream.units, axis=0)])
+        embeddings = (cumsum[starts + self.units_per_window] - cumsum[starts]) / self.units_per_window
+        window_starts = (stream.next_window + np.arange(n_windows)) * self.hop
+        stream.next_window += n_windows
+        drop = stream.next_window * windows_hop - stream.unit_offset
+        stream.units = stream.units[drop:]
+        stream.unit_offset += drop
+        return window_starts, embeddings.astype(np.float32)
+
+    def flush(self, keys=None):
+        """Embed the new units of streams and return their finished windows.
+
+        Parameters
+        ----------
+        keys : ``list``
+            the streams to flush, all of them if None. The other streams keep their frames.
+
+        Returns
+        -------
+        windows : ``dict``
+            for every flushed stream, ``(starts, embeddings)``: the first frame of each new
+            window and the ``[n_windows, dim]`` embeddings.
+        """
+        keys = list(self._streams) if keys is None else list(keys)
+        units = [self._cut_units(self._streams[key]) for key in keys]
+        features = self.embedder.embed(np.concatenate(units, axis=0)) if keys else None
+        windows = dict()
+        start = 0
+        for key, stream_units in zip(keys, units):
+            stream = self._streams[key]
+            stream.units = np.concatenate([stream.units, features[start:start + len(stream_units)]], axis=0)
+            start += len(stream_units)
+            windows[key] = self._emit(stream)
+        return windows
+
+    def extract(self, recordings):
+        """Extract the window embeddings of whole recordings, batching the units of all of them.
+
+        The streams opened by ``push`` are left as they are.
+
+        Parameters
+        ----------
+        recordings : ``list``
+            ``[frames, dim]`` feature matrices.
+
+        Returns
+        -------
+        embeddings : ``list``
+            ``[n_windows, dim]`` embeddings per recording, empty for recordings shorter than a window.
+        """
+        # keys which can't be the keys of the streams of the caller.
+        keys = [(_EXTRACT, i) for i in range(len(recordings))]
+        for key, frames in zip(keys, recordings):
+            self.push(key, frames)
+        windows = self.flush(keys)
+        for key in keys:
+            self.close(key)
+        return [windows[key][1] for key in keys]
@@ -1,2 +1,5 @@
 from pyasv.loss.triplet_loss import batch_hard_triplet_loss
-from pyasv.loss.triplet_loss import batch_all_triplet_loss
\ No newline at end of file
+from pyasv.loss.triplet_loss import batch_all_triplet_loss
+from pyasv.loss.triplet_loss import batch_all_triplet_loss_sorted
+from pyasv.loss.triplet_loss import semi_hard_triplet_loss
+from pyasv.loss.sampled_softmax import sampled_softmax_loss
\ No newline at end of file
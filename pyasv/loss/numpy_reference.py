@@ -0,0 +1,110 @@
+"""
+NumPy versions of the triplet losses, written with plain loops over the triplets
+to check the tensorflow versions, e.g. in ``benchmarks/triplet_loss.py``. Each
+function also returns the number of triplets with a positive loss.
+
+.. automethod::
+    pyasv.loss.numpy_reference.batch_all_triplet_loss
+
+.. automethod::
+    pyasv.loss.numpy_reference.batch_hard_triplet_loss
+
+.. automethod::
+    pyasv.loss.numpy_reference.semi_hard_triplet_loss
+"""
+import numpy as np
+
+
+__all__ = ['pairwise_distances',
+           'batch_all_triplet_loss',
+           'batch_hard_triplet_loss',
+           'semi_hard_triplet_loss']
+
+
+def pairwise_distances(embeddings, squared=False):
+    """Return the (batch_size, batch_size) euclidean distances of ``embeddings``."""
+    embeddings = np.asarray(embeddings, dtype=np.float64)
+    distances = np.sum((embeddings[:, None, :] - embeddings[None, :, :]) ** 2, axis=-1)
+    return distances if squared else np.sqrt(distances)
+
+
+def batch_all_triplet_loss(labels, embeddings, margin, squared=False):
+    """Reference of ``pyasv.loss.triplet_loss.batch_all_triplet_loss``.
+
+    Returns
+    -------
+    triplet_loss : ``float``
+        the mean loss of the positive triplets.
+    fraction_positive_triplets : ``float``
+    num_positive_triplets : ``int``
+    """
+    labels = np.asarray(labels).reshape(-1)
+    distances = pairwise_distances(embeddings, squared)
+    total = 0.0
+    num_positive = 0
+    num_valid = 0
+    for a in range(len(labels)):
+        for p in range(len(labels)):
+            if p == a or labels[p] != labels[a]:
+                continue
+            for n in range(len(labels)):
+                if labels[n] == labels[a]:
+                    continue
+                num_valid += 1
+                loss = distances[a, p] - distances[a, n] + margin
+                if loss > 1e-16:
+                    total += loss
+                    num_positive += 1
+    return total / (num_positive + 1e-16), num_positive / (num_valid + 1e-16), num_positive
+
+
+def batch_hard_triplet_loss(labels, embeddings, margin, squared=False):
+    """Reference of ``pyasv.loss.triplet_loss.batch_hard_triplet_loss``.
+
+    Returns
+    -------
+    triplet_loss : ``float``
+        the mean loss over the anchors.
+    num_positive_triplets : ``int``
+    """
+    labels = np.asarray(labels).reshape(-1)
+    distances = pairwise_distances(embeddings, squared)
+    losses = []
+    for a in range(len(labels)):
+        positives = [distances[a, p] for p in range(len(labels)) if p != a and labels[p] == labels[a]]
+        negatives = [distances[a, n] for n in range(len(labels)) if labels[n] != labels[a]]
+        hardest_positive = max(positives) if positives else 0.0
+        hardest_negative = min(negatives) if negatives else distances[a].max()
+        losses.append(max(hardest_positive - hardest_negative + margin, 0.0))
+    losses = np.array(losses)
+    return float(losses.mean()), int(np.sum(losses > 1e-16))
+
+
+def semi_hard_triplet_loss(labels, embeddings, margin, squared=False):
+    """Reference of ``pyasv.loss.triplet_loss.semi_hard_triplet_loss``.
+
+    Returns
+    -------
+    triplet_loss : ``float``
+        the mean loss over the pairs (anchor, positive).
+    fraction_positive_triplets : ``float``
+    num_positive_triplets : ``int``
+    """
+    labels = np.asarray(labels).reshape(-1)
+    distances = pairwise_distances(embeddings, squared)
+    losses = []
+    for a in range(len(labels)):
+        negatives = [distances[a, n] for n in range(len(labels)) if labels[n] != labels[a]]
+        if not negatives:
+            continue
+        for p in range(len(labels)):
+            if p == a or labels[p] != labels[a]:
+                continue
+            farther = [d for d in negatives if d > distances[a, p]]
+            negative = min(farther) if farther else max(negatives)
+            losses.append(max(distances[a, p] - negative + margin, 0.0))
+    losses = np.array(losses)
+    if not len(losses):
+        return 0.0, 0.0, 0
+    num_positive = int(np.sum(losses > 1e-16))
+    return float(losses.mean()), num_positive / len(losses), num_positive
@@ -0,0 +1,46 @@
+"""
+.. automethod::
+    pyasv.loss.sampled_softmax.sampled_softmax_loss
+"""
+import tensorflow as tf
+
+
+__all__ = ['sampled_softmax_loss']
+
+
+def sampled_softmax_loss(weights, biases, labels, inputs, num_sampled, num_classes):
+    """Compute the softmax cross entropy over the true speaker and ``num_sampled`` sampled speakers.
+
+    The speakers are sampled uniformly without replacement, as the training speakers have
+    about the same number of examples. Only the sampled rows of ``weights`` are read, so
+    the cost of a step does not grow with the number of speakers.
+
+    Parameters
+    ----------
+    weights : ``tf.Variable``
+        ``[num_classes, dim]`` output weights, one row per speaker.
+    biases : ``tf.Variable``
+        ``[num_classes]`` output biases.
+    labels : ``tf.tensor``
+        ``[batch, num_classes]`` one-hot labels or ``[batch, 1]`` speaker ids.
+    inputs : ``tf.tensor``
+        ``[batch, dim]`` features.
+    num_sampled : ``int``
+        the number of sampled speakers per batch.
+    num_classes : ``int``
+        the number of speakers.
+
+    Returns
+    -------
+    loss : ``tf.tensor``
+        scalar, the mean loss of the batch.
+    """
+    if labels.get_shape().as_list()[-1] != 1:
+        labels = tf.argmax(labels, axis=1)
+    labels = tf.reshape(tf.cast(labels, tf.int64), [-1, 1])
+    sampled_values = tf.nn.uniform_candidate_sampler(true_classes=labels, num_true=1, num_sampled=num_sampled,
+                                                     unique=True, range_max=num_classes)
+    loss = tf.nn.sampled_softmax_loss(weights=weights, biases=biases, labels=labels, inputs=inputs,
+                                      num_sampled=num_sampled, num_classes=num_classes,
+                                      sampled_values=sampled_values, remove_accidental_hits=True)
+    return tf.reduce_mean(loss)
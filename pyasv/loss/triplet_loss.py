@@ -6,8 +6,14 @@
 .. automethod::
     pyasv.loss.triplet_loss.batch_all_triplet_loss
 
+.. automethod::
+    pyasv.loss.triplet_loss.batch_all_triplet_loss_sorted
+
 .. automethod::
     pyasv.loss.triplet_loss.batch_hard_triplet_loss
+
+.. automethod::
+    pyasv.loss.triplet_loss.semi_hard_triplet_loss
 """
 
 
@@ -17,7 +23,9 @@ import tensorflow as tf
 
 
 __all__ = ['batch_all_triplet_loss',
-           'batch_hard_triplet_loss']
+           'batch_all_triplet_loss_sorted',
+           'batch_hard_triplet_loss',
+           'semi_hard_triplet_loss']
 
 
 def _pairwise_distances(embeddings, squared=False):
@@ -207,6 +215,87 @@ def batch_all_triplet_loss(labels, embeddings, margin, squared=False):
     return triplet_loss, fraction_positive_triplets
 
 
+def _sorted_negative_distances(pairwise_dist, labels, margin):
+    """Sort the distances from each anchor to its negatives in ascending order.
+
+    Returns
+    -------
+    sorted_negative_dist : ``tf.tensor``
+        shape (batch_size, batch_size), the non-negatives are put at the end with a
+        distance larger than any ``d(a, p) + margin``.
+    mask_anchor_negative : ``tf.tensor``
+        float mask of shape (batch_size, batch_size).
+    """
+    mask_anchor_negative = _get_anchor_negative_triplet_mask(labels)
+    beyond = tf.stop_gradient(tf.reduce_max(pairwise_dist)) + margin + 1.0
+    anchor_negative_dist = tf.where(mask_anchor_negative, pairwise_dist,
+                                    beyond * tf.ones_like(pairwise_dist))
+    # top_k of the negated distances sorts each row and has a gradient.
+    sorted_negative_dist = -tf.nn.top_k(-anchor_negative_dist, k=tf.shape(anchor_negative_dist)[1]).values
+    return sorted_negative_dist, tf.to_float(mask_anchor_negative)
+
+
+def _gather_rows(params, indices):
+    """Return ``params[i, indices[i, j]]`` with shape of ``indices``."""
+    rows = tf.tile(tf.expand_dims(tf.range(tf.shape(indices)[0]), 1), [1, tf.shape(indices)[1]])
+    return tf.gather_nd(params, tf.stack([rows, indices], axis=2))
+
+
+def batch_all_triplet_loss_sorted(labels, embeddings, margin, squared=False):
+    """Compute ``batch_all_triplet_loss`` with O(batch_size^2) memory.
+
+    For an anchor ``a`` and a positive ``p``, the positive triplets are the negatives with
+    ``d(a, n) < d(a, p) + margin``. With the negatives of ``a`` sorted by distance, their number
+    ``c`` is found by ``tf.searchsorted`` and the sum of their losses is
+    ``c * (d(a, p) + margin) - (sum of the c nearest d(a, n))``, read from the prefix sums.
+
+    Parameters
+    ----------
+    labels : ``tf.tensor``
+        labels of the batch, of size (batch_size,)
+    embeddings : ``tf.tensor``
+        tensor of shape (batch_size, embed_dim)
+    margin : ``float``
+        margin for triplet loss
+    squared : ``Bool``
+        If true, output is the pairwise squared euclidean distance matrix.
+        If false, output is the pairwise euclidean distance matrix.
+
+    Returns
+    -------
+    triplet_loss : ``tf.tensor``
+        scalar tensor containing the triplet loss
+    fraction_positive_triplets : ``tf.tensor``
+        scalar tensor, the fraction of the valid triplets with a positive loss.
+    """
+    pairwise_dist = _pairwise_distances(embeddings, squared=squared)
+
+    mask_anchor_positive = tf.to_float(_get_anchor_positive_triplet_mask(labels))
+    sorted_negative_dist, mask_anchor_negative = _sorted_negative_distances(pairwise_dist, labels, margin)
+
+    # shape (batch_size, batch_size), thresholds[a, p] = d(a, p) + margin
+    thresholds = pairwise_dist + margin
+
+    # counts[a, p] is the number of negatives n with d(a, n) < d(a, p) + margin
+    counts = tf.searchsorted(sorted_negative_dist, thresholds, side='left')
+
+    # shape (batch_size, batch_size + 1), prefix_sums[a, c] is the sum of the c nearest negatives
+    prefix_sums = tf.concat([tf.zeros_like(sorted_negative_dist[:, :1]),
+                             tf.cumsum(sorted_negative_dist, axis=1)], axis=1)
+
+    positive_counts = tf.to_float(counts) * mask_anchor_positive
+    loss_sums = mask_anchor_positive * (positive_counts * thresholds - _gather_rows(prefix_sums, counts))
+
+    num_positive_triplets = tf.reduce_sum(positive_counts)
+    num_valid_triplets = tf.reduce_sum(mask_anchor_positive * tf.reduce_sum(mask_anchor_negative, axis=1,
+                                                                            keepdims=True))
+    fraction_positive_triplets = num_positive_triplets / (num_valid_triplets + 1e-16)
+
+    triplet_loss = tf.reduce_sum(loss_sums) / (num_positive_triplets + 1e-16)
+
+    return triplet_loss, fraction_positive_triplets
+
+
 def batch_hard_triplet_loss(labels, embeddings, margin, squared=False):
     """Build the triplet loss over a batch of embeddings.
     For each anchor, we get the hardest positive and hardest negative to form a triplet.
@@ -262,4 +351,59 @@ def batch_hard_triplet_loss(labels, embeddings, margin, squared=False):
     # Get final mean triplet loss
     triplet_loss = tf.reduce_mean(triplet_loss)
 
-    return triplet_loss
\ No newline at end of file
+    return triplet_loss
+
+
+def semi_hard_triplet_loss(labels, embeddings, margin, squared=False):
+    """Build the triplet loss over a batch of embeddings with semi-hard negatives.
+    For each pair (anchor, positive), the negative is the nearest one farther than the
+    positive. If there is none, the farthest negative is used, as in FaceNet.
+
+    The negatives of each anchor are sorted once and the semi-hard negative of every
+    positive is found by ``tf.searchsorted``, so the memory is O(batch_size^2).
+
+    Parameters
+    ----------
+    labels : ``tf.tensor``
+        labels of the batch, of size (batch_size,)
+    embeddings : ``tf.tensor``
+        tensor of shape (batch_size, embed_dim)
+    margin : ``float``
+        margin for triplet loss
+    squared : ``Bool``
+        If true, output is the pairwise squared euclidean distance matrix.
+        If false, output is the pairwise euclidean distance matrix.
+
+    Returns
+    -------
+    triplet_loss : ``tf.tensor``
+        scalar tensor, the mean loss over the pairs (anchor, positive).
+    fraction_positive_triplets : ``tf.tensor``
+        scalar tensor, the fraction of the pairs with a positive loss.
+    """
+    pairwise_dist = _pairwise_distances(embeddings, squared=squared)
+
+    mask_anchor_positive = tf.to_float(_get_anchor_positive_triplet_mask(labels))
+    sorted_negative_dist, mask_anchor_negative = _sorted_negative_distances(pairwise_dist, labels, margin)
+
+    # shape (batch_size, 1)
+    num_negatives = tf.to_int32(tf.reduce_sum(mask_anchor_negative, axis=1, keepdims=True))
+
+    # index of the nearest negative with d(a, n) > d(a, p), num_negatives if there is none
+    semi_hard_index = tf.searchsorted(sorted_negative_dist, pairwise_dist, side='right')
+    farthest_index = tf.maximum(num_negatives - 1, 0) * tf.ones_like(semi_hard_index)
+    negative_index = tf.where(semi_hard_index < num_negatives, semi_hard_index, farthest_index)
+    negative_dist = _gather_rows(sorted_negative_dist, negative_index)
+
+    # anchors without negatives have no triplet
+    valid_pairs = mask_anchor_positive * tf.to_float(num_negatives > 0)
+    triplet_loss = valid_pairs * tf.maximum(pairwise_dist - negative_dist + margin, 0.0)
+
+    num_valid_pairs = tf.reduce_sum(valid_pairs)
+    num_positive_triplets = tf.reduce_sum(tf.to_float(tf.greater(triplet_loss, 1e-16)))
+    fraction_positive_triplets = num_positive_triplets / (num_valid_pairs + 1e-16)
+
+    triplet_loss = tf.reduce_sum(triplet_loss) / (num_valid_pairs + 1e-16)
+
+    return triplet_loss, fraction_positive_triplets
+
@@ -1,3 +1,7 @@
 from pyasv.model.max_feature_map_dnn_model import MaxFeatureMapDnn
 from pyasv.model.ctdnn import CTDnn
 from pyasv.model.deep_speaker import DeepSpeaker
+from pyasv.model.embedder import Embedder
+from pyasv.model.max_feature_map_dnn_model import MaxFeatureMapDnnEmbedder
+from pyasv.model.ctdnn import CTDnnEmbedder
+from pyasv.model.deep_speaker import DeepSpeakerEmbedder
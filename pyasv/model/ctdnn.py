@@ -5,16 +5,31 @@ import tensorflow as tf
 import sys
 
 sys.path.append("../..")
-import os
-import time
 import numpy as np
-from pyasv.data_manage import DataManage
-from pyasv.data_manage import DataManage4BigData
-from tensorflow.python import debug
+from pyasv.model.embedder import Embedder
+from pyasv.engine import Trainer
+from pyasv.loss.sampled_softmax import sampled_softmax_loss
 
 
 class CTDnn:
-    def __init__(self, config, x, y=None):
+    # the shape of a training example and the dim of a feature, used by ``pyasv.engine.Trainer``.
+    input_shape = (9, 40, 1)
+    feature_dim = 400
+
+    def __init__(self, config, x, y=None, utterance=False):
+        """Create CTDNN model.
+
+        Parameters
+        ----------
+        config : ``config``
+            the config of model.
+        x : ``tf.Tensor``
+            ``[batch, 9, 40, 1]`` windows, or ``[batch, frames, 40, 1]`` utterances if ``utterance``.
+        y : ``tf.Tensor``
+            labels, the training graph is built if it is not None.
+        utterance : ``bool``
+            build the utterance mode inference graph, see ``frame_feature``.
+        """
 
         self._config = config
         self._batch_size = config.BATCH_SIZE
@@ -28,8 +43,11 @@ class CTDnn:
         self._lr = config.LR
         self._save_path = config.SAVE_PATH
         self._vectors = np.zeros(shape=(self._n_speaker, 400))
+        self._n_sampled = getattr(config, 'N_SAMPLED', None)
 
-        if y is not None:
+        if utterance:
+            self._build_utterance_graph(x)
+        elif y is not None:
             self._build_train_graph(x, y)
         else:
             self._build_pred_graph(x)
@@ -64,9 +82,25 @@ class CTDnn:
         """
         return self._feature
 
+    @property
+    def frame_feature(self):
+        """A ``property`` member to get the feature of every frame in utterance mode.
+
+        Returns
+        -------
+        frame_feature : ``tf.operation``
+            ``[batch, frames - 8, 400]``, the same features as the windows of
+            ``slide_windows`` with 4 frames on each side.
+        """
+        return self._frame_feature
+
     def _build_pred_graph(self, x):
         _, self._feature = self._inference(x)
 
+    def _build_utterance_graph(self, x):
+        self._frame_feature = self._utterance_inference(x)
+        self._feature = tf.reduce_mean(self._frame_feature, axis=1)
+
     def _build_train_graph(self, x, y):
         """
         Build the compute graph.
@@ -75,7 +109,11 @@ class CTDnn:
         out, feature = self._inference(x)
         self._prediction = tf.nn.softmax(out)
         self._feature = feature
-        self._loss = tf.reduce_mean(tf.nn.softmax_cross_entropy_with_logits(labels=y, logits=out))
+        if self._n_sampled:
+            self._loss = sampled_softmax_loss(self._output_weights, self._output_biases, y, feature,
+                                              self._n_sampled, self._n_speaker)
+        else:
+            self._loss = tf.reduce_mean(tf.nn.softmax_cross_entropy_with_logits(labels=y, logits=out))
 
     def _inference(self, frames):
 
@@ -93,6 +131,38 @@ class CTDnn:
                                         pool2.get_shape().as_list()[2] *
                                         pool2.get_shape().as_list()[3]])
 
+        return self._dnn(pool2_flat)
+
+    def _utterance_inference(self, frames):
+        """Run the convolutions once over whole utterances instead of once per window.
+
+        In a 9 frames window, conv1 gives 6 rows and pool1 keeps rows (0, 1), (2, 3), (4, 5),
+        so the conv2 rows of window ``j`` read the pool1 rows ``j, j+2`` and ``j+2, j+4`` of
+        the utterance. Pooling the utterance with a time stride of 1 and dilating conv2 by 2
+        in time gives every conv2 row once, and window ``j`` is the conv2 rows ``j`` and ``j+2``.
+        """
+        conv1 = self._conv2d(frames, 'conv1', [4, 8, 1, 128], [1, 1, 1, 1], 'VALID')
+
+        pool1 = tf.nn.max_pool(conv1, ksize=[1, 2, 3, 1], strides=[1, 1, 3, 1], padding='VALID')
+
+        conv2 = self._conv2d(pool1, 'conv2', [2, 4, 128, 256], [1, 1, 1, 1], 'VALID', dilation_rate=[2, 1])
+
+        pool2 = tf.nn.max_pool(conv2, ksize=[1, 1, 2, 1], strides=[1, 1, 2, 1], padding='VALID')
+
+        windows = tf.stack([pool2[:, :-2], pool2[:, 2:]], axis=2)
+
+        n_frames = tf.shape(windows)[1]
+
+        windows_flat = tf.reshape(windows, [-1, 2 *
+                                            pool2.get_shape().as_list()[2] *
+                                            pool2.get_shape().as_list()[3]])
+
+        _, feature_layer = self._dnn(windows_flat)
+
+        return tf.reshape(feature_layer, [-1, n_frames, 400])
+
+    def _dnn(self, pool2_flat):
+
         bottleneck = self._full_connect(pool2_flat, 'bottleneck', 512)
 
         bottleneck_t = tf.reshape(bottleneck, [-1, 512, 1])
@@ -121,23 +191,38 @@ class CTDnn:
 
         feature_layer = self._full_connect(pnorm2_output, name='feature_layer', units=400)
 
-        output = self._full_connect(feature_layer, name='output', units=self._n_speaker)
+        output = self._output_layer(feature_layer, name='output')
 
         output += 1e-10
 
         return output, feature_layer,
 
+    def _output_layer(self, x, name):
+        if not self._n_sampled:
+            return self._full_connect(x, name=name, units=self._n_speaker)
+        # with sampled softmax the weights are stored one row per speaker, so a step only
+        # reads and updates the rows of the sampled speakers.
+        with tf.name_scope(name):
+            self._output_weights = self._weights_variable([self._n_speaker, x.get_shape().as_list()[-1]],
+                                                          name=name+'_sampled_w')
+            self._output_biases = self._bias_variable(self._n_speaker, name=name+'_sampled_b')
+        return tf.nn.bias_add(tf.matmul(x, self._output_weights, transpose_b=True), self._output_biases,
+                              name=name + "_output")
+
     def _t_dnn(self, x, shape, strides, name):
         with tf.name_scope(name):
             weights = self._weights_variable(shape, name=name+'_w')
         return tf.nn.conv1d(x, weights, stride=strides, padding='SAME', name=name + "_output")
 
-    def _conv2d(self, x, name, shape, strides, padding='SAME'):
+    def _conv2d(self, x, name, shape, strides, padding='SAME', dilation_rate=None):
         with tf.name_scope(name):
             weights = self._weights_variable(shape, name=name+'_w')
             biases = self._bias_variable(shape[-1], name=name+'_b')
-        return tf.nn.relu(tf.nn.bias_add(tf.nn.conv2d(x, weights,
-                                                      strides=strides, padding=padding), biases, name=name + "_output"))
+        if dilation_rate is None:
+            conv = tf.nn.conv2d(x, weights, strides=strides, padding=padding)
+        else:
+            conv = tf.nn.convolution(x, weights, padding=padding, dilation_rate=dilation_rate)
+        return tf.nn.relu(tf.nn.bias_add(conv, biases, name=name + "_output"))
 
     def _full_connect(self, x, name, units):
         with tf.name_scope(name):
@@ -163,302 +248,46 @@ class CTDnn:
         return root_sum_squares
 
 
-def average_losses(loss):
-    tf.add_to_collection('losses', loss)
-
-    # Assemble all of the losses for the current tower only.
-    losses = tf.get_collection('losses')
-
-    # Calculate the total loss for the current tower.
-    regularization_losses = tf.get_collection(tf.GraphKeys.REGULARIZATION_LOSSES)
-    total_loss = tf.add_n(losses + regularization_losses, name='total_loss')
-
-    # Compute the moving average of all individual losses and the total loss.
-    loss_averages = tf.train.ExponentialMovingAverage(0.9, name='avg')
-    loss_averages_op = loss_averages.apply(losses + [total_loss])
-
-    with tf.control_dependencies([loss_averages_op]):
-        total_loss = tf.identity(total_loss)
-    return total_loss
-
-
-def average_gradients(tower_grads):
-    average_grads = []
-    for grad_and_vars in zip(*tower_grads):
-        # Note that each grad_and_vars looks like the following:
-        #   ((grad0_gpu0, var0_gpu0), ... , (grad0_gpuN, var0_gpuN))
-        grads = [g for g, _ in grad_and_vars]
-        # Average over the 'tower' dimension.
-        grad = tf.stack(grads, 0)
-        grad = tf.reduce_mean(grad, 0)
-
-        # Keep in mind that the Variables are redundant because they are shared
-        # across towers. So .. we will just return the first tower's pointer to
-        # the Variable.
-        v = grad_and_vars[0][1]
-        grad_and_var = (grad, v)
-        average_grads.append(grad_and_var)
-    return average_grads
-
-
-def feed_all_gpu(inp_dict, models, payload_per_gpu, batch_x, batch_y):
-    for i in range(len(models)):
-        x, y, _, _, _, _ = models[i]
-        start_pos = i * payload_per_gpu
-        stop_pos = (i + 1) * payload_per_gpu
-        inp_dict[x] = batch_x[start_pos:stop_pos]
-        inp_dict[y] = batch_y[start_pos:stop_pos]
-    return inp_dict
-
-
-def _no_gpu(config, train, validation):
-    tf.reset_default_graph()
-    with tf.Session() as sess:
-        learning_rate = config.LR
-        print('build model...')
-        opt = tf.train.AdamOptimizer(learning_rate=learning_rate)
-        x = tf.placeholder(tf.float32, [None, 9, 40, 1])
-        y = tf.placeholder(tf.float32, [None, config.N_SPEAKER])
-        model = CTDnn(config, x, y)
-        pred = model.prediction
-        loss = model.loss
-        feature = model.feature
-        train_op = opt.minimize(loss)
-        vectors = dict()
-        print("done...")
-        print('run train op...')
-        sess.run(tf.global_variables_initializer())
-        saver = tf.train.Saver()
-        for epoch in range(config.MAX_STEP):
-            start_time = time.time()
-            avg_loss = 0.0
-            total_batch = int(train.num_examples / config.BATCH_SIZE) - 1
-            print('\n---------------------')
-            print('Epoch:%d, lr:%.4f, total_batch=%d' % (epoch, config.LR, total_batch))
-            feature_ = None
-            ys = None
-            for batch_id in range(total_batch):
-                batch_x, batch_y = train.next_batch
-                batch_x = batch_x.reshape(-1, 9, 40, 1)
-                _, _loss, batch_feature = sess.run([train_op, loss, feature],
-                                                   feed_dict={x: batch_x, y: batch_y})
-
-                avg_loss += _loss
-                if feature_ is None:
-                    feature_ = batch_feature
-                else:
-                    feature_ = np.concatenate((feature_, batch_feature), 0)
-                if ys is None:
-                    ys = batch_y
-                else:
-                    ys = np.concatenate((ys, batch_y), 0)
-                print("batch_%d  batch_loss=%.4f"%(batch_id, _loss), end='\r')
-            print('\n')
-            train.reset_batch_counter()
-            for spkr in range(config.N_SPEAKER):
-                if len(feature_[np.argmax(ys, 1) == spkr]):
-                    vector = np.mean(feature_[np.argmax(ys, 1) == spkr], axis=0)
-                    if spkr in vectors.keys():
-                        vector = (vectors[spkr] + vector) / 2
-                    else:
-                        vector = vector
-                    vectors[spkr] = vector
-                else:
-                    if spkr not in vectors.keys():
-                        vectors[spkr] = np.zeros(400, dtype=np.float32)
-            avg_loss /= total_batch
-            print('Train loss:%.4f' % (avg_loss))
-            total_batch = int(validation.num_examples / config.BATCH_SIZE) - 1
-            preds = None
-            feature_ = None
-            ys = None
-            for batch_idx in range(total_batch):
-                print("validation in batch_%d..."%batch_idx, end='\r')
-                batch_x, batch_y = validation.next_batch
-                batch_y, batch_pred, batch_feature = sess.run([y, pred, feature],
-                                                              feed_dict={x:batch_x, y:batch_y})
-                if preds is None:
-                    preds = batch_pred
-                else:
-                    preds = np.concatenate((preds, batch_pred), 0)
-                if feature_ is None:
-                    feature_ = batch_feature
-                else:
-                    feature_ = np.concatenate((feature_, batch_feature), 0)
-                if ys is None:
-                    ys = batch_y
-                else:
-                    ys = np.concatenate((ys, batch_y), 0)
-            validation.reset_batch_counter()
-            vec_preds = []
-            for sample in range(feature_.shape[0]):
-                score = -100
-                pred = -1
-                for spkr in vectors.keys():
-                    if cosine(vectors[spkr], feature_[sample]) > score:
-                        score = cosine(vectors[spkr], feature_[sample])
-                        pred = int(spkr)
-                vec_preds.append(pred)
-            correct_pred = np.equal(np.argmax(ys, 1), vec_preds)
-            val_accuracy = np.mean(np.array(correct_pred, dtype='float'))
-            print('Val Accuracy: %0.4f%%' % (100.0 * val_accuracy))
-            stop_time = time.time()
-            elapsed_time = stop_time-start_time
-            saver.save(sess=sess, save_path=os.path.join(model._save_path, model._name + ".ckpt"))
-            print('Cost time: ' + str(elapsed_time) + ' sec.')
-        print('training done.')
-
-
-def _multi_gpu(config, train, validation, debug_mode=False):
-    tf.reset_default_graph()
-    with tf.Session() as sess:
-        with tf.device('/cpu:0'):
-            learning_rate = config.LR
-            # opt = tf.train.GradientDescentOptimizer(learning_rate=learning_rate)
-            opt = tf.train.AdamOptimizer(learning_rate=learning_rate)
-            print('build model...')
-            print('build model on gpu tower...')
-            models = []
-            for gpu_id in range(config.N_GPU):
-                with tf.device('/gpu:%d' % gpu_id):
-                    print('tower:%d...' % gpu_id)
-                    with tf.name_scope('tower_%d' % gpu_id):
-                        with tf.variable_scope('cpu_variables', reuse=tf.AUTO_REUSE):
-                            x = tf.placeholder(tf.float32, [None, 9, 40, 1])
-                            y = tf.placeholder(tf.float32, [None, train.spkr_num])
-                            model = CTDnn(config, x, y)
-                            pred = model.prediction
-                            feature = model.feature
-                            loss = model.loss
-                            grads = opt.compute_gradients(loss)
-                            models.append((x, y, pred, loss, grads, feature))
-            print('build model on gpu tower done.')
-
-            print('reduce model on cpu...')
-            tower_x, tower_y, tower_preds, tower_losses, tower_grads, tower_feature = zip(*models)
-            aver_loss_op = tf.reduce_mean(tower_losses)
-            apply_gradient_op = opt.apply_gradients(average_gradients(tower_grads))
-            get_feature = tf.reshape(tf.stack(tower_feature, 0), [-1, 400])
-
-            all_y = tf.reshape(tf.stack(tower_y, 0), [-1, config.N_SPEAKER])
-
-            all_pred = tf.reshape(tf.stack(tower_preds, 0), [-1, config.N_SPEAKER])
-
-            vectors = dict()
-
-            print('reduce model on cpu done.')
-
-            print('run train op...')
-            sess.run(tf.global_variables_initializer())
-            if debug_mode:
-                sess = debug.LocalCLIDebugWrapperSession(sess=sess)
-            saver = tf.train.Saver()
-
-            for epoch in range(config.MAX_STEP):
-                start_time = time.time()
-                payload_per_gpu = int(config.BATCH_SIZE//config.N_GPU)
-                if config.BATCH_SIZE % config.N_GPU:
-                    print("Warning: Batch size can't to be divisible of N_GPU")
-                total_batch = int(train.num_examples / config.BATCH_SIZE) - 1
-                avg_loss = 0.0
-                print('\n---------------------')
-                print('Epoch:%d, lr:%.4f, total_batch:%d' % (epoch, config.LR, total_batch))
-                feature_ = None
-                ys = None
-
-                # temp log
-                for batch_idx in range(total_batch):
-                    batch_x, batch_y = train.next_batch
-                    batch_x = batch_x.reshape(-1, 9, 40, 1)
-                    # Below line is required for big data set
-                    # batch_y = np.array((np.eye(config.N_SPEAKER)[np.array(batch_y).reshape(-1)]), dtype=np.float32)
-                    inp_dict = dict()
-                    # print("data part done...")
-                    inp_dict = feed_all_gpu(inp_dict, models, payload_per_gpu, batch_x, batch_y)
-                    _, _loss, batch_feature = sess.run([apply_gradient_op, aver_loss_op, get_feature], inp_dict)
-                    # print("train part done...")
-                    avg_loss += _loss
-                    if ys is None:
-                        ys = batch_y
-                    else:
-                        ys = np.concatenate((ys, batch_y), 0)
-                    if feature_ is None:
-                        feature_ = batch_feature
-                    else:
-                        feature_ = np.concatenate((feature_, batch_feature), 0)
-                    print("batch_%d, batch_loss=%.4f, payload_per_gpu=%d"%(batch_idx, _loss, payload_per_gpu), end='\r')
-                print("\n")
-                train.reset_batch_counter()
-                for spkr in range(config.N_SPEAKER):
-                    if len(feature_[np.argmax(ys, 1) == spkr]):
-                        vector = np.mean(feature_[np.argmax(ys, 1) == spkr], axis=0)
-                        if spkr in vectors.keys():
-                            vector = (vectors[spkr] + vector) / 2
-                        else:
-                            vector = vector
-                        vectors[spkr] = vector
-                    else:
-                        if spkr not in vectors.keys():
-                            vectors[spkr] = np.zeros(400, dtype=np.float32)
-                # print("vector part done....")
-                avg_loss /= total_batch
-                print('Train loss:%.4f' % (avg_loss))
-
-                val_payload_per_gpu = int(config.BATCH_SIZE//config.N_GPU)
-                if config.BATCH_SIZE % config.N_GPU:
-                    print("Warning: Batch size can't to be divisible of N_GPU")
-
-                total_batch = int(validation.num_examples / config.BATCH_SIZE) - 1
-                preds = None
-                ys = None
-                feature_ = None
-                for batch_idx in range(total_batch):
-                    batch_x, batch_y = validation.next_batch
-                    batch_x = batch_x.reshape(-1, 9, 40, 1)
-                    # Below line is required for big data set
-                    # batch_y = np.array((np.eye(config.N_SPEAKER)[np.array(batch_y).reshape(-1)]), dtype=np.float32)
-                    inp_dict = feed_all_gpu({}, models, val_payload_per_gpu, batch_x, batch_y)
-
-                    batch_pred, batch_y_, batch_feature = sess.run([all_pred, all_y, get_feature], inp_dict)
-                    if preds is None:
-                        preds = batch_pred
-                    else:
-                        preds = np.concatenate((preds, batch_pred), 0)
-                    if feature_ is None:
-                        feature_ = batch_feature
-                    else:
-                        feature_ = np.concatenate((feature_, batch_feature), 0)
-                    if ys is None:
-                        ys = batch_y_
-                    else:
-                        ys = np.concatenate((ys, batch_y_), 0)
-                    
-                validation.reset_batch_counter()
-                vec_preds = []
-                for sample in range(feature_.shape[0]):
-                    score = -100
-                    pred = -1
-                    for spkr in vectors.keys():
-                        if cosine(vectors[spkr], feature_[sample]) > score:
-                            score = cosine(vectors[spkr], feature_[sample])
-                            pred = int(spkr)
-                    vec_preds.append(pred)
-                correct_pred = np.equal(np.argmax(ys, 1), vec_preds)
-                val_accuracy = np.mean(np.array(correct_pred, dtype='float'))
-                print('Val Accuracy: %0.4f%%' % (100.0 * val_accuracy))
-                saver.save(sess=sess, save_path=os.path.join(model._save_path, model._name + ".ckpt"))
-                stop_time = time.time()
-                elapsed_time = stop_time-start_time
-                print('Cost time: ' + str(elapsed_time) + ' sec.')
-            print('training done.')
-
-
-def cosine(vector1, vector2):
-    return np.dot(vector1, vector2) / (np.linalg.norm(vector1) * (np.linalg.norm(vector2)))
-
-
-def run(config, train, validation, debug_mode=False):
-    """Train CTDNN model.
+class CTDnnEmbedder(Embedder):
+    """Keep a restored ``CTDnn`` model to extract features repeatedly.
+
+    ``embed_utterance`` averages the features of every frame with its 9 frames context,
+    the convolutions run once over the utterance (see ``CTDnn.frame_feature``).
+    """
+    model_class = CTDnn
+    frame_shape = (9, 40, 1)
+    hop = 1
+
+    def _build(self, config):
+        model = CTDnn(config, self._x)
+        self._utterance_x = tf.placeholder(tf.float32, [1, None, 40, 1], name='utterance_x')
+        with tf.variable_scope(tf.get_variable_scope(), reuse=True):
+            self._utterance_feature = CTDnn(config, self._utterance_x, utterance=True).feature
+        return model
+
+    def embed_utterance(self, features, hop=None):
+        """Extract one feature of an utterance, the mean of the features of its frames.
+
+        Parameters
+        ----------
+        features : ``np.ndarray``
+            ``[frames, 40]`` feature matrix.
+        hop : ``int``
+            frames between the starts of two windows, only a hop of 1 uses the shared convolutions.
+
+        Returns
+        -------
+        feature : ``np.ndarray``
+            ``[400]`` feature.
+        """
+        if (hop or self.hop) != 1 or len(features) < self.frame_shape[0]:
+            return Embedder.embed_utterance(self, features, hop)
+        features = np.asarray(features, dtype=np.float32).reshape([1, -1, 40, 1])
+        return self._sess.run(self._utterance_feature, feed_dict={self._utterance_x: features})[0]
+
+
+def run(config, train, validation, debug_mode=False, hooks=None):
+    """Train CTDNN model, see ``pyasv.engine.Trainer``.
 
     Parameters
     ----------
@@ -468,112 +297,37 @@ def run(config, train, validation, debug_mode=False):
         train dataset.
     validation
         validation dataset.
+    debug_mode : ``bool``
+        wrap the session in the tensorflow CLI debugger.
+    hooks : ``list``
+        ``pyasv.engine.Hook`` objects called during training.
+    """
+    Trainer(CTDnn, config, hooks).run(train, validation, debug_mode)
+
+
+def restore(config, enroll, test, output='text', k=5):
+    """Enroll speakers with the trained CTDNN model and score the test set.
+
+    Parameters
+    ----------
+    config : ``config``
+        the config of model.
+    enroll : ``DataManage``
+        enroll dataset.
+    test : ``DataManage``
+        test dataset.
+    output : ``str``
+        ``'text'`` writes ``result.txt``, ``'npy'`` writes the score matrix into ``scores.npy``
+        and ``'topk'`` only writes the ``k`` best speakers per vector, see ``ScoreWriter``.
+    k : ``int``
+        the number of speakers kept per vector with ``output='topk'``.
+
+    Returns
+    -------
+    summary : ``dict``
+        see ``ScoreWriter.summary``.
     """
-    if config.N_GPU == 0:
-        _no_gpu(config, train, validation)
-    else:
-        if os.path.exists('./tmp'):
-            os.rename('./tmp', './tmp-backup')
-        os.system('nvidia-smi -q -d Memory |grep -A4 GPU|grep Free > ./tmp')
-        memory_gpu=[int(x.split()[2]) for x in open('tmp','r').readlines()]
-        gpu_list = []
-        for gpu in range(config.N_GPU):
-            gpu_list.append(str(np.argmax(memory_gpu)))
-            memory_gpu[np.argmax(memory_gpu)] = -10000
-        s = ""
-        for i in range(config.N_GPU):
-            if i != 0:
-                s += ','
-            s += str(gpu_list[i])
-        os.environ['CUDA_VISIBLE_DEVICES'] = s
-        os.remove('./tmp')
-        _multi_gpu(config, train, validation, debug_mode)
-
-
-def restore(config, enroll, test):
-    with tf.Graph().as_default() as g:
-        assert type(enroll) == (DataManage or DataManage4BigData)
-        assert type(enroll) == (DataManage or DataManage4BigData)
-        with tf.Session() as sess:
-            x = tf.placeholder(tf.float32, [None, 9, 40, 1])
-            if config.N_GPU == 0:
-                model = CTDnn(config, x)
-            else:
-                with tf.variable_scope('cpu_variables', reuse=tf.AUTO_REUSE):
-                    model = CTDnn(config, x)
-            get_feature = model.feature
-            saver = tf.train.Saver()
-            saver.restore(sess, os.path.join(config.SAVE_PATH, config.MODEL_NAME + ".ckpt"))
-            print("restore model succeed.")
-            total_batch = int(enroll.num_examples / config.BATCH_SIZE)
-            ys = None
-            feature_ = None
-            print("enrolling...")
-            for batch in range(total_batch):
-                batch_x, batch_y = enroll.next_batch
-
-                if batch_x.shape[0] != enroll.batch_size:
-                    print("Abandon the last batch because it is not enough.")
-                    break
-
-                batch_feature = sess.run(get_feature, feed_dict={x: batch_x})
-                if feature_ is None:
-                    feature_ = batch_feature
-                else:
-                    feature_ = np.concatenate((feature_, batch_feature), 0)
-                if ys is None:
-                    ys = batch_y
-                else:
-                    ys = np.concatenate((ys, batch_y), 0)
-            enrolled_vector = {}
-            for i in range(enroll.spkr_num):
-                enrolled_vector[i] = np.mean(feature_[np.argmax(ys, axis=1) == i], 0)
-
-            print("testing...")
-            total_batch = int(test.num_examples / config.BATCH_SIZE)
-            for batch in range(total_batch):
-                batch_x, batch_y = test.next_batch
-
-                if batch_x.shape[0] != test.batch_size:
-                    print("Abandon the last batch because it is not enough.")
-                    break
-
-                batch_feature = sess.run(get_feature, feed_dict={x: batch_x})
-                if feature_ is None:
-                    feature_ = batch_feature
-                else:
-                    feature_ = np.concatenate((feature_, batch_feature), 0)
-                if ys is None:
-                    ys = batch_y
-                else:
-                    ys = np.concatenate((ys, batch_y), 0)
-            support = 0
-            all_ = 0
-            print("writing the result in %s"%config.SAVE_PATH + "/result.txt")
-            result = []
-            with open(os.path.join(config.SAVE_PATH, 'result.txt'), 'w') as f:
-                vec_id = 0
-                for vec in feature_:
-                    score = -1
-                    pred = None
-                    scores = []
-                    for key in enrolled_vector.keys():
-                        tmp_score = cosine(vec, enrolled_vector[key])
-                        scores.append(tmp_score)
-                        if tmp_score > score:
-                            score = tmp_score
-                            pred = key
-                            if pred == np.argmax(ys, axis=1)[vec_id]:
-                                support += 1
-                            all_ += 1
-                    string = "No.%d vector, pred:" % vec_id + str(pred) + " "
-                    string += str(pred==np.argmax(ys, axis=1)[vec_id])+ " Score list:" + str(scores) + '\n'
-                    result.append(string)
-                    vec_id += 1
-                f.writelines("Acc:%.4f  Num_of_true:%d\n"%(support/all_, support))
-                for line in result:
-                    f.writelines(line)
-            print("done.")
+    return Trainer(CTDnn, config).restore(enroll, test, output, k)
 
 
 def _main():
@@ -0,0 +1,79 @@
+"""
+Embedder
+--------
+
+.. autoclass:: pyasv.model.embedder.Embedder
+    :members:
+    :inherited-members:
+
+    .. automethod:: __init__
+"""
+import os
+import tensorflow as tf
+from pyasv.inference import BaseEmbedder, freeze_graph, write_frozen_graph, session_config
+
+
+class Embedder(BaseEmbedder):
+    """
+    Base class of the embedding extractors. The graph is built and the checkpoint is
+    restored once, then ``embed`` can be called repeatedly with the same session.
+
+    Subclasses set ``model_class``, the ``frame_shape`` of one input example and the
+    default ``hop`` (in frames) between the windows of ``embed_utterance``.
+    """
+    model_class = None
+
+    def __init__(self, config, checkpoint=None, batch_size=None, intra_op_threads=0, inter_op_threads=0):
+        """
+        Parameters
+        ----------
+        config : ``config``
+            the config of model.
+        checkpoint : ``str``
+            path of the checkpoint, ``SAVE_PATH/MODEL_NAME.ckpt`` if None.
+        batch_size : ``int``
+            the fixed number of examples fed per run, ``config.BATCH_SIZE`` if None.
+        intra_op_threads : ``int``
+            threads used inside one op, 0 lets tensorflow decide.
+        inter_op_threads : ``int``
+            threads used to run independent ops, 0 lets tensorflow decide.
+        """
+        if checkpoint is None:
+            checkpoint = os.path.join(config.SAVE_PATH, config.MODEL_NAME + ".ckpt")
+        self.config = config
+        self.batch_size = batch_size or config.BATCH_SIZE
+        self._graph = tf.Graph()
+        with self._graph.as_default():
+            self._x = tf.placeholder(tf.float32, [self.batch_size] + list(self.frame_shape), name='x')
+            if config.N_GPU == 0:
+                model = self._build(config)
+            else:
+                with tf.variable_scope('cpu_variables', reuse=tf.AUTO_REUSE):
+                    model = self._build(config)
+            self._feature = tf.identity(model.feature, name='feature')
+            saver = tf.train.Saver()
+        self._sess = tf.Session(graph=self._graph, config=session_config(intra_op_threads, inter_op_threads))
+        saver.restore(self._sess, checkpoint)
+        self._graph.finalize()
+        self.dim = int(self._feature.shape[-1])
+
+    def _build(self, config):
+        """Build the model in the current graph and variable scope, return it."""
+        return self.model_class(config, self._x)
+
+    def _run(self, batch):
+        return self._sess.run(self._feature, feed_dict={self._x: batch})
+
+    def export(self, path):
+        """Write the inference graph with the restored weights as a frozen graph,
+        which can be loaded by ``pyasv.inference.FrozenEmbedder``.
+
+        Parameters
+        ----------
+        path : ``str``
+            the output directory.
+        """
+        graph_def = freeze_graph(self._sess, self._x.op.name, self._feature.op.name)
+        write_frozen_graph(path, graph_def, {'input': self._x.name, 'output': self._feature.name,
+                                             'frame_shape': list(self.frame_shape), 'hop': self.hop,
+                                             'batch_size': self.batch_size, 'dim': self.dim})
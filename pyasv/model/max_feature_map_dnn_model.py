@@ -1,14 +1,19 @@
 import tensorflow as tf
 import sys
 sys.path.append("../..")
-import os
-import time
 import numpy as np
-from pyasv.data_manage import DataManage
-from pyasv.data_manage import DataManage4BigData
+from pyasv.backend.centroid import CentroidAccumulator
+from pyasv.backend.scoring import best_match
+from pyasv.model.embedder import Embedder
+from pyasv.engine import Trainer
+from pyasv.loss.sampled_softmax import sampled_softmax_loss
 
 
 class MaxFeatureMapDnn:
+    # the shape of a training example and the dim of a feature, used by ``pyasv.engine.Trainer``.
+    input_shape = (50, 40, 1)
+    feature_dim = 400
+
     def __init__(self, config, x, y=None):
         """Create Max feature Map model.
 
@@ -35,6 +40,7 @@ class MaxFeatureMapDnn:
             self._url_of_big_dataset = config.URL_OF_BIG_DATASET
         self._lr = config.LR
         self._save_path = config.SAVE_PATH
+        self._n_sampled = getattr(config, 'N_SAMPLED', None)
         if y is not None:
             self._build_train_graph(x, y)
         else:
@@ -78,7 +84,11 @@ class MaxFeatureMapDnn:
         out, mfm6 = self._inference(x)
         self._feature = mfm6
         self._prediction = out
-        self._loss = tf.reduce_mean(tf.nn.softmax_cross_entropy_with_logits(labels=y, logits=out))
+        if self._n_sampled:
+            self._loss = sampled_softmax_loss(self._output_weights, self._output_biases, y, mfm6,
+                                              self._n_sampled, self._n_speaker)
+        else:
+            self._loss = tf.reduce_mean(tf.nn.softmax_cross_entropy_with_logits(labels=y, logits=out))
 
     def _inference(self, frames):
         conv_1 = self._conv2d(frames, name='Conv1',shape=[7, 7, 1, 128], 
@@ -126,9 +136,21 @@ class MaxFeatureMapDnn:
         fc_1 = self._full_connect(pool_5_flat, name='fc_1', units=800)
         mfm_6 = self._max_feature_map(fc_1, netType='fc')
         
-        out = self._full_connect(mfm_6, name='out', units=self._n_speaker)
+        out = self._output_layer(mfm_6, name='out')
         return out, mfm_6
 
+    def _output_layer(self, x, name):
+        if not self._n_sampled:
+            return self._full_connect(x, name=name, units=self._n_speaker)
+        # with sampled softmax the weights are stored one row per speaker, so a step only
+        # reads and updates the rows of the sampled speakers.
+        with tf.name_scope(name):
+            self._output_weights = self._weights_variable([self._n_speaker, x.get_shape().as_list()[-1]],
+                                                          name=name+'_sampled_w')
+            self._output_biases = self._bias_variable(self._n_speaker, name=name+'_sampled_b')
+        return tf.nn.bias_add(tf.matmul(x, self._output_weights, transpose_b=True), self._output_biases,
+                              name=name+"_output")
+
     def _max_feature_map(self, x, netType='conv', name='activation'):
         if netType == 'fc':    
             x0, x1 = tf.split(x, num_or_size_splits = 2, axis = 1)
@@ -189,331 +211,30 @@ class MaxFeatureMapDnn:
         features = sess.run(self.feature,
                             feed_dict={'x:0': enroll_frames, 'y_:0': enroll_labels})
 
-        for i in range(self._n_speaker):
-            self._vectors[i] = np.mean(features[np.max(enroll_labels) == i])
+        enrolled = CentroidAccumulator(self._n_speaker, features.shape[-1])
+        enrolled.update(features, enroll_labels)
+        self._vectors = enrolled.epoch_means()
 
         features = sess.run(self.feature,
                             feed_dict={'x:0': test_frames, 'y_:0': test_labels})
 
-        tot = 0
-        acc = 0
-        # print(features.shape[0])
-        for vec_id in range(test_labels.shape[0]):
-            score = -1
-            pred = -1
-            tot += 1
-            for spkr_id in range(self._n_speaker):
-                if self._cosine(self._vectors[spkr_id], features[vec_id]) > score:
-                    score = self._cosine(self._vectors[spkr_id], features[vec_id])
-                    pred = spkr_id
-            if pred == np.argmax(test_labels, axis=1)[vec_id]:
-                acc += 1
-
-        return acc / tot
-
-    def _cosine(self, vector1, vector2):
-        return np.dot(vector1, vector2) / (np.linalg.norm(vector1) * (np.linalg.norm(vector2)))
-
-
-def cosine(vector1, vector2):
-    return np.dot(vector1, vector2) / (np.linalg.norm(vector1) * (np.linalg.norm(vector2)))
-
-
-def average_losses(loss):
-    tf.add_to_collection('losses', loss)
-
-    # Assemble all of the losses for the current tower only.
-    losses = tf.get_collection('losses')
-
-    # Calculate the total loss for the current tower.
-    regularization_losses = tf.get_collection(tf.GraphKeys.REGULARIZATION_LOSSES)
-    total_loss = tf.add_n(losses + regularization_losses, name='total_loss')
-
-    # Compute the moving average of all individual losses and the total loss.
-    loss_averages = tf.train.ExponentialMovingAverage(0.9, name='avg')
-    loss_averages_op = loss_averages.apply(losses + [total_loss])
-
-    with tf.control_dependencies([loss_averages_op]):
-        total_loss = tf.identity(total_loss)
-    return total_loss
-
-
-def average_gradients(tower_grads):
-    average_grads = []
-    for grad_and_vars in zip(*tower_grads):
-        # Note that each grad_and_vars looks like the following:
-        #   ((grad0_gpu0, var0_gpu0), ... , (grad0_gpuN, var0_gpuN))
-        grads = [g for g, _ in grad_and_vars]
-        # Average over the 'tower' dimension.
-        grad = tf.stack(grads, 0)
-        grad = tf.reduce_mean(grad, 0)
-
-        # Keep in mind that the Variables are redundant because they are shared
-        # across towers. So .. we will just return the first tower's pointer to
-        # the Variable.
-        v = grad_and_vars[0][1]
-        grad_and_var = (grad, v)
-        average_grads.append(grad_and_var)
-    return average_grads
-
-
-def feed_all_gpu(inp_dict, models, payload_per_gpu, batch_x, batch_y):
-    for i in range(len(models)):
-        x, y, _, _, _, _ = models[i]
-        start_pos = i * payload_per_gpu
-        stop_pos = (i + 1) * payload_per_gpu
-        inp_dict[x] = batch_x[start_pos:stop_pos]
-        inp_dict[y] = batch_y[start_pos:stop_pos]
-    return inp_dict
-
-
-def _no_gpu(config, train, validation):
-    tf.reset_default_graph()
-    with tf.Session() as sess:
-        learning_rate = config.LR
-        print('build model...')
-        opt = tf.train.AdamOptimizer(learning_rate=learning_rate)
-        x = tf.placeholder(tf.float32, [None, 50, 40, 1])
-        y = tf.placeholder(tf.float32, [None, config.N_SPEAKER])
-        model = MaxFeatureMapDnn(config, x, y)
-        pred = model.prediction
-        loss = model.loss
-        feature = model.feature
-        train_op = opt.minimize(loss)
-        vectors = dict()
-        print("done...")
-        print('run train op...')
-        sess.run(tf.global_variables_initializer())
-        saver = tf.train.Saver()
-        for epoch in range(config.MAX_STEP):
-            start_time = time.time()
-            avg_loss = 0.0
-            total_batch = int(train.num_examples / config.BATCH_SIZE) - 1
-            print('\n---------------------')
-            print('Epoch:%d, lr:%.4f, total_batch=%d' % (epoch, config.LR, total_batch))
-            feature_ = None
-            ys = None
-            for batch_id in range(total_batch):
-                batch_x, batch_y = train.next_batch
-                batch_x = batch_x.reshape(-1, 50, 40, 1)
-                batch_y = np.eye(train.spkr_num)[batch_y.reshape(-1)]
-                _, _loss, batch_feature = sess.run([train_op, loss, feature],
-                                                   feed_dict={x: batch_x, y: batch_y})
-                avg_loss += _loss
-                if ys is None:
-                    ys = batch_y
-                else:
-                    ys = np.concatenate((ys, batch_y), 0)
-                if feature_ is None:
-                    feature_ = batch_feature
-                else:
-                    feature_ = np.concatenate((feature_, batch_feature), 0)
-                print("batch_%d  batch_loss=%.4f"%(batch_id, _loss), end='\r')
-            print('\n')
-            train.reset_batch_counter()
-            for spkr in range(config.N_SPEAKER):
-                if len(feature_[np.argmax(ys, 1) == spkr]):
-                    vector = np.mean(feature_[np.argmax(ys, 1) == spkr], axis=0)
-                    if spkr in vectors.keys():
-                        vector = (vectors[spkr] + vector) / 2
-                    else:
-                        vector = vector
-                    vectors[spkr] = vector
-                else:
-                    if spkr not in vectors.keys():
-                        vectors[spkr] = np.zeros(400, dtype=np.float32)
-            avg_loss /= total_batch
-            print('Train loss:%.4f' % (avg_loss))
-            total_batch = int(validation.num_examples / config.BATCH_SIZE) - 1
-            preds = None
-            feature = None
-            ys = None
-            if total_batch < 1:
-                print("your validation dataset's size is less than one batch.")
-                exit(1)
-            for batch_idx in range(total_batch):
-                print("validation in batch_%d..." % batch_idx, end='\r')
-                batch_x, batch_y = validation.next_batch
-                batch_x = batch_x.reshape(-1, 50, 40, 1)
-                batch_y, batch_pred, batch_feature = sess.run([y, pred, feature],
-                                                              feed_dict={x: batch_x, y: batch_y})
-                if preds is None:
-                    preds = batch_pred
-                else:
-                    preds = np.concatenate((preds, batch_pred), 0)
-                if feature is None:
-                    feature = batch_feature
-                else:
-                    feature = np.concatenate((feature, batch_feature), 0)
-                if ys is None:
-                    ys = batch_y
-                else:
-                    ys = np.concatenate((ys, batch_y), 0)
-            vec_preds = []
-            validation.reset_batch_counter()
-            for sample in range(feature.shape[0]):
-                score = -100
-                pred = -1
-                for spkr in vectors.keys():
-                    if cosine(vectors[spkr], feature[sample]) > score:
-                        score = cosine(vectors[spkr], feature[sample])
-                        pred = int(spkr)
-                vec_preds.append(pred)
-            correct_pred = np.equal(np.argmax(ys, 1), vec_preds)
-            val_accuracy = np.mean(np.array(correct_pred, dtype='float'))
-            print('Val Accuracy: %0.4f%%' % (100.0 * val_accuracy))
-            saver.save(sess=sess, save_path=os.path.join(model._save_path, model._name + ".ckpt"))
-            stop_time = time.time()
-            elapsed_time = stop_time - start_time
-            print('Cost time: ' + str(elapsed_time) + ' sec.')
-        print('training done.')
-
-
-def _multi_gpu(config, train, validation):
-    tf.reset_default_graph()
-    with tf.Session() as sess:
-        with tf.device('/cpu:0'):
-            learning_rate = config.LR
-            opt = tf.train.GradientDescentOptimizer(learning_rate=learning_rate)
-            print('build model...')
-            print('build model on gpu tower...')
-            models = []
-            for gpu_id in range(config.N_GPU):
-                with tf.device('/gpu:%d' % gpu_id):
-                    print('tower:%d...' % gpu_id)
-                    with tf.name_scope('tower_%d' % gpu_id):
-                        with tf.variable_scope('cpu_variables', reuse=tf.AUTO_REUSE):
-                            x = tf.placeholder(tf.float32, [None, 50, 40, 1])
-                            y = tf.placeholder(tf.float32, [None, train.spkr_num])
-                            model = MaxFeatureMapDnn(config, x, y)
-                            pred = model.prediction
-                            feature = model.feature
-                            loss = model.loss
-                            grads = opt.compute_gradients(loss)
-                            models.append((x, y, pred, loss, grads, feature))
-            print('build model on gpu tower done.')
-
-            print('reduce model on cpu...')
-            tower_x, tower_y, tower_preds, tower_losses, tower_grads, tower_feature = zip(*models)
-            aver_loss_op = tf.reduce_mean(tower_losses)
-            apply_gradient_op = opt.apply_gradients(average_gradients(tower_grads))
-            get_feature = tf.reshape(tf.stack(tower_feature, 0), [-1, 400])
-
-            all_y = tf.reshape(tf.stack(tower_y, 0), [-1, config.N_SPEAKER])
-
-            all_pred = tf.reshape(tf.stack(tower_preds, 0), [-1, config.N_SPEAKER])
-
-            vectors = dict()
-
-            print('reduce model on cpu done.')
-
-            print('run train op...')
-            sess.run(tf.global_variables_initializer())
-
-            saver = tf.train.Saver()
-
-            for epoch in range(config.MAX_STEP):
-                start_time = time.time()
-                payload_per_gpu = int(config.BATCH_SIZE // config.N_GPU)
-                if config.BATCH_SIZE % config.N_GPU:
-                    print("Warning: Batch size can't to be divisible of N_GPU")
-                total_batch = int(train.num_examples / config.BATCH_SIZE) - 1
-                avg_loss = 0.0
-                print('\n---------------------')
-                print('Epoch:%d, lr:%.4f, total_batch=%d' % (epoch, config.LR, total_batch))
-                feature_ = None
-                ys = None
-                for batch_idx in range(total_batch):
-                    batch_x, batch_y = train.next_batch
-                    batch_x = batch_x.reshape(-1, 50, 40, 1)
-                    inp_dict = dict()
-                    # print("data part done...")
-                    inp_dict = feed_all_gpu(inp_dict, models, payload_per_gpu, batch_x, batch_y)
-                    _, _loss, feature = sess.run([apply_gradient_op, aver_loss_op, get_feature], inp_dict)
-                    # print("train part done...")
-                    avg_loss += _loss
-                    if ys is None:
-                        ys = batch_y
-                    else:
-                        ys = np.concatenate((ys, batch_y), 0)
-                    if feature_ is None:
-                        feature_ = feature
-                    else:
-                        feature_ = np.concatenate((feature_, feature), 0)
-                    print("batch_%d  batch_loss=%.4f"%(batch_idx, _loss), end='\r')
-                print('\n')
-
-                train.reset_batch_counter()
-                for spkr in range(config.N_SPEAKER):
-                    if len(feature_[np.argmax(ys, 1) == spkr]):
-                        vector = np.mean(feature_[np.argmax(ys, 1) == spkr], axis=0)
-                        if spkr in vectors.keys():
-                            vector = (vectors[spkr] + vector) / 2
-                        else:
-                            vector = vector
-                        vectors[spkr] = vector
-                    else:
-                        if spkr not in vectors.keys():
-                            vectors[spkr] = np.zeros(400, dtype=np.float32)
-                    # print("vector part done....")
-                avg_loss /= total_batch
-                print('Train loss:%.4f' % (avg_loss))
-
-                val_payload_per_gpu = int(config.BATCH_SIZE // config.N_GPU)
-                if config.BATCH_SIZE % config.N_GPU:
-                    print("Warning: Batch size can't to be divisible of N_GPU")
-
-
-                total_batch = int(validation.num_examples / config.N_GPU) - 1
-                if total_batch < 1:
-                    print("your validation dataset's size is less than one batch.")
-                    exit(1)
-
-                preds = None
-                ys = None
-                feature = None
-                for batch_idx in range(total_batch):
-
-                    batch_x, batch_y = validation.next_batch
-                    batch_x = batch_x.reshape(-1, 50, 40, 1)
-                    inp_dict = feed_all_gpu({}, models, val_payload_per_gpu, batch_x, batch_y)
-                    batch_pred, batch_y, batch_feature = sess.run([all_pred, all_y, get_feature], inp_dict)
-                    if preds is None:
-                        preds = batch_pred
-                    else:
-                        preds = np.concatenate((preds, batch_pred), 0)
-                    if feature is None:
-                        feature = batch_feature
-                    else:
-                        feature = np.concatenate((feature, batch_feature), 0)
-                    if ys is None:
-                        ys = batch_y
-                    else:
-                        ys = np.concatenate((ys, batch_y), 0)
-
-                vec_preds = []
-                validation.reset_batch_counter()
-                for sample in range(feature.shape[0]):
-                    score = -100
-                    pred = -1
-                    for spkr in vectors.keys():
-                        if cosine(vectors[spkr], feature[sample]) > score:
-                            score = cosine(vectors[spkr], feature[sample])
-                            pred = int(spkr)
-                    vec_preds.append(pred)
-                correct_pred = np.equal(np.argmax(ys, 1), vec_preds)
-                val_accuracy = np.mean(np.array(correct_pred, dtype='float'))
-                print('Val Accuracy: %0.4f%%' % (100.0 * val_accuracy))
-                saver.save(sess=sess, save_path=os.path.join(model._save_path, model._name+ ".ckpt"))
-                stop_time = time.time()
-                elapsed_time = stop_time - start_time
-                print('Cost time: ' + str(elapsed_time) + ' sec.')
-            print('training done.')
-
-
-def run(config, train, validation):
-    """Train MFM model.
-    
+        preds, _ = best_match(features, self._vectors)
+        return np.mean(preds == np.argmax(test_labels, axis=1))
+
+
+class MaxFeatureMapDnnEmbedder(Embedder):
+    """Keep a restored ``MaxFeatureMapDnn`` model to extract features repeatedly.
+
+    ``embed_utterance`` averages the features of 50 frames windows with a hop of 25 frames.
+    """
+    model_class = MaxFeatureMapDnn
+    frame_shape = (50, 40, 1)
+    hop = 25
+
+
+def run(config, train, validation, hooks=None):
+    """Train MFM model, see ``pyasv.engine.Trainer``.
+
     Parameters
     ----------
     config : ``config``
@@ -522,112 +243,35 @@ def run(config, train, validation):
         train dataset.
     validation
         validation dataset.
+    hooks : ``list``
+        ``pyasv.engine.Hook`` objects called during training.
+    """
+    Trainer(MaxFeatureMapDnn, config, hooks).run(train, validation)
+
+
+def restore(config, enroll, test, output='text', k=5):
+    """Enroll speakers with the trained MaxFeatureMapDnn model and score the test set.
+
+    Parameters
+    ----------
+    config : ``config``
+        the config of model.
+    enroll : ``DataManage``
+        enroll dataset.
+    test : ``DataManage``
+        test dataset.
+    output : ``str``
+        ``'text'`` writes ``result.txt``, ``'npy'`` writes the score matrix into ``scores.npy``
+        and ``'topk'`` only writes the ``k`` best speakers per vector, see ``ScoreWriter``.
+    k : ``int``
+        the number of speakers kept per vector with ``output='topk'``.
+
+    Returns
+    -------
+    summary : ``dict``
+        see ``ScoreWriter.summary``.
     """
-    if config.N_GPU == 0:
-        _no_gpu(config, train, validation)
-    else:
-        if os.path.exists('./tmp'):
-            os.rename('./tmp', './tmp-backup')
-        os.system('nvidia-smi -q -d Memory |grep -A4 GPU|grep Free > ./tmp')
-        memory_gpu = [int(x.split()[2]) for x in open('tmp', 'r').readlines()]
-        gpu_list = []
-        for gpu in range(config.N_GPU):
-            gpu_list.append(str(np.argmax(memory_gpu)))
-            memory_gpu[np.argmax(memory_gpu)] = -10000
-        s = ""
-        for i in range(config.N_GPU):
-            if i != 0:
-                s += ','
-            s += str(gpu_list[i])
-        os.environ['CUDA_VISIBLE_DEVICES'] = s
-        os.remove('./tmp')
-        _multi_gpu(config, train, validation)
-
-
-def restore(config, enroll, test):
-    with tf.Graph().as_default() as g:
-        assert type(enroll) == (DataManage or DataManage4BigData)
-        assert type(enroll) == (DataManage or DataManage4BigData)
-        with tf.Session() as sess:
-            x = tf.placeholder(tf.float32, [None, 50, 40, 1])
-            if config.N_GPU == 0:
-                model = MaxFeatureMapDnn(config, x)
-            else:
-                with tf.variable_scope('cpu_variables', reuse=tf.AUTO_REUSE):
-                    model = MaxFeatureMapDnn(config, x)
-            get_feature = model.feature
-            saver = tf.train.Saver()
-            saver.restore(sess, os.path.join(config.SAVE_PATH, config.MODEL_NAME + ".ckpt"))
-            print("restore model succeed.")
-            total_batch = int(enroll.num_examples / config.BATCH_SIZE)
-            ys = None
-            feature_ = None
-            print("enrolling...")
-            for batch in range(total_batch):
-                batch_x, batch_y = enroll.next_batch
-
-                if batch_x.shape[0] != enroll.batch_size:
-                    print("Abandon the last batch because it is not enough.")
-                    break
-
-                batch_feature = sess.run(get_feature, feed_dict={x: batch_x})
-                if feature_ is None:
-                    feature_ = batch_feature
-                else:
-                    feature_ = np.concatenate((feature_, batch_feature), 0)
-                if ys is None:
-                    ys = batch_y
-                else:
-                    ys = np.concatenate((ys, batch_y), 0)
-            enrolled_vector = {}
-            for i in range(enroll.spkr_num):
-                enrolled_vector[i] = np.mean(feature_[np.argmax(ys, axis=1) == i], 0)
-
-            print("testing...")
-            total_batch = int(test.num_examples / config.BATCH_SIZE)
-            for batch in range(total_batch):
-                batch_x, batch_y = test.next_batch
-
-                if batch_x.shape[0] != test.batch_size:
-                    print("Abandon the last batch because it is not enough.")
-                    break
-
-                batch_feature = sess.run(get_feature, feed_dict={x: batch_x})
-                if feature_ is None:
-                    feature_ = batch_feature
-                else:
-                    feature_ = np.concatenate((feature_, batch_feature), 0)
-                if ys is None:
-                    ys = batch_y
-                else:
-                    ys = np.concatenate((ys, batch_y), 0)
-            support = 0
-            all_ = 0
-            print("writing the result in %s"%config.SAVE_PATH + "/result.txt")
-            result = []
-            with open(os.path.join(config.SAVE_PATH, 'result.txt'), 'w') as f:
-                vec_id = 0
-                for vec in feature_:
-                    score = -1
-                    pred = None
-                    scores = []
-                    for key in enrolled_vector.keys():
-                        tmp_score = cosine(vec, enrolled_vector[key])
-                        scores.append(tmp_score)
-                        if tmp_score > score:
-                            score = tmp_score
-                            pred = key
-                            if pred == np.argmax(ys, axis=1)[vec_id]:
-                                support += 1
-                            all_ += 1
-                    string = "No.%d vector, pred:" % vec_id + str(pred) + " "
-                    string += str(pred==np.argmax(ys, axis=1)[vec_id])+ " Score list:" + str(scores) + '\n'
-                    result.append(string)
-                    vec_id += 1
-                f.writelines("Acc:%.4f  Num_of_true:%d\n"%(support/all_, support))
-                for line in result:
-                    f.writelines(line)
-            print("done.")
+    return Trainer(MaxFeatureMapDnn, config).restore(enroll, test, output, k)
 
 
 def _main():
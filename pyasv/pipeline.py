@@ -0,0 +1,332 @@
+"""
+make_dataset
+------------
+
+.. autofunction:: pyasv.pipeline.make_dataset
+
+input_tensors
+-------------
+
+.. autofunction:: pyasv.pipeline.input_tensors
+
+export_tfrecords
+----------------
+
+.. autofunction:: pyasv.pipeline.export_tfrecords
+
+.. autofunction:: pyasv.pipeline.manager_samples
+
+TFRecordData
+------------
+
+.. autoclass:: pyasv.pipeline.TFRecordData
+    :members:
+
+    .. automethod:: __init__
+
+.. note::
+    Set ``use_tf_data=True`` in config to train a model with this pipeline,
+    the training loop then feeds nothing and only runs the train op.
+"""
+import numpy as np
+import tensorflow as tf
+import json
+import os
+
+
+INDEX_NAME = 'index.json'
+LENGTHS_NAME = 'lengths.npy'
+
+
+def make_dataset(data, frame_shape, n_speaker, batch_size, shuffle_buffer=0,
+                 num_parallel_calls=4, prefetch=2, map_fn=None):
+    """Expose a data manager as a ``tf.data.Dataset``.
+
+    The batches of the manager are read by ``num_parallel_calls`` parallel
+    ``batch_at`` calls in random order, split to examples, optionally mapped,
+    shuffled, batched and prefetched.
+
+    Parameters
+    ----------
+    data : ``DataManage`` or ``DataManage4BigData``
+        the dataset.
+    frame_shape : ``list``
+        the shape of an example, e.g. ``[9, 40, 1]``.
+    n_speaker : ``int``
+        the width of the one-hot labels.
+    batch_size : ``int``
+        the batch size of the dataset.
+    shuffle_buffer : ``int``
+        the size of the example shuffle buffer, no shuffle if 0.
+    num_parallel_calls : ``int``
+        the number of batches read (and examples mapped) in parallel.
+    prefetch : ``int``
+        the number of batches prepared ahead of the training step.
+    map_fn : ``callable``
+        a function of ``(frame, label)`` tensors applied to every example.
+
+    Returns
+    -------
+    dataset : ``tf.data.Dataset``
+        yields ``float32`` frames of shape ``[None] + frame_shape`` and one-hot
+        ``float32`` labels of shape ``[None, n_speaker]``.
+    """
+    frame_shape = list(frame_shape)
+
+    def _load(index):
+        frames, labels = data.batch_at(int(index))
+        frames = np.asarray(frames, dtype=np.float32).reshape([-1] + frame_shape)
+        return frames, one_hot(labels, n_speaker)
+
+    def _read(index):
+        frames, labels = tf.py_func(_load, [index], [tf.float32, tf.float32], stateful=False)
+        frames.set_shape([None] + frame_shape)
+        labels.set_shape([None, n_speaker])
+        return frames, labels
+
+    dataset = tf.data.Dataset.range(data.num_batches)
+    if shuffle_buffer:
+        dataset = dataset.shuffle(data.num_batches)
+    dataset = dataset.map(_read, num_parallel_calls=num_parallel_calls)
+    dataset = dataset.flat_map(lambda frames, labels: tf.data.Dataset.from_tensor_slices((frames, labels)))
+    if map_fn is not None:
+        dataset = dataset.map(map_fn, num_parallel_calls=num_parallel_calls)
+    if shuffle_buffer:
+        dataset = dataset.shuffle(shuffle_buffer)
+    dataset = dataset.batch(batch_size)
+    return dataset.prefetch(prefetch)
+
+
+def input_tensors(config, train, validation, frame_shape, shuffle_buffer=None):
+    """Build the input tensors of a model from a train and a validation dataset.
+
+    Parameters
+    ----------
+    config : ``config``
+        the config of model, we use its 'batch_size' and 'n_speaker' members.
+    train : ``DataManage``, ``DataManage4BigData`` or ``TFRecordData``
+        train dataset.
+    validation : ``DataManage``, ``DataManage4BigData`` or ``TFRecordData``
+        validation dataset.
+    frame_shape : ``list``
+        the shape of an example, e.g. ``[9, 40, 1]``.
+    shuffle_buffer : ``int``
+        the size of the shuffle buffer of train dataset,
+        default is 10 batches.
+
+    Returns
+    -------
+    x : ``tf.tensor``
+        the frames of a batch.
+    y : ``tf.tensor``
+        the one-hot labels of a batch.
+    train_init : ``tf.operation``
+        run it to start an epoch of train dataset.
+    validation_init : ``tf.operation``
+        run it to start an epoch of validation dataset.
+    """
+    if shuffle_buffer is None:
+        shuffle_buffer = 10 * config.BATCH_SIZE
+    train_set = _as_dataset(train, frame_shape, config.N_SPEAKER, config.BATCH_SIZE, shuffle_buffer)
+    validation_set = _as_dataset(validation, frame_shape, config.N_SPEAKER, config.BATCH_SIZE, 0)
+    iterator = tf.data.Iterator.from_structure(train_set.output_types, train_set.output_shapes)
+    x, y = iterator.get_next()
+    return x, y, iterator.make_initializer(train_set), iterator.make_initializer(validation_set)
+
+
+def one_hot(labels, n_speaker):
+    """Convert speaker ids or one-hot labels to ``float32`` one-hot labels."""
+    labels = np.asarray(labels)
+    if labels.ndim > 1 and labels.shape[-1] == n_speaker:
+        return labels.astype(np.float32)
+    return np.eye(n_speaker, dtype=np.float32)[labels.reshape(-1).astype(np.int64)]
+
+
+def _as_dataset(data, frame_shape, n_speaker, batch_size, shuffle_buffer):
+    if isinstance(data, TFRecordData):
+        return data.dataset(n_speaker, batch_size, shuffle_buffer=shuffle_buffer)
+    return make_dataset(data, frame_shape, n_speaker, batch_size, shuffle_buffer=shuffle_buffer)
+
+
+def export_tfrecords(samples, url, examples_per_shard=1000, prefix='data'):
+    """Write feature matrices and integer labels to sharded TFRecord files.
+
+    Besides the shards, ``url`` contains an ``index.json`` with the number of
+    examples, speakers and frames, the feature dimension and the shards, and a
+    ``lengths.npy`` with the number of frames of every example.
+
+    Parameters
+    ----------
+    samples : ``iterable``
+        ``(feature, label)`` pairs, ``feature`` is a ``[frames, dim]`` matrix,
+        e.g. from ``speech_processing.iter_utterance_features`` or ``manager_samples``.
+    url : ``str``
+        the directory of the records.
+    examples_per_shard : ``int``
+        the number of examples in a shard.
+    prefix : ``str``
+        the prefix of the shard names.
+
+    Returns
+    -------
+    index : ``dict``
+        the content of ``index.json``.
+    """
+    if not os.path.exists(url):
+        os.makedirs(url)
+    index = {'num_examples': 0, 'spkr_num': 0, 'speaker_counts': [], 'dim': None,
+             'num_frames': 0, 'shards': []}
+    speaker_counts = {}
+    lengths = []
+    writer = None
+    for feature, label in samples:
+        feature = np.asarray(feature, dtype=np.float32)
+        feature = feature.reshape(feature.shape[0], -1)
+        if index['dim'] is None:
+            index['dim'] = feature.shape[1]
+        elif feature.shape[1] != index['dim']:
+            raise ValueError("All features must have dim %d, got %d." % (index['dim'], feature.shape[1]))
+        label = int(label)
+        if writer is None or index['shards'][-1]['length'] >= examples_per_shard:
+            if writer is not None:
+                writer.close()
+            name = "%s-%05d.tfrecord" % (prefix, len(index['shards']))
+            writer = tf.python_io.TFRecordWriter(os.path.join(url, name))
+            index['shards'].append({'name': name, 'length': 0})
+        example = tf.train.Example(features=tf.train.Features(feature={
+            'feature': tf.train.Feature(bytes_list=tf.train.BytesList(value=[feature.tobytes()])),
+            'frames': tf.train.Feature(int64_list=tf.train.Int64List(value=[feature.shape[0]])),
+            'label': tf.train.Feature(int64_list=tf.train.Int64List(value=[label]))}))
+        writer.write(example.SerializeToString())
+        index['shards'][-1]['length'] += 1
+        index['num_examples'] += 1
+        index['num_frames'] += feature.shape[0]
+        speaker_counts[label] = speaker_counts.get(label, 0) + 1
+        lengths.append(feature.shape[0])
+    if writer is not None:
+        writer.close()
+    n_speaker = max(speaker_counts) + 1 if speaker_counts else 0
+    index['spkr_num'] = n_speaker
+    index['speaker_counts'] = [speaker_counts.get(i, 0) for i in range(n_speaker)]
+    np.save(os.path.join(url, LENGTHS_NAME), np.array(lengths, dtype=np.int32))
+    with open(os.path.join(url, INDEX_NAME), 'w') as f:
+        json.dump(index, f)
+    return index
+
+
+def manager_samples(data):
+    """Yield the ``(feature, label)`` pairs of a ``DataManage`` or ``DataManage4BigData``.
+
+    Every example becomes a ``[frames, dim]`` matrix (e.g. a 9x40 window) and an
+    integer label, so the records can be written by ``export_tfrecords``.
+    """
+    for index in range(data.num_batches):
+        frames, labels = data.batch_at(index)
+        labels = np.asarray(labels)
+        if labels.ndim > 1 and labels.shape[-1] > 1:
+            labels = np.argmax(labels, -1)
+        labels = labels.reshape(-1)
+        for frame, label in zip(frames, labels):
+            frame = np.asarray(frame)
+            yield frame.reshape(frame.shape[0], -1), label
+
+
+class TFRecordData(object):
+    """
+    Use ``TFRecordData`` to train a model on records written by ``export_tfrecords``.
+    Model inputs are cut from the stored matrices on the fly, e.g. every 9x40
+    window of an utterance for CTDnn or 100x64 segments for DeepSpeaker.
+
+    It has no ``next_batch`` or ``batch_at``, so it can only be read by the
+    ``tf.data`` pipeline: set ``use_tf_data=True`` in config.
+    """
+    def __init__(self, url, frame_shape, step=1, num_parallel_reads=4):
+        """
+        Parameters
+        ----------
+        url : ``str``
+            the directory of the records.
+        frame_shape : ``list``
+            the shape of an example, e.g. ``[9, 40, 1]``, its first element is the
+            window length and its second the feature dim.
+        step : ``int``
+            the number of frames between two windows.
+        num_parallel_reads : ``int``
+            the number of shards read in parallel.
+        """
+        with open(os.path.join(url, INDEX_NAME), 'r') as f:
+            self.index = json.load(f)
+        self.url = url
+        self.frame_shape = list(frame_shape)
+        self.window = self.frame_shape[0]
+        if self.index['dim'] is not None and np.prod(self.frame_shape[1:]) != self.index['dim']:
+            raise ValueError("frame_shape %s does not match the feature dim %d."
+                             % (str(frame_shape), self.index['dim']))
+        self.step = step
+        self.num_parallel_reads = num_parallel_reads
+        self.spkr_num = self.index['spkr_num']
+        lengths = np.load(os.path.join(url, LENGTHS_NAME)).astype(np.int64)
+        self.num_examples = int(np.sum(np.maximum(0, (lengths - self.window) // step + 1)))
+
+    def reset_batch_counter(self):
+        pass
+
+    @property
+    def files(self):
+        """The paths of the shards."""
+        return [os.path.join(self.url, shard['name']) for shard in self.index['shards']]
+
+    def dataset(self, n_speaker, batch_size, shuffle_buffer=0, num_parallel_calls=4, prefetch=2):
+        """Build a ``tf.data.Dataset`` of model inputs.
+
+        Parameters
+        ----------
+        n_speaker : ``int``
+            the width of the one-hot labels.
+        batch_size : ``int``
+            the batch size of the dataset.
+        shuffle_buffer : ``int``
+            the size of the example shuffle buffer, no shuffle if 0.
+            The order of the shards is shuffled at every epoch as well.
+        num_parallel_calls : ``int``
+            the number of records parsed in parallel.
+        prefetch : ``int``
+            the number of batches prepared ahead of the training step.
+
+        Returns
+        -------
+        dataset : ``tf.data.Dataset``
+            yields ``float32`` frames of shape ``[None] + frame_shape`` and one-hot
+            ``float32`` labels of shape ``[None, n_speaker]``.
+        """
+        files = self.files
+        dim = self.index['dim']
+        window = self.window
+        step = self.step
+        frame_shape = self.frame_shape
+
+        def _parse(record):
+            parsed = tf.parse_single_example(record, features={
+                'feature': tf.FixedLenFeature([], tf.string),
+                'frames': tf.FixedLenFeature([], tf.int64),
+                'label': tf.FixedLenFeature([], tf.int64)})
+            feature = tf.reshape(tf.decode_raw(parsed['feature'], tf.float32), [-1, dim])
+            windows = tf.contrib.signal.frame(feature, window, step, axis=0)
+            windows = tf.reshape(windows, [-1] + frame_shape)
+            labels = tf.fill([tf.shape(windows)[0]], parsed['label'])
+            return windows, tf.one_hot(labels, n_speaker, dtype=tf.float32)
+
+        if shuffle_buffer:
+            # the shard order is drawn again at every epoch.
+            dataset = tf.data.Dataset.from_tensor_slices(files)
+            dataset = dataset.shuffle(len(files), reshuffle_each_iteration=True)
+            dataset = dataset.interleave(tf.data.TFRecordDataset, cycle_length=self.num_parallel_reads,
+                                         num_parallel_calls=self.num_parallel_reads)
+        else:
+            dataset = tf.data.TFRecordDataset(files, num_parallel_reads=self.num_parallel_reads)
+        dataset = dataset.map(_parse, num_parallel_calls=num_parallel_calls)
+        dataset = dataset.flat_map(lambda frames, labels: tf.data.Dataset.from_tensor_slices((frames, labels)))
+        if shuffle_buffer:
+            dataset = dataset.shuffle(shuffle_buffer)
+        dataset = dataset.batch(batch_size)
+        return dataset.prefetch(prefetch)
@@ -19,6 +19,11 @@ ext_fbank_feature
 
     xxxxx/your_data_path/2_1.wav 1
 
+iter_utterance_features
+-----------------------
+
+.. autofunction:: pyasv.speech_processing.iter_utterance_features
+
 calc_fbank
 ----------
 
@@ -169,6 +174,40 @@ def ext_fbank_feature(url_path, config):
         return fbanks, labels
 
 
+def iter_utterance_features(url_path, feature='fbank'):
+    """Yield the feature matrix and label of every audio in a dataset.
+
+    Unlike ``ext_fbank_feature`` and ``ext_mfcc_feature``, the features are not
+    windowed and only one utterance is in memory at a time, e.g. to write them by
+    ``pyasv.pipeline.export_tfrecords``.
+
+    Parameters
+    ----------
+    url_path : ``str``
+        The path of the 'PATH' file.
+    feature : ``str``
+        'fbank' or 'mfcc'.
+
+    Returns
+    -------
+    features : ``generator``
+        yields ``(feature, label)``, ``feature`` is a ``[frames, dim]`` matrix.
+    """
+    with open(url_path, 'r') as urls:
+        for url in urls:
+            url, label = str(url).split(" ")
+            index = int(str(label).split("\n")[0])
+            if feature == 'fbank':
+                matrix = calc_fbank(url)
+            else:
+                y, sr = librosa.load(url)
+                mfcc_ = librosa.feature.mfcc(y, sr, n_mfcc=13)
+                mfcc_delta = librosa.feature.delta(mfcc_, width=3)
+                mfcc_delta_delta = librosa.feature.delta(mfcc_delta, width=3)
+                matrix = cmvn(np.vstack([mfcc_, mfcc_delta, mfcc_delta_delta]).T)
+            yield matrix, index
+
+
 def calc_fbank(url):
     """Calculate Fbank feature of a audio file.
 
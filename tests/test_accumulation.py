@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+tf = pytest.importorskip("tensorflow")
+from pyasv.accumulation import micro_batches, GradientAccumulator, EmbeddingCacheAccumulator
+from pyasv.loss.triplet_loss import batch_hard_triplet_loss
+
+
+@pytest.mark.parametrize('n, micro_batch_size', [(10, 3), (9, 3), (2, 5), (1, 1)])
+def test_micro_batches_cover_the_batch(n, micro_batch_size):
+    parts = micro_batches(n, micro_batch_size)
+    assert all(0 < part.stop - part.start <= micro_batch_size for part in parts)
+    assert np.concatenate([np.arange(n)[part] for part in parts]).tolist() == list(range(n))
+
+
+def _softmax_loss(feature, labels):
+    return tf.reduce_mean(tf.nn.sparse_softmax_cross_entropy_with_logits(labels=labels, logits=feature))
+
+
+def _triplet_loss(feature, labels):
+    return batch_hard_triplet_loss(labels, feature, margin=0.5)
+
+
+def _l2_normalize_rows(feature):
+    # the output of DeepSpeaker.
+    return tf.nn.l2_normalize(feature, axis=1)
+
+
+def _l2_normalize_batch(feature):
+    return tf.nn.l2_normalize(feature)
+
+
+def _train_step(loss_fn, accumulator_class, micro_batch_size, output_fn=None):
+    """Train a linear model one step from fixed weights and return the new weights.
+
+    Without ``accumulator_class`` the whole batch is fed to ``opt.minimize``.
+    ``output_fn`` is applied to the output of the model if given.
+    """
+    rng = np.random.RandomState(0)
+    batch_x = rng.randn(12, 5).astype(np.float32)
+    batch_y = np.arange(12) % 3
+    with tf.Graph().as_default():
+        x = tf.placeholder(tf.float32, [None, 5])
+        y = tf.placeholder(tf.int32, [None])
+        weights = tf.Variable(np.random.RandomState(1).randn(5, 4).astype(np.float32))
+        feature = tf.matmul(x, weights)
+        if output_fn is not None:
+            feature = output_fn(feature)
+        opt = tf.train.GradientDescentOptimizer(0.1)
+        if accumulator_class is None:
+            train_op = opt.minimize(loss_fn(feature, y))
+        elif accumulator_class is GradientAccumulator:
+            accumulator = GradientAccumulator(opt, loss_fn(feature, y), feature)
+        else:
+            accumulator = EmbeddingCacheAccumulator(opt, x, y, feature, loss_fn)
+        with tf.Session() as sess:
+            sess.run([tf.global_variables_initializer(), tf.local_variables_initializer()])
+            if accumulator_class is None:
+                sess.run(train_op, {x: batch_x, y: batch_y})
+            else:
+                loss, features = accumulator.run(sess, {x: batch_x, y: batch_y}, micro_batch_size)
+                assert features.shape == (12, 4)
+            return sess.run(weights)
+
+
+@pytest.mark.parametrize('loss_fn, accumulator_class', [(_softmax_loss, GradientAccumulator),
+                                                        (_triplet_loss, EmbeddingCacheAccumulator)])
+@pytest.mark.parametrize('micro_batch_size', [5, 12])
+def test_accumulation_matches_the_whole_batch(loss_fn, accumulator_class, micro_batch_size):
+    expected = _train_step(loss_fn, None, None)
+    np.testing.assert_allclose(_train_step(loss_fn, accumulator_class, micro_batch_size), expected,
+                               rtol=1e-4, atol=1e-5)
+
+
+@pytest.mark.parametrize('micro_batch_size', [5, 12])
+def test_embedding_cache_matches_the_whole_batch_with_normalized_rows(micro_batch_size):
+    expected = _train_step(_triplet_loss, None, None, _l2_normalize_rows)
+    np.testing.assert_allclose(_train_step(_triplet_loss, EmbeddingCacheAccumulator, micro_batch_size,
+                                           _l2_normalize_rows), expected, rtol=1e-4, atol=1e-5)
+
+
+def test_embedding_cache_needs_independent_rows():
+    # a feature normalized over the whole batch depends on the other examples of the micro-batch.
+    expected = _train_step(_triplet_loss, None, None, _l2_normalize_batch)
+    assert not np.allclose(_train_step(_triplet_loss, EmbeddingCacheAccumulator, 5, _l2_normalize_batch),
+                           expected, rtol=1e-4, atol=1e-5)
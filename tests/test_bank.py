@@ -0,0 +1,42 @@
+import numpy as np
+
+from pyasv.backend.bank import EmbeddingBank
+
+
+def test_refresh_averages_with_the_old_rows():
+    bank = EmbeddingBank(3, 2, refresh_steps=2, momentum=0.5)
+    assert not bank.observe(np.array([[2.0, 0.0]]), np.array([0]))
+    assert bank.observe(np.array([[0.0, 3.0]]), np.array([1]))
+    assert bank.num_refreshes == 1
+    np.testing.assert_allclose(bank.table, [[1, 0], [0, 1], [0, 0]])
+    assert bank.table.dtype == np.float16
+    assert (bank.valid == [True, True, False]).all()
+    # the new mean of speaker 0 is averaged with its row, speaker 1 is kept.
+    bank.observe(np.array([[0.0, 1.0]]), np.array([0]))
+    bank.refresh()
+    np.testing.assert_allclose(bank.table, [[np.sqrt(0.5), np.sqrt(0.5)], [0, 1], [0, 0]], atol=1e-3)
+
+
+def test_refresh_starts_from_the_new_batches():
+    bank = EmbeddingBank(2, 2, refresh_steps=1, momentum=0)
+    bank.observe(np.array([[1.0, 0.0]]), np.array([0]))
+    bank.observe(np.array([[0.0, 1.0]]), np.array([0]))
+    np.testing.assert_allclose(bank.table, [[0, 1], [0, 0]])
+    # the bank does not fold its batches into epoch centroids.
+    assert (bank._accumulator.centroids == 0).all()
+
+
+def test_neighbours():
+    bank = EmbeddingBank(5, 2, momentum=0)
+    vectors = np.array([[1.0, 0.0], [0.9, 0.1], [0.0, 1.0], [0.6, 0.4]])
+    bank.observe(vectors, np.arange(4))
+    bank.refresh()
+    ids, scores = bank.neighbours([0, 2, 4], 3)
+    assert ids.shape == scores.shape == (3, 3)
+    # the speaker itself and speaker 4, which has no row, are never neighbours.
+    assert ids[0].tolist() == [1, 3, 2]
+    assert ids[1].tolist() == [3, 1, 0]
+    assert (scores[:2] <= 1 + 1e-3).all() and (np.diff(scores[:2], axis=1) <= 0).all()
+    assert np.isneginf(scores[2]).all()
+    ids, scores = bank.neighbours([0], 10)
+    assert ids.shape == (1, 4) and np.isneginf(scores[0, -1])
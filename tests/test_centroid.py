@@ -0,0 +1,54 @@
+import numpy as np
+
+from pyasv.backend.centroid import CentroidAccumulator
+
+
+def _batches(n_batches=5, batch_size=16, n_speaker=6, dim=4, seed=0):
+    rng = np.random.RandomState(seed)
+    return [(rng.randn(batch_size, dim), rng.randint(0, n_speaker, batch_size)) for _ in range(n_batches)]
+
+
+def _means(batches, n_speaker, dim):
+    features = np.concatenate([f for f, _ in batches])
+    ids = np.concatenate([l for _, l in batches])
+    means = np.zeros((n_speaker, dim))
+    for spkr in np.unique(ids):
+        means[spkr] = features[ids == spkr].mean(0)
+    return means, np.bincount(ids, minlength=n_speaker)
+
+
+def test_update_matches_the_means_of_all_batches():
+    batches = _batches()
+    accumulator = CentroidAccumulator(6, 4)
+    for features, labels in batches:
+        accumulator.update(features, labels)
+    # an empty batch and one-hot labels.
+    accumulator.update(np.zeros((0, 4)), np.zeros(0))
+    extra = _batches(1, seed=1)
+    accumulator.update(extra[0][0], np.eye(6)[extra[0][1]])
+    means, counts = _means(batches + extra, 6, 4)
+    assert (accumulator.counts == counts).all()
+    np.testing.assert_allclose(accumulator.epoch_means(), means, rtol=1e-5, atol=1e-6)
+
+
+def test_end_epoch_averages_with_the_previous_epochs():
+    accumulator = CentroidAccumulator(3, 2)
+    accumulator.update(np.array([[1.0, 0.0], [3.0, 0.0]]), np.array([0, 0]))
+    np.testing.assert_allclose(accumulator.end_epoch(), [[2, 0], [0, 0], [0, 0]])
+    assert (accumulator.counts == 0).all()
+    accumulator.update(np.array([[0.0, 4.0], [0.0, 2.0]]), np.array([0, 1]))
+    # speaker 0 is averaged with its previous vector, speaker 1 is new and speaker 2 never seen.
+    np.testing.assert_allclose(accumulator.end_epoch(), [[1, 2], [0, 2], [0, 0]])
+    np.testing.assert_allclose(accumulator.centroids, [[1, 2], [0, 2], [0, 0]])
+
+
+def test_merge_equals_updating_with_all_batches():
+    batches = _batches()
+    whole = CentroidAccumulator(6, 4)
+    parts = [CentroidAccumulator(6, 4) for _ in range(2)]
+    for i, (features, labels) in enumerate(batches):
+        whole.update(features, labels)
+        parts[i % 2].update(features, labels)
+    parts[0].merge(parts[1].sums, parts[1].counts)
+    assert (parts[0].counts == whole.counts).all()
+    np.testing.assert_allclose(parts[0].end_epoch(), whole.end_epoch(), rtol=1e-6)
@@ -0,0 +1,104 @@
+import os
+import numpy as np
+import pytest
+
+from pyasv.config import Config
+from pyasv.data_manage import DataManage, DataManage4BigData
+from pyasv.data_loader import MultiProcessLoader
+
+
+def _config(tmp_path, batch_size=8, n_speaker=5):
+    return Config(name='test', n_speaker=n_speaker, batch_size=batch_size, save_path=str(tmp_path))
+
+
+def _data(tmp_path, n=100, batch_size=8):
+    ids = np.arange(n)
+    return DataManage(np.repeat(ids[:, None], 3, axis=1), ids % 5, _config(tmp_path, batch_size))
+
+
+def _epoch(loader):
+    batches = []
+    for _ in range(loader.num_batches):
+        frames, labels = loader.next_batch
+        batches.append(frames[:, 0].astype(np.int64).copy())
+    assert len(loader.next_batch[0]) == 0
+    return batches
+
+
+def _expected(data):
+    return sorted(tuple(data.batch_at(i)[0][:, 0].astype(np.int64)) for i in range(data.num_batches))
+
+
+def test_loader_returns_every_batch_of_each_epoch(tmp_path):
+    data = _data(tmp_path)
+    with MultiProcessLoader(data, n_workers=2, seed=3) as loader:
+        assert loader.num_batches == 13
+        orders = []
+        for _ in range(3):
+            batches = _epoch(loader)
+            assert sorted(tuple(batch) for batch in batches) == _expected(data)
+            orders.append([batch[0] for batch in batches])
+            loader.reset_batch_counter()
+        assert orders[0] != orders[1]
+
+
+def test_loader_follows_the_epoch_partition(tmp_path):
+    data = _data(tmp_path)
+    data.set_partition(1, 2, seed=4)
+    with MultiProcessLoader(data, n_workers=3, shuffle=False) as loader:
+        for _ in range(3):
+            # the part of the worker changes every epoch, the workers must follow it.
+            assert [tuple(batch) for batch in _epoch(loader)] == \
+                [tuple(data.batch_at(i)[0][:, 0].astype(np.int64)) for i in range(data.num_batches)]
+            loader.reset_batch_counter()
+
+
+def test_loader_set_partition(tmp_path):
+    data = _data(tmp_path)
+    with MultiProcessLoader(data, n_workers=2, shuffle=False) as loader:
+        loader.next_batch
+        # the workers were forked before the partition was set.
+        loader.set_partition(0, 3, seed=2)
+        assert loader.num_batches == data.num_batches == 5
+        for _ in range(2):
+            assert [tuple(batch) for batch in _epoch(loader)] == \
+                [tuple(data.batch_at(i)[0][:, 0].astype(np.int64)) for i in range(data.num_batches)]
+            loader.reset_batch_counter()
+
+
+def test_loader_skips_the_rest_of_an_epoch(tmp_path):
+    data = _data(tmp_path)
+    with MultiProcessLoader(data, n_workers=2, n_slots=2, shuffle=False) as loader:
+        loader.next_batch
+        loader.reset_batch_counter()
+        assert [tuple(batch) for batch in _epoch(loader)] == \
+            [tuple(data.batch_at(i)[0][:, 0].astype(np.int64)) for i in range(data.num_batches)]
+
+
+def test_loader_slots_hold_shards_larger_than_a_batch(tmp_path):
+    data = DataManage4BigData(_config(tmp_path, batch_size=32), 'train')
+    ids = np.arange(70)
+    data.write_file(np.repeat(ids[:, None], 3, axis=1), ids % 5)
+    data.batch_size = 16
+    with MultiProcessLoader(data, n_workers=2) as loader:
+        assert sorted(np.concatenate(_epoch(loader)).tolist()) == list(range(70))
+
+
+def test_loader_rejects_a_shuffle_buffer(tmp_path):
+    data = DataManage4BigData(_config(tmp_path), 'train', shuffle_buffer_size=10)
+    with pytest.raises(ValueError):
+        MultiProcessLoader(data)
+
+
+def test_loader_reports_worker_errors(tmp_path):
+    parent = os.getpid()
+
+    def transform(frames, labels, rng):
+        # the batch probed by the constructor passes, the batches of the workers fail.
+        if os.getpid() != parent:
+            raise IOError("broken example")
+        return frames, labels
+
+    with MultiProcessLoader(_data(tmp_path), n_workers=1, transform=transform) as loader:
+        with pytest.raises(RuntimeError, match="broken example"):
+            loader.next_batch
@@ -0,0 +1,394 @@
+import io
+import os
+import json
+import numpy as np
+import pytest
+
+from pyasv.config import Config
+from pyasv.data_manage import DataManage, DataManage4BigData, SpeakerBalancedSampler, HardNegativeSampler, \
+    UtteranceStore, SegmentSampler, BucketBatcher, padding_report, partition_indices, encode_frames, decode_frames
+
+CODECS = ['none', 'npz', 'zlib', 'lzma']
+
+
+def _config(tmp_path, batch_size=32, n_speaker=10):
+    return Config(name='test', n_speaker=n_speaker, batch_size=batch_size, save_path=str(tmp_path))
+
+
+def _examples(n, start=0, n_speaker=10):
+    """Frames whose value is the id of the example, and speaker ids."""
+    ids = np.arange(start, start + n)
+    return np.repeat(ids[:, None], 3, axis=1).astype(np.float32), ids % n_speaker
+
+
+def _write(data, n, start=0, append=False):
+    frames, labels = _examples(n, start)
+    with data.open_writer(n_workers=2, append=append) as writer:
+        writer.write(frames, labels)
+
+
+def _read_epoch(data):
+    batches = []
+    for _ in range(data.num_batches):
+        frames, labels = data.next_batch
+        assert len(frames) > 0
+        batches.append(frames[:, 0].astype(np.int64))
+    assert len(data.next_batch[0]) == 0
+    return batches
+
+
+def test_shuffle_buffer_batches_with_uneven_shards(tmp_path):
+    data = DataManage4BigData(_config(tmp_path), 'train', shuffle_buffer_size=100, n_open_shards=3, seed=0)
+    # 31 full shards and one of 8, then one of 32 and one of 18.
+    _write(data, 1000)
+    _write(data, 50, start=1000, append=True)
+    assert len(data.shard_names) == 34
+    assert data.num_batches == 33
+    for _ in range(2):
+        batches = _read_epoch(data)
+        assert [len(batch) for batch in batches] == [32] * 32 + [26]
+        assert sorted(np.concatenate(batches).tolist()) == list(range(1050))
+        data.reset_batch_counter()
+
+
+@pytest.mark.parametrize('n, world_size', [(10, 1), (10, 3), (100, 4), (7, 7)])
+def test_partition_indices_disjoint(n, world_size):
+    for epoch in range(3):
+        parts = [partition_indices(n, rank, world_size, seed=1, epoch=epoch) for rank in range(world_size)]
+        assert all(len(part) == n // world_size for part in parts)
+        merged = np.concatenate(parts)
+        assert len(np.unique(merged)) == len(merged)
+        assert ((merged >= 0) & (merged < n)).all()
+
+
+def test_partition_indices_depends_on_epoch():
+    assert (partition_indices(100, 0, 2, seed=1) == partition_indices(100, 0, 2, seed=1)).all()
+    assert not (partition_indices(100, 0, 2, seed=1, epoch=0) == partition_indices(100, 0, 2, seed=1, epoch=1)).all()
+
+
+def _round_trip(frames, storage_dtype, codec):
+    buf = io.BytesIO()
+    np.savez(buf, **encode_frames(frames, storage_dtype, codec))
+    buf.seek(0)
+    with np.load(buf) as loaded:
+        decoded = decode_frames(loaded)
+    assert decoded.dtype == np.float32
+    assert decoded.shape == frames.shape
+    return decoded
+
+
+def _frames():
+    rng = np.random.RandomState(0)
+    # one constant dimension, its int8 scale is 1.
+    frames = rng.randn(20, 9, 40).astype(np.float32) * np.linspace(0.1, 10, 40).astype(np.float32)
+    frames[..., 0] = 3.0
+    return frames
+
+
+@pytest.mark.parametrize('codec', CODECS)
+def test_float32_codec_is_exact(codec):
+    frames = _frames()
+    assert (_round_trip(frames, 'float32', codec) == frames).all()
+
+
+@pytest.mark.parametrize('codec', CODECS)
+def test_float16_codec_relative_error(codec):
+    frames = _frames()
+    np.testing.assert_allclose(_round_trip(frames, 'float16', codec), frames, rtol=1e-3, atol=1e-6)
+
+
+@pytest.mark.parametrize('codec', CODECS)
+def test_int8_codec_error_within_half_a_step(codec):
+    frames = _frames()
+    scale = encode_frames(frames, 'int8', codec)['scale']
+    error = np.abs(_round_trip(frames, 'int8', codec) - frames).reshape(-1, frames.shape[-1]).max(0)
+    assert (error <= scale / 2 + 1e-5).all()
+    assert error[0] < 1e-6
+
+
+def _all_examples(data):
+    return sorted(np.concatenate([data.batch_at(i)[0][:, 0] for i in range(data.num_batches)]).astype(int).tolist())
+
+
+def test_write_file_replaces_the_dataset(tmp_path):
+    data = DataManage4BigData(_config(tmp_path), 'train')
+    frames, labels = _examples(200)
+    data.write_file(frames, labels)
+    frames, labels = _examples(40, start=1000)
+    data.write_file(frames, labels)
+    # the shards of the first dataset are removed.
+    assert data.shard_names == ['data_0.npz', 'data_1.npz']
+    assert data.num_examples == 40
+    assert _all_examples(data) == list(range(1000, 1040))
+    reopened = DataManage4BigData(_config(tmp_path), 'train')
+    assert reopened.num_examples == 40 and reopened.spkr_num == 10
+
+
+def test_writer_append_and_index_rebuild(tmp_path):
+    data = DataManage4BigData(_config(tmp_path), 'train')
+    _write(data, 70)
+    # a dataset written without an index, e.g. by an older version.
+    os.remove(os.path.join(data.url, 'index.json'))
+    data = DataManage4BigData(_config(tmp_path), 'train')
+    _write(data, 30, start=70, append=True)
+    assert data.shard_names == ['data_0.npz', 'data_1.npz', 'data_2.npz', 'data_3.npz']
+    assert data.num_examples == 100
+    with open(os.path.join(data.url, 'index.json')) as f:
+        index = json.load(f)
+    assert [shard['length'] for shard in index['shards']] == [32, 32, 6, 30]
+    assert index['speaker_counts'] == [10] * 10
+    assert _all_examples(data) == list(range(100))
+
+
+def test_writer_error_keeps_the_old_index(tmp_path):
+    data = DataManage4BigData(_config(tmp_path), 'train')
+    _write(data, 64)
+    with pytest.raises(RuntimeError):
+        with data.open_writer(append=True) as writer:
+            writer.write(*_examples(40, start=64))
+            raise RuntimeError("feature extraction failed")
+    reopened = DataManage4BigData(_config(tmp_path), 'train')
+    assert reopened.num_examples == 64
+    assert reopened.shard_names == ['data_0.npz', 'data_1.npz']
+
+
+def _check_pk_batch(frames, labels, n_speakers, n_utterances):
+    ids = np.argmax(labels, -1) if labels.ndim > 1 else labels.reshape(-1)
+    assert len(frames) == n_speakers * n_utterances
+    # the labels go with their frames.
+    assert (frames[:, 0].astype(np.int64) % 10 == ids).all()
+    # K adjacent utterances of P distinct speakers.
+    groups = ids.reshape(n_speakers, n_utterances)
+    assert (groups == groups[:, :1]).all()
+    assert len(np.unique(groups[:, 0])) == n_speakers
+    return groups[:, 0]
+
+
+def test_speaker_balanced_sampler_in_memory(tmp_path):
+    frames, labels = _examples(200)
+    sampler = SpeakerBalancedSampler(DataManage(frames, labels, _config(tmp_path)), _config(tmp_path),
+                                     n_speakers=4, n_utterances=3, seed=0)
+    assert sampler.batch_size == 12
+    for _ in range(2):
+        seeds = []
+        for _ in range(sampler.num_batches):
+            frames, labels = sampler.next_batch
+            seeds.append(_check_pk_batch(frames, labels, 4, 3))
+        assert len(sampler.next_batch[0]) == 0
+        # every speaker is drawn in an epoch.
+        assert set(np.concatenate(seeds)) == set(range(10))
+        sampler.reset_batch_counter()
+
+
+def test_speaker_balanced_sampler_loads_each_shard_once_per_epoch(tmp_path):
+    data = DataManage4BigData(_config(tmp_path, batch_size=10), 'train')
+    _write(data, 400)
+    loaded = []
+    load_shard = data._load_shard
+    data._load_shard = lambda name: loaded.append(name) or load_shard(name)
+    sampler = SpeakerBalancedSampler(data, _config(tmp_path), n_speakers=2, n_utterances=2, seed=0, cache_size=8)
+    # only the labels are read to index the shards.
+    assert loaded == []
+    for _ in range(sampler.num_batches):
+        _check_pk_batch(*sampler.next_batch, n_speakers=2, n_utterances=2)
+    assert sorted(loaded) == sorted(data.shard_names)
+
+
+def test_hard_negative_sampler_groups_close_speakers(tmp_path):
+    frames, labels = _examples(200)
+    sampler = HardNegativeSampler(DataManage(frames, labels, _config(tmp_path)), _config(tmp_path),
+                                  n_speakers=4, n_utterances=3, group_size=2, refresh_steps=1, seed=0)
+    # without a bank the seeds are grouped with random speakers.
+    _check_pk_batch(*sampler.next_batch, n_speakers=4, n_utterances=3)
+    # speakers 2i and 2i + 1 are close to each other.
+    vectors = np.repeat(np.eye(5), 2, axis=0) + 0.01 * np.random.RandomState(0).randn(10, 5)
+    sampler.observe(vectors, np.arange(10))
+    assert sampler.bank.dim == 5 and sampler.bank.valid.all()
+    sampler.reset_batch_counter()
+    for _ in range(sampler.num_batches):
+        speakers = _check_pk_batch(*sampler.next_batch, n_speakers=4, n_utterances=3)
+        assert speakers[0] // 2 == speakers[1] // 2
+
+
+def _epoch_examples(data):
+    return np.concatenate([data.batch_at(i)[0][:, 0] for i in range(data.num_batches)]).astype(np.int64)
+
+
+@pytest.mark.parametrize('world_size', [2, 3])
+def test_independent_managers_get_disjoint_partitions(tmp_path, world_size):
+    frames, labels = _examples(100)
+    # each worker builds its own DataManage, which shuffles the rows differently.
+    workers = [DataManage(frames, labels, _config(tmp_path)) for _ in range(world_size)]
+    assert not all((data.raw_frames == workers[0].raw_frames).all() for data in workers[1:])
+    for rank, data in enumerate(workers):
+        data.set_partition(rank, world_size, seed=7)
+    for _ in range(3):
+        parts = [_epoch_examples(data) for data in workers]
+        merged = np.concatenate(parts)
+        assert all(len(part) == 100 // world_size for part in parts)
+        assert len(np.unique(merged)) == len(merged)
+        for data in workers:
+            data.reset_batch_counter()
+
+
+def test_big_data_partition_keeps_its_seed(tmp_path):
+    data = DataManage4BigData(_config(tmp_path), 'train', seed=5)
+    _write(data, 200)
+    parts = []
+    for rank in range(2):
+        worker = DataManage4BigData(_config(tmp_path), 'train', seed=5)
+        worker.set_partition(rank, 2)
+        assert worker.seed == 5
+        # 3 of the 7 shards each.
+        assert worker.num_batches == 3
+        parts.append(_epoch_examples(worker))
+    assert len(np.intersect1d(parts[0], parts[1])) == 0
+
+
+def _sampler_epoch(sampler):
+    examples = []
+    for _ in range(sampler.num_batches):
+        frames, labels = sampler.next_batch
+        _check_pk_batch(frames, labels, 2, 2)
+        examples.append(frames[:, 0].astype(np.int64))
+    return np.concatenate(examples) if examples else np.zeros(0, dtype=np.int64)
+
+
+def test_speaker_balanced_sampler_partition_in_memory(tmp_path):
+    frames, labels = _examples(120)
+    workers = [DataManage(frames, labels, _config(tmp_path)) for _ in range(2)]
+    samplers = [SpeakerBalancedSampler(data, _config(tmp_path), n_speakers=2, n_utterances=2, seed=rank)
+                for rank, data in enumerate(workers)]
+    for rank, sampler in enumerate(samplers):
+        sampler.set_partition(rank, 2, seed=3)
+    for _ in range(3):
+        parts = [data.raw_frames[data.partition][:, 0].astype(np.int64) for data in workers]
+        assert len(np.intersect1d(parts[0], parts[1])) == 0
+        for sampler, part in zip(samplers, parts):
+            assert np.isin(_sampler_epoch(sampler), part).all()
+            sampler.reset_batch_counter()
+    # back to the whole dataset.
+    samplers[0].set_partition(0, 1)
+    assert set(_sampler_epoch(samplers[0]) % 10) == set(range(10))
+
+
+def test_speaker_balanced_sampler_partition_of_shards(tmp_path):
+    _write(DataManage4BigData(_config(tmp_path, batch_size=10), 'train'), 400)
+    workers = [DataManage4BigData(_config(tmp_path, batch_size=10), 'train') for _ in range(2)]
+    samplers = [SpeakerBalancedSampler(data, _config(tmp_path), n_speakers=2, n_utterances=2, seed=0, cache_size=4)
+                for data in workers]
+    for rank, sampler in enumerate(samplers):
+        sampler.set_partition(rank, 2, seed=3)
+    for _ in range(2):
+        parts = [np.concatenate([data._load_shard(name)[0][:, 0] for name in data.partition]).astype(np.int64)
+                 for data in workers]
+        assert len(np.intersect1d(parts[0], parts[1])) == 0
+        for sampler, part in zip(samplers, parts):
+            assert np.isin(_sampler_epoch(sampler), part).all()
+            sampler.reset_batch_counter()
+
+
+def _store(tmp_path, lengths):
+    """Utterances whose frames are ``[utterance, frame]``, of speaker ``utterance % 5``."""
+    samples = [(np.stack([np.full(length, i), np.arange(length)], 1), i % 5) for i, length in enumerate(lengths)]
+    return UtteranceStore.write(str(tmp_path / 'store'), samples)
+
+
+def _check_crops(frames, labels, store, length):
+    assert frames.shape[1:] == (length, 2)
+    utterances = frames[:, 0, 0].astype(np.int64)
+    # contiguous frames of one utterance, inside it.
+    assert (frames[:, :, 0] == utterances[:, None]).all()
+    assert (np.diff(frames[:, :, 1], axis=1) == 1).all()
+    assert (frames[:, -1, 1] < store.lengths[utterances]).all()
+    assert (np.argmax(labels, -1) == utterances % 5).all()
+
+
+def test_segment_sampler_crops(tmp_path):
+    store = _store(tmp_path, [30, 120, 250, 99, 400, 100])
+    config = _config(tmp_path, batch_size=16, n_speaker=5)
+    sampler = SegmentSampler(store, config, segment_length=100, seed=0)
+    assert sampler.num_batches == int(np.ceil(store.num_frames / 100.0 / 16))
+    for _ in range(5):
+        frames, labels = sampler.next_batch
+        _check_crops(frames, labels, store, 100)
+        # the utterances shorter than a crop are never drawn.
+        assert not np.isin(frames[:, 0, 0], [0, 3]).any()
+    frames, labels = SegmentSampler(store, config, crop_lengths=[50, 80], seed=0).next_batch
+    _check_crops(frames, labels, store, frames.shape[1])
+    assert frames.shape[1] in (50, 80)
+    with pytest.raises(ValueError):
+        SegmentSampler(store, config, segment_length=500)
+
+
+def test_segment_sampler_batch_at_is_deterministic(tmp_path):
+    store = _store(tmp_path, [120, 250, 400])
+    sampler = SegmentSampler(store, _config(tmp_path, batch_size=8, n_speaker=5), seed=1)
+    first = sampler.batch_at(3)
+    _check_crops(first[0], first[1], store, 100)
+    assert (sampler.batch_at(3)[0] == first[0]).all()
+    assert not (sampler.batch_at(4)[0] == first[0]).all()
+    sampler.reset_batch_counter()
+    assert not (sampler.batch_at(3)[0] == first[0]).all()
+
+
+def test_segment_sampler_partition(tmp_path):
+    store = _store(tmp_path, [120, 250, 400, 150, 300, 200])
+    samplers = [SegmentSampler(store, _config(tmp_path, batch_size=16, n_speaker=5), seed=rank) for rank in range(2)]
+    for rank, sampler in enumerate(samplers):
+        sampler.set_partition(rank, 2, seed=1)
+    for epoch in range(3):
+        parts = [partition_indices(6, rank, 2, seed=1, epoch=epoch) for rank in range(2)]
+        for sampler, part in zip(samplers, parts):
+            assert sampler.num_examples == int(store.lengths[part].sum() / 100)
+            for frames in (sampler.next_batch[0], sampler.batch_at(0)[0]):
+                assert np.isin(frames[:, 0, 0], part).all()
+            sampler.reset_batch_counter()
+
+
+def test_bucket_batcher(tmp_path):
+    lengths = np.random.RandomState(0).randint(10, 300, 50)
+    store = _store(tmp_path, lengths)
+    batcher = BucketBatcher(store, _config(tmp_path, batch_size=4, n_speaker=5), bucket_edges=[100, 200], seed=0)
+    for _ in range(2):
+        seen = []
+        for _ in range(batcher.epoch_size):
+            frames, labels, batch_lengths, mask = batcher.next_batch
+            utterances = frames[:, 0, 0].astype(np.int64)
+            assert (batch_lengths == lengths[utterances]).all()
+            assert frames.shape[1] == batch_lengths.max()
+            assert len(np.unique(np.searchsorted([100, 200], batch_lengths))) == 1
+            assert (mask.sum(1) == batch_lengths).all()
+            # the padding is zero.
+            assert (frames[mask == 0] == 0).all()
+            assert (np.argmax(labels, -1) == utterances % 5).all()
+            seen += utterances.tolist()
+        assert len(batcher.next_batch[0]) == 0
+        assert sorted(seen) == list(range(50))
+        batcher.reset_batch_counter()
+
+
+def test_bucket_batcher_partition(tmp_path):
+    store = _store(tmp_path, np.random.RandomState(0).randint(10, 300, 51))
+    batchers = [BucketBatcher(store, _config(tmp_path, batch_size=4, n_speaker=5), bucket_edges=[100], seed=rank)
+                for rank in range(2)]
+    for rank, batcher in enumerate(batchers):
+        batcher.set_partition(rank, 2, seed=2)
+    for epoch in range(2):
+        parts = []
+        for batcher in batchers:
+            seen = [batcher.next_batch[0][:, 0, 0] for _ in range(batcher.epoch_size)]
+            parts.append(np.concatenate(seen).astype(np.int64))
+            batcher.reset_batch_counter()
+        for rank, part in enumerate(parts):
+            assert sorted(part) == sorted(partition_indices(51, rank, 2, seed=2, epoch=epoch))
+
+
+def test_padding_report():
+    lengths = np.array([10, 10, 100, 100])
+    report = padding_report(lengths, [50], batch_size=4)
+    assert report['overhead'] == 0.0
+    assert report['buckets'] == [(50, 2, 20, 20), (None, 2, 200, 200)]
+    # one batch padded to 100 frames.
+    assert report['no_bucket_overhead'] == pytest.approx(1 - 220 / 400.0)
+    assert padding_report(lengths, [], batch_size=4)['overhead'] == pytest.approx(1 - 220 / 400.0)
@@ -0,0 +1,58 @@
+import socket
+import numpy as np
+import pytest
+
+pytest.importorskip("tensorflow")
+from pyasv import distributed
+
+
+def _free_ports(n):
+    sockets = [socket.socket(socket.AF_INET, socket.SOCK_STREAM) for _ in range(n)]
+    for sock in sockets:
+        sock.bind(('127.0.0.1', 0))
+    ports = [sock.getsockname()[1] for sock in sockets]
+    for sock in sockets:
+        sock.close()
+    return ports
+
+
+def _addresses(world_size):
+    return ['127.0.0.1:%d' % port for port in _free_ports(world_size)]
+
+
+def _worker_array(rank, size):
+    return np.random.RandomState(rank).randn(size).astype(np.float64)
+
+
+def _ring_worker(communicator, world_size):
+    rank = communicator.rank
+    # sizes smaller than, equal to and not a multiple of world_size.
+    for size in [1, world_size, 1001]:
+        reduced = communicator.allreduce(_worker_array(rank, size))
+        expected = sum(_worker_array(k, size) for k in range(world_size))
+        np.testing.assert_allclose(reduced, expected)
+    grid = communicator.allreduce(np.full((3, 4), rank, dtype=np.int64))
+    assert grid.shape == (3, 4)
+    assert (grid == sum(range(world_size))).all()
+    assert communicator.allreduce(np.array([rank + 5]), 'min')[0] == 5
+    assert communicator.allreduce(np.array([rank]), 'max')[0] == world_size - 1
+    for root in range(world_size):
+        array = communicator.broadcast(np.full(7, rank, dtype=np.int64), root=root)
+        assert (array == root).all()
+    communicator.barrier()
+
+
+def _failing_worker(communicator):
+    if communicator.rank == 1:
+        raise SystemExit(3)
+    communicator.barrier()
+
+
+@pytest.mark.parametrize('world_size', [2, 3])
+def test_ring_allreduce_and_broadcast(world_size):
+    distributed.launch(_ring_worker, world_size, (world_size,), addresses=_addresses(world_size))
+
+
+def test_launch_fails_with_a_worker():
+    with pytest.raises(RuntimeError):
+        distributed.launch(_failing_worker, 2, addresses=_addresses(2))
@@ -0,0 +1,132 @@
+import os
+import socket
+import numpy as np
+import pytest
+
+tf = pytest.importorskip("tensorflow")
+from pyasv.config import Config
+from pyasv.data_manage import DataManage, SpeakerBalancedSampler
+from pyasv.engine import Trainer, Hook
+
+
+class _Linear(object):
+    """A linear model, the first column of an example is its id and is not used."""
+    input_shape = (5,)
+    feature_dim = 4
+
+    def __init__(self, config, x, y):
+        weights = tf.get_variable('weights', [4, 4], initializer=tf.constant_initializer(np.eye(4)))
+        self.feature = tf.matmul(x[:, 1:], weights)
+        logits = tf.layers.dense(self.feature, config.N_SPEAKER)
+        self.loss = tf.reduce_mean(tf.nn.softmax_cross_entropy_with_logits_v2(labels=y, logits=logits))
+
+
+class _Summaries(Hook):
+    def __init__(self):
+        self.summaries = []
+        self.batch_sizes = []
+
+    def after_step(self, trainer, step, loss, features, labels):
+        self.batch_sizes.append(len(features))
+
+    def end_epoch(self, trainer, epoch, summary):
+        self.summaries.append(summary)
+
+
+class _Recorder(object):
+    """Write the ids of the examples read in each epoch to ``path % rank``."""
+    def __init__(self, data, path):
+        self._data = data
+        self.path = path
+        self.rank = 0
+        self.epoch = 0
+
+    @property
+    def num_batches(self):
+        return self._data.num_batches
+
+    def set_partition(self, rank, world_size, seed=None):
+        self.rank = rank
+        self._data.set_partition(rank, world_size, seed)
+
+    def reset_batch_counter(self):
+        self.epoch += 1
+        self._data.reset_batch_counter()
+
+    @property
+    def next_batch(self):
+        frames, labels = self._data.next_batch
+        with open(self.path % self.rank, 'a') as f:
+            f.write(' '.join('%d:%d' % (self.epoch, i) for i in frames[:, 0]) + '\n')
+        return frames, labels
+
+
+def _config(tmp_path, **kwargs):
+    return Config(name='linear', n_speaker=4, batch_size=8, n_gpu=0, max_step=2, learning_rate=0.01,
+                  save_path=str(tmp_path), **kwargs)
+
+
+def _data(config, n=96, seed=0):
+    """Examples of 4 speakers around the axes, after a column of ids."""
+    rng = np.random.RandomState(seed)
+    labels = np.arange(n) % 4
+    frames = np.eye(4)[labels] + 0.1 * rng.randn(n, 4)
+    return DataManage(np.concatenate([np.arange(n)[:, None], frames], 1), labels, config)
+
+
+def _free_addresses(n):
+    sockets = [socket.socket(socket.AF_INET, socket.SOCK_STREAM) for _ in range(n)]
+    for sock in sockets:
+        sock.bind(('127.0.0.1', 0))
+    addresses = ['127.0.0.1:%d' % sock.getsockname()[1] for sock in sockets]
+    for sock in sockets:
+        sock.close()
+    return addresses
+
+
+def _read_records(path):
+    epochs = {}
+    with open(path) as f:
+        for line in f:
+            for record in line.split():
+                epoch, example = record.split(':')
+                epochs.setdefault(int(epoch), set()).add(int(example))
+    return epochs
+
+
+def test_trainer_trains_a_sampler_and_validates(tmp_path):
+    config = _config(tmp_path)
+    train = SpeakerBalancedSampler(_data(config), config, n_speakers=4, n_utterances=2, seed=0)
+    hook = _Summaries()
+    Trainer(_Linear, config, [hook]).train(train, _data(config, n=32, seed=1))
+    assert [summary['epoch'] for summary in hook.summaries] == [0, 1]
+    assert all(summary['steps'] == train.num_batches for summary in hook.summaries)
+    # no batch is lost, every step has P x K examples.
+    assert hook.batch_sizes == [8] * (2 * train.num_batches)
+    assert hook.summaries[-1]['val_accuracy'] > 0.9
+    assert os.path.exists(os.path.join(str(tmp_path), 'linear.ckpt.index'))
+
+
+@pytest.mark.parametrize('sampler', [False, True])
+def test_data_parallel_workers_read_disjoint_examples(tmp_path, sampler):
+    config = _config(tmp_path, n_workers=2, worker_addresses=_free_addresses(2))
+    train = _data(config)
+    if sampler:
+        train = SpeakerBalancedSampler(train, config, n_speakers=2, n_utterances=2, seed=0)
+    path = str(tmp_path / 'rank%d.txt')
+    Trainer(_Linear, config).run(_Recorder(train, path), _data(config, n=32, seed=1))
+    records = [_read_records(path % rank) for rank in range(2)]
+    for epoch in range(2):
+        assert records[0][epoch] and records[1][epoch]
+        assert not records[0][epoch] & records[1][epoch]
+
+
+class _Communicator(object):
+    rank = 0
+    world_size = 2
+
+
+def test_data_parallel_training_needs_set_partition(tmp_path):
+    config = _config(tmp_path)
+    with pytest.raises(ValueError):
+        Trainer(_Linear, config).train(object(), _data(config), communicator=_Communicator())
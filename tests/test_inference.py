@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("tensorflow")
+from pyasv.inference import BaseEmbedder, SlidingWindowExtractor
+
+
+class _LinearEmbedder(BaseEmbedder):
+    """A linear map of the flattened input, enough to check the windowing."""
+    def __init__(self, frame_shape, dim, batch_size=16):
+        self.frame_shape = frame_shape
+        self.batch_size = batch_size
+        self.dim = dim
+        self._weights = np.random.RandomState(0).randn(int(np.prod(frame_shape)), dim).astype(np.float32)
+
+    def _run(self, batch):
+        assert len(batch) == self.batch_size
+        return batch.reshape(len(batch), -1).dot(self._weights)
+
+    def close(self):
+        pass
+
+
+def _reference(embedder, frames, window, hop, unit_hop):
+    length = embedder.frame_shape[0]
+    embeddings = []
+    for start in range(0, len(frames) - window + 1, hop):
+        units = [frames[s:s + length] for s in range(start, start + window - length + 1, unit_hop)]
+        embeddings.append(embedder.embed(np.stack(units)).mean(0))
+    return np.array(embeddings).reshape(-1, embedder.dim)
+
+
+@pytest.mark.parametrize('window, hop, unit_hop', [(20, 5, 1), (30, 10, 5), (9, 3, 3)])
+def test_streaming_matches_batch(window, hop, unit_hop):
+    embedder = _LinearEmbedder([9, 4], dim=3)
+    rng = np.random.RandomState(1)
+    recordings = [rng.randn(n, 4).astype(np.float32) for n in [5, 9, 57, 200]]
+    extractor = SlidingWindowExtractor(embedder, window, hop, unit_hop)
+    batch = extractor.extract(recordings)
+
+    streamed = {i: [] for i in range(len(recordings))}
+    positions = [0] * len(recordings)
+    while any(position < len(frames) for position, frames in zip(positions, recordings)):
+        for i, frames in enumerate(recordings):
+            chunk = rng.randint(1, 13)
+            extractor.push(i, frames[positions[i]:positions[i] + chunk])
+            positions[i] += chunk
+        for i, (starts, embeddings) in extractor.flush().items():
+            assert (starts == np.arange(len(streamed[i]), len(streamed[i]) + len(starts)) * hop).all()
+            streamed[i].extend(embeddings)
+
+    for i, frames in enumerate(recordings):
+        expected = _reference(embedder, frames, window, hop, unit_hop)
+        np.testing.assert_allclose(batch[i].reshape(-1, 3), expected, rtol=1e-4, atol=1e-4)
+        np.testing.assert_allclose(np.reshape(streamed[i], (-1, 3)), expected, rtol=1e-4, atol=1e-4)
+
+
+def test_window_shorter_than_a_unit():
+    with pytest.raises(ValueError):
+        SlidingWindowExtractor(_LinearEmbedder([9, 4], dim=3), window=5, hop=1)
+
+
+def test_extract_leaves_the_pushed_streams():
+    embedder = _LinearEmbedder([9, 4], dim=3)
+    rng = np.random.RandomState(2)
+    live = rng.randn(60, 4).astype(np.float32)
+    extractor = SlidingWindowExtractor(embedder, window=20, hop=5)
+    extractor.push('call', live[:30])
+    extractor.extract([rng.randn(40, 4).astype(np.float32)])
+    extractor.push('call', live[30:])
+    starts, embeddings = extractor.flush()['call']
+    assert (starts == np.arange(9) * 5).all()
+    np.testing.assert_allclose(embeddings, _reference(embedder, live, 20, 5, 1), rtol=1e-4, atol=1e-4)
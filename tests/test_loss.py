@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+tf = pytest.importorskip("tensorflow")
+from pyasv.loss import numpy_reference
+from pyasv.loss.triplet_loss import batch_all_triplet_loss, batch_all_triplet_loss_sorted, semi_hard_triplet_loss
+
+CASES = [(np.arange(12) % 3, 0.5), (np.arange(16) % 4, 0.2), (np.array([0, 0, 0, 1, 2, 2, 3, 3]), 1.0)]
+
+
+def _run(loss_fn, labels, embeddings, margin, squared):
+    with tf.Graph().as_default():
+        outputs = loss_fn(tf.constant(labels, dtype=tf.int32), tf.constant(embeddings, dtype=tf.float32),
+                          margin, squared=squared)
+        with tf.Session() as sess:
+            return sess.run(outputs)
+
+
+def _embeddings(n, seed=0):
+    return np.random.RandomState(seed).randn(n, 8).astype(np.float32)
+
+
+@pytest.mark.parametrize('squared', [False, True])
+@pytest.mark.parametrize('labels, margin', CASES)
+def test_batch_all_sorted_matches_reference(labels, margin, squared):
+    embeddings = _embeddings(len(labels))
+    loss, fraction = _run(batch_all_triplet_loss_sorted, labels, embeddings, margin, squared)
+    expected_loss, expected_fraction, _ = numpy_reference.batch_all_triplet_loss(labels, embeddings, margin, squared)
+    np.testing.assert_allclose(loss, expected_loss, rtol=1e-4, atol=1e-5)
+    np.testing.assert_allclose(fraction, expected_fraction, rtol=1e-4, atol=1e-5)
+    unsorted_loss, unsorted_fraction = _run(batch_all_triplet_loss, labels, embeddings, margin, squared)
+    np.testing.assert_allclose(loss, unsorted_loss, rtol=1e-4, atol=1e-5)
+    np.testing.assert_allclose(fraction, unsorted_fraction, rtol=1e-4, atol=1e-5)
+
+
+@pytest.mark.parametrize('squared', [False, True])
+@pytest.mark.parametrize('labels, margin', CASES + [(np.zeros(6, dtype=np.int64), 0.5)])
+def test_semi_hard_matches_reference(labels, margin, squared):
+    embeddings = _embeddings(len(labels), seed=1)
+    loss, fraction = _run(semi_hard_triplet_loss, labels, embeddings, margin, squared)
+    expected_loss, expected_fraction, _ = numpy_reference.semi_hard_triplet_loss(labels, embeddings, margin, squared)
+    np.testing.assert_allclose(loss, expected_loss, rtol=1e-4, atol=1e-5)
+    np.testing.assert_allclose(fraction, expected_fraction, rtol=1e-4, atol=1e-5)
@@ -0,0 +1,48 @@
+import os
+import numpy as np
+import pytest
+
+tf = pytest.importorskip("tensorflow")
+from pyasv.config import Config
+from pyasv.model.ctdnn import CTDnn
+from pyasv.model.deep_speaker import DeepSpeaker, DeepSpeakerEmbedder
+from pyasv.model.max_feature_map_dnn_model import MaxFeatureMapDnn
+
+
+def _deep_speaker_config(tmp_path, batch_size=4):
+    return Config(name='deepspeaker', n_speaker=3, batch_size=batch_size, n_gpu=0, max_step=1,
+                  learning_rate=0.01, save_path=str(tmp_path), conv_weight_decay=0.0, fc_weight_decay=0.0,
+                  bn_epsilon=1e-3, deep_speaker_out_channel=[4, 8])
+
+
+def _save_deep_speaker(config):
+    with tf.Graph().as_default():
+        tf.set_random_seed(0)
+        DeepSpeaker(config, tf.placeholder(tf.float32, [None, 100, 64, 1]))
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            tf.train.Saver().save(sess, os.path.join(config.SAVE_PATH, config.MODEL_NAME + '.ckpt'))
+
+
+def test_deep_speaker_embeddings_do_not_depend_on_the_batch(tmp_path):
+    config = _deep_speaker_config(tmp_path)
+    _save_deep_speaker(config)
+    examples = np.random.RandomState(0).rand(6, 100, 64, 1).astype(np.float32)
+    with DeepSpeakerEmbedder(config, batch_size=4) as embedder:
+        together = embedder.embed(examples)
+        # alone in a batch padded with zeros.
+        alone = np.concatenate([embedder.embed(example[None]) for example in examples])
+    np.testing.assert_allclose(np.linalg.norm(together, axis=1), 1, rtol=1e-5)
+    np.testing.assert_allclose(together, alone, rtol=1e-5, atol=1e-6)
+
+
+@pytest.mark.parametrize('model_class, output', [(CTDnn, 'output'), (MaxFeatureMapDnn, 'out')])
+def test_sampled_softmax_variable_names(tmp_path, model_class, output):
+    config = Config(name='sampled', n_speaker=20, batch_size=4, n_gpu=0, max_step=1, is_big_dataset=False,
+                    learning_rate=0.01, save_path=str(tmp_path), n_sampled=5)
+    with tf.Graph().as_default():
+        x = tf.placeholder(tf.float32, [None] + list(model_class.input_shape))
+        y = tf.placeholder(tf.float32, [None, 20])
+        model_class(config, x, y)
+        names = [v.op.name for v in tf.global_variables() if 'sampled' in v.op.name]
+    assert sorted(name.split('/')[-1] for name in names) == [output + '_sampled_b', output + '_sampled_w']
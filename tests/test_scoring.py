@@ -0,0 +1,98 @@
+import os
+import json
+import numpy as np
+import pytest
+
+from pyasv.backend.scoring import normalize, cosine_scores, iter_scores, select_top_k, top_k, best_match, \
+    ScoreWriter
+
+
+def _vectors(n, dim=8, seed=0):
+    return np.random.RandomState(seed).randn(n, dim).astype(np.float32)
+
+
+def _naive_cosine(features, centroids):
+    scores = np.zeros((len(features), len(centroids)))
+    for i, feature in enumerate(features):
+        for j, centroid in enumerate(centroids):
+            norm = np.linalg.norm(feature) * np.linalg.norm(centroid)
+            scores[i, j] = np.dot(feature, centroid) / norm if norm else 0.0
+    return scores
+
+
+def test_normalize_keeps_zero_rows():
+    vectors = np.array([[3.0, 4.0], [0.0, 0.0]])
+    np.testing.assert_allclose(normalize(vectors), [[0.6, 0.8], [0.0, 0.0]])
+
+
+def test_cosine_scores_and_chunks():
+    features, centroids = _vectors(50), _vectors(7, seed=1)
+    centroids[3] = 0
+    expected = _naive_cosine(features, centroids)
+    np.testing.assert_allclose(cosine_scores(features, centroids), expected, atol=1e-5)
+    chunks = list(iter_scores(features, centroids, chunk_size=16))
+    assert [start for start, _ in chunks] == [0, 16, 32, 48]
+    np.testing.assert_allclose(np.concatenate([scores for _, scores in chunks]), expected, atol=1e-5)
+
+
+@pytest.mark.parametrize('k', [1, 3, 10])
+def test_select_top_k(k):
+    scores = _vectors(20, dim=6)
+    exclude = np.array([False, True, False, False, True, False])
+    ids, top_scores = select_top_k(scores, k, exclude)
+    allowed = np.where(exclude, -np.inf, scores)
+    k = min(k, 6)
+    assert ids.shape == (20, k)
+    np.testing.assert_array_equal(ids[:, :min(k, 4)], np.argsort(-allowed, axis=1, kind='stable')[:, :min(k, 4)])
+    np.testing.assert_allclose(top_scores, np.take_along_axis(scores, ids, axis=1))
+
+
+def test_top_k_skips_speakers_never_seen():
+    features, centroids = _vectors(40), _vectors(5, seed=1)
+    centroids[2] = 0
+    ids, scores = top_k(features, centroids, k=2, chunk_size=7)
+    expected = _naive_cosine(features, centroids)
+    expected[:, 2] = -np.inf
+    np.testing.assert_array_equal(ids, np.argsort(-expected, axis=1)[:, :2])
+    best_ids, best_scores = best_match(features, centroids, chunk_size=7)
+    np.testing.assert_array_equal(best_ids, ids[:, 0])
+    np.testing.assert_allclose(best_scores, scores[:, 0])
+
+
+def _write_scores(path, output, k=2):
+    scores = _vectors(10, dim=4)
+    labels = np.argmax(scores, 1)
+    labels[:3] = (labels[:3] + 1) % 4
+    with ScoreWriter(str(path), 12, 4, output, k) as writer:
+        writer.write(scores[:6], labels[:6])
+        writer.write(scores[6:], labels[6:])
+    return scores, labels, writer.summary()
+
+
+@pytest.mark.parametrize('output', ['text', 'npy', 'topk'])
+def test_score_writer_outputs(tmp_path, output):
+    scores, labels, summary = _write_scores(tmp_path, output)
+    assert summary['num_vectors'] == 10 and summary['num_true'] == 7
+    assert summary['accuracy'] == pytest.approx(0.7)
+    second = np.argsort(-scores, axis=1)[:, 1]
+    assert summary['top_k_accuracy'] == pytest.approx((7 + np.sum(second[:3] == labels[:3])) / 10.0)
+    with open(os.path.join(str(tmp_path), 'summary.json')) as f:
+        assert json.load(f)['num_true'] == 7
+    if output == 'text':
+        with open(os.path.join(str(tmp_path), 'result.txt')) as f:
+            lines = f.read().splitlines()
+        assert lines[0].startswith('Acc:0.7000') and len(lines) == 11
+    elif output == 'npy':
+        np.testing.assert_allclose(np.load(os.path.join(str(tmp_path), 'scores.npy'))[:10], scores)
+        assert (np.load(os.path.join(str(tmp_path), 'labels.npy'))[:10] == labels).all()
+    else:
+        ids = np.load(os.path.join(str(tmp_path), 'topk_ids.npy'))[:10]
+        assert (ids == np.argsort(-scores, axis=1)[:, :2]).all()
+
+
+def test_score_writer_rejects_extra_vectors(tmp_path):
+    with ScoreWriter(str(tmp_path), 3, 4, 'npy') as writer:
+        with pytest.raises(ValueError):
+            writer.write(_vectors(4, dim=4), np.zeros(4))
+    with pytest.raises(ValueError):
+        ScoreWriter(str(tmp_path), 3, 4, 'csv')